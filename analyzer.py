@@ -0,0 +1,82 @@
+"""
+analyzer.py
+
+This analyzes messages held in memory, for use from other programs
+
+    analyzer = EmailAnalyzer()
+    result = analyzer.analyze_bytes(raw_message, name="queue id 4711")
+    print(result["risk_rating"], result["risk_grade"])
+
+Nothing is read from or written to disk: the message is parsed from the
+given bytes and the result (see analyze_email in report_generator.py) is
+returned as a dict. The keyword rules are compiled once, when the modules
+are imported, and each analyzer keeps one geolocation client, so create one
+analyzer and share it. An analyzer can be used from many threads at once.
+"""
+
+from eml_ingest import DEFAULT_LIMITS, parse_eml_bytes, parse_message
+from geolocator import GeolocationClient, skipped_location
+from report_generator import analyze_email
+
+"""
+EmailAnalyzer
+
+Analyzes raw messages. client is any geolocation client (GeolocationClient,
+OfflineGeolocator), by default an uncached GeolocationClient for ip-api.com.
+With geolocate False hops are not looked up at all, so no network is used, and
+they are reported without a location (never as foreign hops).
+limits overrides the message size limits (see DEFAULT_LIMITS in eml_ingest.py)
+"""
+class EmailAnalyzer:
+    def __init__(self, client=None, geolocate=True, limits=None):
+        # Only a client made here is closed with the analyzer
+        self.owns_client = geolocate and client is None
+        if self.owns_client:
+            client = GeolocationClient()
+        self.client = client if geolocate else None
+        self.limits = {**DEFAULT_LIMITS, **limits} if limits else None
+
+    """
+    analyze_bytes
+
+    Returns the result for a message given as bytes. name identifies the
+    message in the result's source
+    """
+    def analyze_bytes(self, data, name=None):
+        return self.analyze_parsed(parse_eml_bytes(data, self.limits), name)
+
+    """
+    analyze_message
+
+    Returns the result for an already parsed email.message.EmailMessage
+    """
+    def analyze_message(self, msg, name=None):
+        return self.analyze_parsed(parse_message(msg, self.limits), name)
+
+    """
+    analyze_parsed
+
+    Returns the result for a message parsed by parse_eml_bytes or parse_message
+    """
+    def analyze_parsed(self, email_data, name=None):
+        if self.client is None:
+            # Hops that were not looked up are reported without a location and never count as foreign
+            locations = [skipped_location(ip) for ip in email_data["hop_ips"]]
+        else:
+            locations = self.client.geolocate_ips(email_data["hop_ips"])
+        return analyze_email(email_data, locations, source={"name": name})
+
+    """
+    close
+
+    Stops the geolocation client if the analyzer created it
+    """
+    def close(self):
+        if self.owns_client:
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
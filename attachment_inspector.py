@@ -0,0 +1,169 @@
+"""
+attachment_inspector.py
+
+This works out attachment metadata without decoding whole payloads into memory
+
+The encoded text of an attachment is decoded in fixed-size chunks. Each chunk
+updates the size and SHA-256 and only the first few bytes are kept, to sniff
+the real file type from its magic bytes. Apart from the encoded text itself,
+memory stays at about one chunk, whatever the size of the attachment.
+Content that is not plain ASCII text, and base64 with padding before its end
+or characters outside the alphabet, is left to email to decode whole, so the
+SHA-256 is always that of the bytes email decodes.
+"""
+
+import binascii
+import hashlib
+
+CHUNK_SIZE = 64 * 1024
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+# Bytes kept from the start of the content for sniffing
+HEAD_SIZE = 512
+
+# (offset, magic bytes, mime) of file types recognised from their content.
+# Zip covers the OOXML/OpenDocument formats and jar, OLE the legacy Office formats and msi
+MAGIC_SIGNATURES = [
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"PK\x05\x06", "application/zip"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (0, b"MZ", "application/x-msdownload"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"Rar!\x1a\x07", "application/x-rar-compressed"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"BZh", "application/x-bzip2"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"{\\rtf", "application/rtf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"\x1aE\xdf\xa3", "video/x-matroska")
+]
+
+# Text based types recognised from how the (lowercased, stripped) content starts
+TEXT_SIGNATURES = [
+    (b"<!doctype html", "text/html"),
+    (b"<html", "text/html"),
+    (b"<?xml", "application/xml"),
+    (b"<svg", "image/svg+xml")
+]
+
+"""
+sniff_mime
+
+Returns the mime type recognised from the first bytes of a file's content,
+or None if it is not recognised
+"""
+def sniff_mime(head):
+    for offset, magic, mime in MAGIC_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mime
+    # RIFF containers say what they hold at offset 8
+    if head[:4] == b"RIFF":
+        return {b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo", b"WEBP": "image/webp"}.get(head[8:12])
+    if head[4:8] == b"ftyp":
+        return "video/quicktime" if head[8:10] == b"qt" else "video/mp4"
+
+    text_start = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    for prefix, mime in TEXT_SIGNATURES:
+        if text_start.startswith(prefix):
+            return mime
+    return None
+
+"""
+decoded_chunks
+
+Yields the decoded content of an ASCII payload (the encoded text of a
+non-multipart part), CHUNK_SIZE encoded characters at a time. Raises
+binascii.Error, before yielding anything wrong, if base64 content has
+characters outside the alphabet or padding before its end: decoded in pieces
+it would not come out as the bytes email decodes
+"""
+def decoded_chunks(encoded, encoding, chunk_size=CHUNK_SIZE):
+    if encoding == "base64":
+        padding = encoded.find("=")
+        if padding != -1 and encoded[padding:].translate(str.maketrans("", "", "= \t\r\n")):
+            raise binascii.Error("padding before the end of the base64 content")
+        carry = b""
+        for start in range(0, len(encoded), chunk_size):
+            chunk = carry + encoded[start:start + chunk_size].encode("ascii")
+            chunk = chunk.translate(None, b" \t\r\n")
+            if chunk.translate(None, BASE64_ALPHABET + b"="):
+                raise binascii.Error("characters outside the base64 alphabet")
+            usable = len(chunk) - len(chunk) % 4
+            carry = chunk[usable:]
+            if usable:
+                yield binascii.a2b_base64(chunk[:usable])
+        # Unpadded tail, decoded leniently like email does. A single character
+        # left over cannot be decoded, email then keeps the payload as it is
+        carry = carry.rstrip(b"=")
+        if len(carry) % 4 == 1:
+            raise binascii.Error("base64 content one character short")
+        if len(carry) % 4 > 1:
+            yield binascii.a2b_base64(carry + b"=" * (-len(carry) % 4))
+
+    elif encoding == "quoted-printable":
+        # Chunks end on a line break so no escape sequence is cut in half
+        start = 0
+        while start < len(encoded):
+            end = encoded.find("\n", start + chunk_size)
+            end = len(encoded) if end == -1 else end + 1
+            yield binascii.a2b_qp(encoded[start:end].encode("ascii"))
+            start = end
+
+    else:
+        # 7bit, 8bit and binary content is the payload itself
+        for start in range(0, len(encoded), chunk_size):
+            yield encoded[start:start + chunk_size].encode("ascii")
+
+"""
+inspect_attachment
+
+Returns the decoded size, SHA-256 and sniffed mime of an attachment part
+"""
+def inspect_attachment(part, chunk_size=CHUNK_SIZE):
+    # Attached messages and other nested multiparts have no payload of their own
+    if part.is_multipart():
+        return {"size": 0, "sha256": None, "sniffed_mime": None}
+
+    encoding = str(part.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+    encoded = part.get_payload()
+    # Only ASCII text is decoded in chunks, anything else (8bit content) is
+    # decoded by email so the bytes are exactly those of get_payload(decode=True)
+    if (encoding in ("base64", "quoted-printable", "7bit", "8bit", "binary")
+            and isinstance(encoded, str) and encoded.isascii()):
+        try:
+            return digest_chunks(decoded_chunks(encoded, encoding, chunk_size))
+        except binascii.Error:
+            pass
+
+    # Damaged base64, 8bit content or an unusual encoding (uuencode), let email decode it whole
+    payload = part.get_payload(decode=True) or b""
+    return digest_chunks([payload])
+
+"""
+digest_chunks
+
+Returns the size, SHA-256 and sniffed mime of content given as chunks of bytes
+"""
+def digest_chunks(chunks):
+    size = 0
+    sha256 = hashlib.sha256()
+    head = b""
+    for chunk in chunks:
+        size += len(chunk)
+        sha256.update(chunk)
+        if len(head) < HEAD_SIZE:
+            head += chunk[:HEAD_SIZE - len(head)]
+
+    if not size:
+        return {"size": 0, "sha256": None, "sniffed_mime": None}
+    return {"size": size, "sha256": sha256.hexdigest(), "sniffed_mime": sniff_mime(head)}
@@ -0,0 +1,704 @@
+"""
+benchmark.py
+
+Measures the per-message cost of the email analyzer
+
+Run with "python benchmark.py" to time the eml files in the ./emails folder
+and the individual components.
+
+Run with "python benchmark.py corpus" to generate a synthetic corpus (see
+synthetic_corpus.py) and time every stage of the analysis over it. Results
+are saved as JSON in ./benchmark_results and can be compared with an
+earlier run using "--compare FILE".
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from html.parser import HTMLParser
+import requests
+from eml_ingest import (extract_attachments, extract_body, extract_hop_ips, get_ip_classification,
+                        list_eml_files, parse_eml, parse_header)
+from geolocator import GeolocationClient, percentile, placeholder_location
+from geolocation_stub import start_stub_server
+from offline_geolocator import OfflineGeolocator, build_index
+from text_analyzer import (CREDENTIAL_LANGUAGE, FINANCIAL_LANGUAGE, LANGUAGE_CATEGORIES, URGENT_LANGUAGE,
+                           build_keyword_matcher)
+from attachment_inspector import inspect_attachment
+from hash_reputation import HashIndex
+from hash_reputation import build_index as build_hash_index
+from html_extractor import extract_html
+from main import finish_email, start_email
+from pipeline_metrics import MessageMetrics
+from url_analyzer import HostnameVerdicts, analyze_urls, has_suspicious_tld, is_raw_ip, is_very_long
+from report_generator import analyze_email
+from results_store import ResultsStore
+from synthetic_corpus import DEFAULT_SETTINGS, generate_corpus, random_url
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is not reported there
+    resource = None
+
+RESULTS_FOLDER = "benchmark_results"
+# Milliseconds "main.py scan" may take to scan one message, over starting a bare interpreter
+STARTUP_BUDGET_MS = 150
+# MB/s extract_html has to keep up on marketing style html
+HTML_MIN_MB_PER_SEC = 10
+# Stages timed by the pipeline (see pipeline_metrics.py), in the order they run
+STAGES = ["parse", "geolocation", "header", "urls", "keywords", "attachments", "scoring", "report"]
+
+"""
+measure
+
+Runs func over every eml file the given number of times and returns the
+average milliseconds per message and the peak traced memory in KiB
+"""
+def measure(func, eml_files, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for eml_file in eml_files:
+            func(eml_file)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    per_message_ms = elapsed * 1000 / (repeat * len(eml_files))
+    return per_message_ms, peak / 1024
+
+"""
+parse_separately
+
+The old ingestion path, each extractor parses the eml file on its own
+"""
+def parse_separately(eml_file):
+    header = parse_header(eml_file)
+    extract_body(eml_file)
+    extract_attachments(eml_file)
+    extract_hop_ips(header["Received"])
+
+"""
+bench_parsing
+
+Compares parsing every eml file once against parsing it once per extractor
+"""
+def bench_parsing(eml_files, repeat=50):
+    before_ms, before_kib = measure(parse_separately, eml_files, repeat)
+    after_ms, after_kib = measure(parse_eml, eml_files, repeat)
+
+    print(f"Parsing ({len(eml_files)} messages x {repeat} runs)")
+    print(f"  separate parses: {before_ms:.3f} ms/message, peak {before_kib:.1f} KiB")
+    print(f"  single parse:    {after_ms:.3f} ms/message, peak {after_kib:.1f} KiB")
+    print(f"  speedup:         {before_ms / after_ms:.2f}x")
+
+"""
+random_public_ips
+
+Returns count repeatable random public IPv4 addresses
+"""
+def random_public_ips(count, seed=1):
+    rng = random.Random(seed)
+    ips = []
+    while len(ips) < count:
+        ip = ".".join(str(rng.randint(1, 254)) for _ in range(4))
+        if get_ip_classification(ip) == "Public":
+            ips.append(ip)
+    return ips
+
+"""
+bench_geolocation
+
+Geolocates hop ips for a number of messages against the local stub service,
+once with one blocking request per ip and once with the batched client
+"""
+def bench_geolocation(messages=50, hops_per_message=8, delay=0.02):
+    stub = start_stub_server(delay=delay)
+    messages_ips = [random_public_ips(hops_per_message, seed) for seed in range(messages)]
+
+    # One request per hop, the way the geolocator used to work
+    start = time.perf_counter()
+    for ip_list in messages_ips:
+        for ip in ip_list:
+            requests.get(f"{stub.base_url}/json/{ip}", timeout=5).json()
+    serial_elapsed = time.perf_counter() - start
+
+    client = GeolocationClient(base_url=stub.base_url)
+    start = time.perf_counter()
+    pending = [client.lookup_async(ip_list) for ip_list in messages_ips]
+    for request in pending:
+        request.result()
+    client_elapsed = time.perf_counter() - start
+    client.close()
+    stub.shutdown()
+
+    stats = client.stats()
+    lookups = messages * hops_per_message
+    print(f"Geolocation ({messages} messages x {hops_per_message} hops, {delay * 1000:.0f} ms service delay)")
+    print(f"  one request per ip: {lookups / serial_elapsed:.1f} lookups/sec")
+    print(f"  batched client:     {lookups / client_elapsed:.1f} lookups/sec "
+          f"in {stats['batch_requests']} requests")
+    print(f"  request latency:    p50 {stats['latency_p50_ms']:.1f} ms, "
+          f"p90 {stats['latency_p90_ms']:.1f} ms, p99 {stats['latency_p99_ms']:.1f} ms")
+
+"""
+write_range_csv
+
+Writes a range CSV of ipv4_count /24 networks and ipv6_count /48 networks
+"""
+def write_range_csv(csv_path, ipv4_count, ipv6_count):
+    countries = ["United States", "Germany", "Russia", "Brazil", "China", "Nigeria"]
+    with open(csv_path, "w", encoding="utf-8") as csv_file:
+        csv_file.write("network,city,region,country\n")
+        for i in range(ipv4_count):
+            network = ipaddress.IPv4Address((1 << 24) + i * 256)
+            csv_file.write(f"{network}/24,City {i % 5000},Region {i % 50},{countries[i % len(countries)]}\n")
+        for i in range(ipv6_count):
+            network = ipaddress.IPv6Address((0x2001 << 112) + (i << 80))
+            csv_file.write(f"{network}/48,City {i % 5000},Region {i % 50},{countries[i % len(countries)]}\n")
+
+"""
+bench_offline_geolocation
+
+Builds an offline index with the given number of ranges and measures
+index load time and lookups per second
+"""
+def bench_offline_geolocation(ipv4_ranges=200000, ipv6_ranges=50000, lookups=200000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "ranges.csv")
+        index_path = os.path.join(temp_dir, "ranges.idx")
+        write_range_csv(csv_path, ipv4_ranges, ipv6_ranges)
+
+        start = time.perf_counter()
+        build_index(csv_path, index_path)
+        build_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        geolocator = OfflineGeolocator(index_path)
+        load_elapsed = time.perf_counter() - start
+
+        rng = random.Random(1)
+        ipv4_ips = [str(ipaddress.IPv4Address(rng.randrange(1 << 24, (1 << 24) + ipv4_ranges * 256)))
+                    for _ in range(lookups)]
+        ipv6_ips = [str(ipaddress.IPv6Address((0x2001 << 112) + (rng.randrange(ipv6_ranges) << 80) + 1))
+                    for _ in range(lookups)]
+
+        print(f"Offline geolocation ({ipv4_ranges} IPv4 ranges, {ipv6_ranges} IPv6 ranges, "
+              f"{os.path.getsize(index_path) / 1024 / 1024:.1f} MiB index)")
+        print(f"  build: {build_elapsed:.2f} s, load: {load_elapsed * 1000:.2f} ms")
+        for label, ips in (("IPv4", ipv4_ips), ("IPv6", ipv6_ips)):
+            start = time.perf_counter()
+            geolocator.geolocate_ips(ips)
+            elapsed = time.perf_counter() - start
+            print(f"  {label} lookups: {lookups / elapsed:.0f} lookups/sec")
+        geolocator.close()
+
+"""
+scan_per_phrase
+
+The old keyword scan, lowercases and searches the text once per phrase
+"""
+def scan_per_phrase(text, phrases_by_category):
+    found = {}
+    for category, phrases in phrases_by_category.items():
+        found[category] = [term for term in phrases if term in text.lower()]
+    return found
+
+"""
+bench_keywords
+
+Times the per-phrase scan against the single pass matcher on a body of
+body_kib KiB, with the built in phrases and with extra_phrases more
+"""
+def bench_keywords(body_kib=64, extra_phrases=2000, repeat=5):
+    rng = random.Random(1)
+    words = ["please", "review", "the", "attached", "document", "current", "meeting", "team",
+             "schedule", "notes", "project", "update", "thanks", "regards", "quarter", "report"]
+    # Roughly one built in phrase every few lines
+    phrases = sorted(URGENT_LANGUAGE | CREDENTIAL_LANGUAGE | FINANCIAL_LANGUAGE)
+    body = ""
+    while len(body) < body_kib * 1024:
+        line = [rng.choice(words) for _ in range(12)]
+        if rng.random() < 0.2:
+            line.append(rng.choice(phrases))
+        body += " ".join(line) + ".\n"
+
+    custom = {"custom": {f"custom phrase {i} {rng.choice(words)}" for i in range(extra_phrases)}}
+    print(f"Keyword scan ({body_kib} KiB body, {repeat} runs)")
+    for label, extra in (("built in phrases", None), (f"+{extra_phrases} phrases", custom)):
+        matcher = build_keyword_matcher(extra)
+        phrases_by_category = dict(LANGUAGE_CATEGORIES, **(extra or {}))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            scan_per_phrase(body, phrases_by_category)
+        per_phrase_ms = (time.perf_counter() - start) * 1000 / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            matcher.match_categories(body)
+        single_pass_ms = (time.perf_counter() - start) * 1000 / repeat
+        print(f"  {label}: per phrase {per_phrase_ms:.2f} ms, single pass {single_pass_ms:.2f} ms")
+
+"""
+bench_urls
+
+Times checking every URL with the separate checks against analyze_urls, on
+bodies that repeat links from a small pool like a campaign does
+"""
+def bench_urls(bodies=5000, urls_per_body=8, distinct_urls=300):
+    rng = random.Random(1)
+    pool = [random_url(rng) for _ in range(distinct_urls)]
+    url_lists = [[rng.choice(pool) for _ in range(urls_per_body)] for _ in range(bodies)]
+
+    start = time.perf_counter()
+    for urls in url_lists:
+        for url in urls:
+            is_raw_ip(url)
+            has_suspicious_tld(url)
+            is_very_long(url)
+    separate_ms = (time.perf_counter() - start) * 1000
+
+    verdicts = HostnameVerdicts()
+    start = time.perf_counter()
+    for urls in url_lists:
+        analyze_urls(urls, verdicts)
+    memoized_ms = (time.perf_counter() - start) * 1000
+    stats = verdicts.stats()
+    print(f"URL checks ({bodies} bodies x {urls_per_body} urls from {distinct_urls} distinct)")
+    print(f"  separate checks: {separate_ms:.0f} ms, analyze_urls: {memoized_ms:.0f} ms, "
+          f"hostname cache hit rate {stats['hit_rate']:.1%}")
+
+"""
+marketing_html
+
+Returns about size_mib MiB of html laid out like marketing mail: nested
+tables with long inline styles, a button link and an image per block
+"""
+def marketing_html(size_mib=4):
+    block = (
+        '<table role="presentation" border="0" cellpadding="0" cellspacing="0" width="100%" '
+        'style="max-width:600px;background-color:#ffffff;border-collapse:collapse"><tr>'
+        '<td align="left" valign="top" style="padding:24px 32px 8px 32px;font-family:Helvetica,Arial,'
+        'sans-serif;font-size:16px;line-height:24px;color:#222222">\n'
+        '<h2 style="margin:0 0 12px 0;font-size:22px;font-weight:bold">Deals picked for you this week</h2>\n'
+        '<p style="margin:0 0 16px 0">Save up to 40% on outdoor furniture &amp; grills. Offers end '
+        'Sunday at midnight. Members get free shipping on every order over $35.</p>\n'
+        '<a href="https://click.mail.example.com/ls/click?upn={n}&amp;utm_medium=email" target="_blank" '
+        'style="display:inline-block;padding:12px 24px;background-color:#0a66c2;color:#ffffff">Shop now</a>\n'
+        '<img src="https://cdn.example.com/images/{n}/hero.jpg" width="536" alt="Outdoor furniture" '
+        'style="display:block;width:100%;height:auto;border:0">\n</td></tr></table>\n')
+    blocks = []
+    size = 0
+    while size < size_mib * 1024 * 1024:
+        blocks.append(block.replace("{n}", str(len(blocks))))
+        size += len(blocks[-1])
+    return ("<html><head><style>td{padding:0}</style></head><body>" + "".join(blocks) +
+            '<a href="http://203.0.113.9/verify">www.paypal.com</a></body></html>')
+
+"""
+bench_html
+
+Times extract_html against html.parser on marketing style html. Returns
+the MB/s of extract_html
+"""
+def bench_html(size_mib=4, repeat=3):
+    html = marketing_html(size_mib)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser = HTMLParser()
+        parser.feed(html)
+        parser.close()
+    parser_s = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        extracted = extract_html(html)
+    extract_s = (time.perf_counter() - start) / repeat
+    size_mb = len(html) / 1e6
+    print(f"Html extraction ({size_mb:.1f} MB, {len(extracted['links'])} links, "
+          f"{len(extracted['mismatches'])} mismatches)")
+    print(f"  html.parser alone: {size_mb / parser_s:.1f} MB/s, extract_html: {size_mb / extract_s:.1f} MB/s")
+    return size_mb / extract_s
+
+"""
+bench_attachments
+
+Compares decoding a whole attachment to measure it against streaming it
+through inspect_attachment, for time and peak memory
+"""
+def bench_attachments(size_mib=16):
+    message = EmailMessage()
+    message.set_content("See attached.")
+    message.add_attachment(b"PK\x03\x04" + random.Random(1).randbytes(size_mib * 1024 * 1024),
+                           maintype="application", subtype="zip", filename="archive.zip")
+    message = BytesParser(policy = policy.default).parsebytes(message.as_bytes())
+    part = next(message.iter_attachments())
+
+    print(f"Attachment inspection ({size_mib} MiB base64 attachment)")
+    for label, func in (("decode whole", lambda: len(part.get_payload(decode=True))),
+                        ("streamed", lambda: inspect_attachment(part))):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {label}: {elapsed * 1000:.1f} ms, peak {peak / 1024 / 1024:.2f} MiB")
+
+"""
+bench_hash_index
+
+Builds a hash index from a feed of the given number of hashes and measures
+lookups of attachments that are not in it, and of ones that are
+"""
+def bench_hash_index(hashes=1000000, lookups=200000):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        feed_path = os.path.join(temp_dir, "feed.txt")
+        index_path = os.path.join(temp_dir, "hashes.idx")
+        known = [rng.randbytes(32).hex() for _ in range(hashes)]
+        with open(feed_path, "w", encoding="ascii") as feed_file:
+            feed_file.writelines(f"{sha256},malware\n" for sha256 in known)
+
+        start = time.perf_counter()
+        build_hash_index(feed_path, index_path)
+        build_elapsed = time.perf_counter() - start
+        index = HashIndex(index_path)
+
+        print(f"Hash index ({hashes} hashes, {os.path.getsize(index_path) / 1024 / 1024:.1f} MiB index)")
+        print(f"  build: {build_elapsed:.2f} s ({hashes / build_elapsed:.0f} hashes/sec)")
+        for label, sha256s in (("unknown", [rng.randbytes(32).hex() for _ in range(lookups)]),
+                               ("known", rng.sample(known, min(lookups, hashes)))):
+            start = time.perf_counter()
+            for sha256 in sha256s:
+                index.contains(sha256)
+            elapsed = time.perf_counter() - start
+            print(f"  {label} lookups: {elapsed / len(sha256s) * 1000000:.2f} us per lookup")
+        # Known hashes always get past the Bloom filter
+        print(f"  unknown hashes searched after passing the Bloom filter: "
+              f"{lookups - index.stats()['bloom_rejected']} of {lookups}")
+        index.close()
+
+"""
+bench_results_store
+
+Measures how many results per second a ResultsStore inserts, with the
+results of the eml files repeated to the given number of messages
+"""
+def bench_results_store(eml_files, messages=100000):
+    samples = []
+    for eml_file in eml_files:
+        email_data = parse_eml(eml_file)
+        samples.append(analyze_email(email_data, [placeholder_location(ip) for ip in email_data["hop_ips"]],
+                                     eml_file))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, "results.sqlite3")
+        start = time.perf_counter()
+        with ResultsStore(store_path) as store:
+            for number in range(messages):
+                store.add(samples[number % len(samples)])
+        elapsed = time.perf_counter() - start
+        print(f"Results store ({messages} messages, {os.path.getsize(store_path) / 1024 / 1024:.1f} MiB)")
+        print(f"  inserts: {messages / elapsed:.0f} messages/sec")
+
+"""
+median_run_ms
+
+Runs a command the given number of times (after one run to warm up the
+bytecode cache) and returns the median milliseconds it took
+"""
+def median_run_ms(command, runs):
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return sorted(elapsed)[len(elapsed) // 2]
+
+"""
+bench_startup
+
+Times "main.py scan" on one eml file, from starting the interpreter to the
+result being written, against the local stand-in geolocation service.
+Returns the milliseconds over starting a bare interpreter
+"""
+def bench_startup(eml_path, runs=15):
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    stub = start_stub_server()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        scan = [sys.executable, main_path, "scan", str(eml_path), "--format", "jsonl",
+                "--jsonl", os.path.join(temp_dir, "results.jsonl"), "--no-geo-cache", "--geo-url", stub.base_url]
+        interpreter_ms = median_run_ms([sys.executable, "-c", "pass"], runs)
+        help_ms = median_run_ms([sys.executable, main_path, "--help"], runs)
+        scan_ms = median_run_ms(scan, runs)
+    stub.shutdown()
+
+    print(f"Startup (median of {runs} runs)")
+    print(f"  python -c pass:  {interpreter_ms:.1f} ms")
+    print(f"  main.py --help:  {help_ms:.1f} ms")
+    print(f"  main.py scan {os.path.basename(eml_path)}: {scan_ms:.1f} ms "
+          f"({scan_ms - interpreter_ms:.1f} ms over the interpreter)")
+    return scan_ms - interpreter_ms
+
+"""
+peak_rss_mib
+
+Returns the peak resident memory of this process in MiB, or None if unknown
+"""
+def peak_rss_mib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+"""
+code_version
+
+Returns the git commit of the code being measured, or "unknown"
+"""
+def code_version():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+"""
+time_stages
+
+Runs one eml file through the pipeline of a serial scan (start_email and
+finish_email in main.py), adding the seconds of each stage, as recorded in
+its MessageMetrics, to timings
+"""
+def time_stages(eml_path, client, timings):
+    metrics = MessageMetrics()
+    result, error = finish_email(eml_path, start_email(eml_path, client, metrics), metrics)
+    if error:
+        raise RuntimeError(f"{eml_path}: {error}")
+    for stage in STAGES:
+        timings[stage].append(metrics.stages.get(stage, 0.0))
+
+"""
+bench_corpus
+
+Generates a synthetic corpus and times each stage over it.
+Returns the results as a dict
+"""
+def bench_corpus(messages, settings, seed=1, geo_delay=0.0):
+    timings = {stage: [] for stage in STAGES}
+    working_folder = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_bytes = 0
+        paths = generate_corpus(os.path.join(temp_dir, "corpus"), messages, seed, settings)
+        corpus_bytes = sum(path.stat().st_size for path in paths)
+
+        stub = start_stub_server(delay=geo_delay)
+        client = GeolocationClient(base_url=stub.base_url)
+        # Reports are written to ./reports, keep them out of the project
+        os.chdir(temp_dir)
+        try:
+            start = time.perf_counter()
+            for path in paths:
+                time_stages(path, client, timings)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(working_folder)
+            client.close()
+            stub.shutdown()
+
+    return {
+        "version": code_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "settings": dict(DEFAULT_SETTINGS, **settings, messages=messages, seed=seed,
+                         geo_delay=geo_delay),
+        "corpus_mib": corpus_bytes / 1024 / 1024,
+        "messages_per_sec": messages / elapsed,
+        "peak_rss_mib": peak_rss_mib(),
+        "stages": {
+            stage: {
+                "total_s": sum(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p90_ms": percentile(values, 90) * 1000,
+                "p99_ms": percentile(values, 99) * 1000
+            }
+            for stage, values in timings.items()
+        }
+    }
+
+"""
+print_corpus_results
+
+Prints corpus benchmark results, with the change from earlier results if given
+"""
+def print_corpus_results(results, earlier=None):
+    settings = results["settings"]
+    print(f"Corpus benchmark ({settings['messages']} messages, {results['corpus_mib']:.1f} MiB, "
+          f"version {results['version']})")
+    line = f"  {results['messages_per_sec']:.1f} messages/sec"
+    if earlier:
+        line += f" (was {earlier['messages_per_sec']:.1f}, version {earlier['version']})"
+    print(line)
+    if results["peak_rss_mib"] is not None:
+        print(f"  peak RSS {results['peak_rss_mib']:.1f} MiB")
+
+    print(f"  {'stage':<12} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    for stage, stats in results["stages"].items():
+        line = (f"  {stage:<12} {stats['p50_ms']:>9.3f} {stats['p90_ms']:>9.3f} "
+                f"{stats['p99_ms']:>9.3f} {stats['total_s']:>9.3f}")
+        if earlier and stage in earlier["stages"] and earlier["stages"][stage]["p50_ms"]:
+            change = stats["p50_ms"] / earlier["stages"][stage]["p50_ms"] - 1
+            line += f"  p50 {change:+.0%}"
+        print(line)
+
+"""
+save_results
+
+Writes results as JSON to path, or to a new file in RESULTS_FOLDER.
+Returns the path written
+"""
+def save_results(results, path=None):
+    if path is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        stamp = results["timestamp"].replace(":", "").replace("-", "")
+        path = os.path.join(RESULTS_FOLDER, f"{stamp}_{results['version']}.json")
+    with open(path, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    return path
+
+"""
+run_micro
+
+Runs the component benchmarks on the ./emails samples
+"""
+def run_micro(args):
+    eml_files = list_eml_files()
+    if not eml_files:
+        return
+    bench_parsing(eml_files, args.repeat)
+    bench_geolocation()
+    bench_offline_geolocation()
+    bench_keywords()
+    bench_urls()
+    bench_html()
+    bench_attachments()
+    bench_hash_index()
+    bench_results_store(eml_files)
+
+"""
+run_startup
+
+Runs the startup benchmark and exits with status 1 if scanning one message
+takes longer than the budget
+"""
+def run_startup(args):
+    eml_path = args.eml
+    if eml_path is None:
+        eml_files = list_eml_files()
+        if not eml_files:
+            return
+        eml_path = eml_files[0]
+    startup_ms = bench_startup(eml_path, args.runs)
+    if startup_ms > args.budget_ms:
+        print(f"  over the budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"  within the budget of {args.budget_ms:.0f} ms")
+
+"""
+run_html
+
+Runs the html extraction benchmark and exits with status 1 if extract_html is
+slower than the minimum throughput
+"""
+def run_html(args):
+    mb_per_sec = bench_html(args.size_mib, args.repeat)
+    if mb_per_sec < args.min_mb_per_sec:
+        print(f"  below the minimum of {args.min_mb_per_sec:.0f} MB/s")
+        sys.exit(1)
+    print(f"  above the minimum of {args.min_mb_per_sec:.0f} MB/s")
+
+"""
+run_corpus
+
+Runs the synthetic corpus benchmark and saves the results
+"""
+def run_corpus(args):
+    settings = {
+        "body_kib": args.body_kib,
+        "urls": args.urls,
+        "hops": args.hops,
+        "attachments": args.attachments,
+        "attachment_kib": args.attachment_kib,
+        "multipart_depth": args.multipart_depth,
+        "campaign_size": args.campaign_size
+    }
+    results = bench_corpus(args.messages, settings, args.seed, args.geo_delay)
+
+    earlier = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as earlier_file:
+            earlier = json.load(earlier_file)
+    print_corpus_results(results, earlier)
+    print(f"  saved to {save_results(results, args.save)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the email analyzer")
+    commands = parser.add_subparsers(dest="command")
+
+    micro = commands.add_parser("micro", help="component benchmarks on ./emails (default)")
+    micro.add_argument("repeat", nargs="?", type=int, default=50,
+                       help="times to parse each sample (default: 50)")
+
+    corpus = commands.add_parser("corpus", help="per-stage benchmark on a synthetic corpus")
+    corpus.add_argument("--messages", type=int, default=500)
+    corpus.add_argument("--seed", type=int, default=1)
+    for name, default in DEFAULT_SETTINGS.items():
+        corpus.add_argument("--" + name.replace("_", "-"), type=int, default=default)
+    corpus.add_argument("--geo-delay", type=float, default=0.0,
+                        help="seconds the stub geolocation service waits per request")
+    corpus.add_argument("--save", help="results file (default: a new file in benchmark_results)")
+    corpus.add_argument("--compare", help="earlier results file to compare against")
+
+    startup = commands.add_parser("startup", help="time main.py scanning one message, from a cold start")
+    startup.add_argument("eml", nargs="?", help="eml file to scan (default: the first in ./emails)")
+    startup.add_argument("--runs", type=int, default=15)
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                         help="milliseconds allowed over starting a bare interpreter, exits with "
+                              f"status 1 when over (default: {STARTUP_BUDGET_MS})")
+
+    html = commands.add_parser("html", help="html extraction throughput on marketing style html")
+    html.add_argument("--size-mib", type=int, default=4)
+    html.add_argument("--repeat", type=int, default=3)
+    html.add_argument("--min-mb-per-sec", type=float, default=HTML_MIN_MB_PER_SEC,
+                      help=f"exits with status 1 when slower (default: {HTML_MIN_MB_PER_SEC})")
+
+    # "python benchmark.py" and "python benchmark.py 20" still run the micro benchmarks
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("micro", "corpus", "startup", "html", "-h", "--help"):
+        argv = ["micro"] + argv
+    args = parser.parse_args(argv)
+    if args.command == "corpus":
+        run_corpus(args)
+    elif args.command == "startup":
+        run_startup(args)
+    elif args.command == "html":
+        run_html(args)
+    else:
+        run_micro(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+campaign_index.py
+
+This recognises the messages of a campaign so its content is analyzed once
+
+A campaign sends thousands of near-identical messages that differ only in
+recipient, greeting and tracking tokens. Every message gets a fingerprint
+taken from its raw body before any MIME parsing: a 64 bit SimHash of its
+text lines with digits and hex letters removed, which may differ in a few
+bits, and an exact key over the hostnames of its links and its encoded
+(base64) content, which has to match. The first message of a campaign is
+analyzed in full. Its body, URL and attachment findings are then
+reused for the rest of the campaign, whose messages only have their header
+parsed, so the sender checks and hops are still their own.
+
+SimHash fingerprints are found by splitting them into 4 bands of 16 bits:
+two fingerprints at most 3 bits apart agree on at least one band.
+"""
+
+import hashlib
+import heapq
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from defaults import DEFAULT_MAX_DISTANCE
+from eml_ingest import parse_eml_bytes, parse_eml_headers, split_header
+
+DEFAULT_MAX_CAMPAIGNS = 10000
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Bodies with fewer distinct lines are too short to fingerprint reliably
+MIN_LINES = 8
+# Most text lines hashed into the SimHash, those with the lowest CRC-32.
+# Near-identical bodies pick nearly the same lines, whatever their length
+SAMPLE_LINES = 256
+# Tracking tokens, ids and MIME boundaries are mostly made of these
+VARYING_CHARACTERS = b"0123456789abcdefABCDEF"
+# Lines of base64 (and similar encoded content) in a row
+ENCODED_RUN_PATTERN = re.compile(rb"((?:^[A-Za-z0-9+/]{40,}=*\r?\n)+)", re.MULTILINE)
+# Hostname of a link, in lowercased text
+LINK_HOST_PATTERN = re.compile(rb"""://([^/\s"'<>?#=]+)""")
+# For each bit of a byte, a translation table mapping a byte to 1 if it has the bit set
+BIT_TABLES = [bytes((value >> bit) & 1 for value in range(256)) for bit in range(8)]
+# Fields of a result that are reused for the rest of a campaign
+CONTENT_FIELDS = ["urls", "link_mismatches", "keywords", "attachments", "limits_exceeded"]
+
+"""
+simhash
+
+Returns the 64 bit SimHash of a set of lines: bit i is set if it is set in
+the hash of more than half of the lines
+"""
+def simhash(lines):
+    digests = b"".join(hashlib.blake2b(line, digest_size=8).digest() for line in lines)
+    half = len(lines) / 2
+    fingerprint = 0
+    for byte in range(8):
+        # Byte number byte of every hash, then the count of each of its bits
+        column = digests[byte::8]
+        for bit in range(8):
+            if column.translate(BIT_TABLES[bit]).count(1) > half:
+                fingerprint |= 1 << (byte * 8 + bit)
+    return fingerprint
+
+"""
+message_fingerprint
+
+Returns (exact key, SimHash) of a raw message, or None if its body has too
+little text to fingerprint. Runs of base64 lines (attachments, mostly) go
+into the exact key with the hostnames of the links, the SimHash is taken
+over the rest of the lines
+"""
+def message_fingerprint(data):
+    pieces = ENCODED_RUN_PATTERN.split(split_header(data)[1])
+    text = b"".join(pieces[0::2])
+    text_lines = set(text.translate(None, VARYING_CHARACTERS).splitlines())
+    text_lines.discard(b"")
+    if len(text_lines) < MIN_LINES:
+        return None
+    if len(text_lines) > SAMPLE_LINES:
+        text_lines = heapq.nsmallest(SAMPLE_LINES, text_lines, key=zlib.crc32)
+
+    exact_key = hashlib.blake2b(digest_size=8)
+    for host in sorted(set(LINK_HOST_PATTERN.findall(text.lower()))):
+        exact_key.update(host + b"\n")
+    for encoded in pieces[1::2]:
+        exact_key.update(encoded)
+    return exact_key.hexdigest(), simhash(text_lines)
+
+"""
+CampaignIndex
+
+The campaigns seen so far, at most max_campaigns of them (the least recently
+seen are forgotten). Messages at most max_distance bits (up to 3) from a
+campaign's first message belong to it. Safe to use from several threads
+"""
+class CampaignIndex:
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, max_campaigns=DEFAULT_MAX_CAMPAIGNS):
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.max_campaigns = max_campaigns
+        # Campaign id -> {"id", "exact_key", "fingerprint", "representative", "size", "content"}
+        self.campaigns = OrderedDict()
+        # (exact key, band number, band bits) -> ids of the campaigns with those bits
+        self.bands = {}
+        self.lock = threading.Lock()
+
+    """
+    band_keys
+
+    Returns the keys of the bands of a fingerprint
+    """
+    def band_keys(self, exact_key, fingerprint):
+        mask = (1 << BAND_BITS) - 1
+        return [(exact_key, band, (fingerprint >> (band * BAND_BITS)) & mask) for band in range(BANDS)]
+
+    """
+    find
+
+    Returns the closest campaign to a fingerprint, or None
+    """
+    def find(self, exact_key, fingerprint):
+        best = None
+        best_distance = self.max_distance + 1
+        for key in self.band_keys(exact_key, fingerprint):
+            for campaign_id in self.bands.get(key, ()):
+                campaign = self.campaigns[campaign_id]
+                distance = (campaign["fingerprint"] ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = campaign, distance
+        if best is not None:
+            self.campaigns.move_to_end(best["id"])
+        return best
+
+    """
+    add
+
+    Starts a campaign with the message name as its representative and returns it
+    """
+    def add(self, exact_key, fingerprint, name):
+        campaign_id = f"{exact_key[:4]}{fingerprint:016x}"
+        campaign = {"id": campaign_id, "exact_key": exact_key, "fingerprint": fingerprint,
+                    "representative": name, "size": 0, "content": None}
+        self.campaigns[campaign_id] = campaign
+        for key in self.band_keys(exact_key, fingerprint):
+            self.bands.setdefault(key, set()).add(campaign_id)
+
+        if len(self.campaigns) > self.max_campaigns:
+            _, oldest = self.campaigns.popitem(last=False)
+            for key in self.band_keys(oldest["exact_key"], oldest["fingerprint"]):
+                self.bands[key].discard(oldest["id"])
+                if not self.bands[key]:
+                    del self.bands[key]
+        return campaign
+
+    """
+    parse
+
+    Parses a raw message like parse_eml_bytes. A message of a known campaign
+    only has its header parsed: the campaign's findings are handed on as the
+    email data's content, or, while the campaign's first message is still
+    being analyzed, the raw message is kept for complete. The email data's
+    campaign says {"id", "representative", "reused"}
+    """
+    def parse(self, data, name):
+        key = message_fingerprint(data)
+        if key is None:
+            return parse_eml_bytes(data)
+        with self.lock:
+            campaign = self.find(*key)
+            known = campaign is not None
+            if not known:
+                campaign = self.add(*key, name)
+            campaign["size"] += 1
+            content = campaign["content"]
+
+        if known:
+            email_data = parse_eml_headers(data)
+            if content is not None:
+                email_data["content"] = content
+            else:
+                email_data["raw"] = data
+        else:
+            email_data = parse_eml_bytes(data)
+        email_data["campaign"] = {"id": campaign["id"], "representative": campaign["representative"],
+                                  "reused": content is not None}
+        return email_data
+
+    """
+    complete
+
+    Returns the email data of a message parsed while its campaign's first
+    message was being analyzed, with the campaign's findings as its content.
+    If there are none (the first message failed) the message is parsed in full
+    """
+    def complete(self, email_data):
+        if "raw" not in email_data:
+            return email_data
+        with self.lock:
+            campaign = self.campaigns.get(email_data["campaign"]["id"])
+            content = campaign["content"] if campaign is not None else None
+        if content is None:
+            completed = parse_eml_bytes(email_data["raw"])
+        else:
+            completed = dict(email_data, content=content)
+            del completed["raw"]
+        completed["campaign"] = dict(email_data["campaign"], reused=content is not None)
+        return completed
+
+    """
+    remember
+
+    Keeps the findings of a fully analyzed message for the rest of its
+    campaign. Findings of a message whose checks stopped early (triage) are
+    incomplete and not kept
+    """
+    def remember(self, email_data, result):
+        if "campaign" not in email_data or email_data["campaign"]["reused"] or result["skipped_stages"]:
+            return
+        with self.lock:
+            campaign = self.campaigns.get(email_data["campaign"]["id"])
+            if campaign is not None and campaign["content"] is None:
+                campaign["content"] = {field: result[field] for field in CONTENT_FIELDS}
+
+_default_index = None
+
+"""
+configure_campaigns
+
+Turns campaign recognition on (with the given maximum distance) or off for
+this process
+"""
+def configure_campaigns(enabled, max_distance=DEFAULT_MAX_DISTANCE):
+    global _default_index
+    _default_index = CampaignIndex(max_distance) if enabled else None
+
+"""
+get_campaign_index
+
+Returns the campaign index of this process, or None when campaigns are off
+"""
+def get_campaign_index():
+    return _default_index
+
+"""
+summarize_campaigns
+
+Returns the campaigns of a run from the campaign of each result as a list of
+{"id", "representative", "size", "reused"}, largest first. Results are
+counted here because worker processes keep their own index
+"""
+def summarize_campaigns(campaigns):
+    summary = {}
+    for campaign in campaigns:
+        entry = summary.setdefault(campaign["id"], {"id": campaign["id"],
+                                                    "representative": campaign["representative"],
+                                                    "size": 0, "reused": 0})
+        entry["size"] += 1
+        entry["reused"] += campaign["reused"]
+    return sorted(summary.values(), key=lambda entry: entry["size"], reverse=True)
@@ -0,0 +1,26 @@
+"""
+defaults.py
+
+Default paths and settings of the optional stages
+
+main.py reads its option defaults from here, so showing or using them does
+not import the modules behind those options. Each module still exposes the
+defaults it uses under the same name
+"""
+
+import os
+
+# Geolocation (geolocator.py, geolocation_cache.py)
+IP_API_URL = "http://ip-api.com"
+DEFAULT_CACHE_PATH = "geo_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 100000
+# Campaign detection (campaign_index.py)
+DEFAULT_MAX_DISTANCE = 3
+# Incremental scans (manifest.py)
+DEFAULT_MANIFEST_PATH = os.path.join("reports", "manifest.json")
+# Stage timings (pipeline_metrics.py)
+DEFAULT_METRICS_PATH = os.path.join("reports", "metrics.json")
+# Watched folders (watcher.py)
+DEFAULT_POLL_INTERVAL = 0.2
+# Results database (results_store.py)
+DEFAULT_STORE_PATH = os.path.join("reports", "results.sqlite3")
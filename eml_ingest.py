@@ -8,10 +8,126 @@ Processes eml files in the ./emails folder
 
 from pathlib import Path
 from email import policy
+from email.message import EmailMessage
+from email.feedparser import BytesFeedParser
 from email.parser import BytesParser
 import re
 import ipaddress
 import os
+from functools import lru_cache
+from attachment_inspector import inspect_attachment
+from html_extractor import extract_html
+from received_parser import chain_ips, parse_received_chain
+
+# Limits on what is read and analyzed of one message, so a huge or
+# pathological message costs bounded memory and time
+DEFAULT_LIMITS = {
+    "max_message_bytes": 25 * 1024 * 1024,
+    "max_parts": 1000,
+    "max_depth": 20,
+    "max_body_chars": 2 * 1024 * 1024,
+    "max_attachments": 100
+}
+# Charset a text body is decoded with when its own is unknown
+FALLBACK_CHARSET = "utf-8"
+# Bytes handed to the parser at a time
+FEED_SIZE = 64 * 1024
+# Most ips whose classification is remembered, relays recur across messages
+IP_CLASSIFICATION_CACHE_SIZE = 65536
+
+_limits = dict(DEFAULT_LIMITS)
+
+"""
+configure_limits
+
+Sets the limits (see DEFAULT_LIMITS) used by every parse in this process.
+Limits not given keep their default
+"""
+def configure_limits(limits):
+    global _limits
+    _limits = {**DEFAULT_LIMITS, **(limits or {})}
+
+"""
+get_limits
+
+Returns the limits used by this process
+"""
+def get_limits():
+    return _limits
+
+"""
+PartLimitExceeded
+
+Raised by LimitedParser when a message has too many parts or nests them too
+deeply. The message is the name of the limit
+"""
+class PartLimitExceeded(Exception):
+    pass
+
+"""
+LimitedParser
+
+Parses a message fed to it in chunks (see email.feedparser), counting the
+parts and their nesting depth as they are created. Parsing stops with
+PartLimitExceeded before a part past max_parts or max_depth is created, root
+is then the message as far as it was parsed. This hooks the feed parser's
+private _new_message (tests/test_eml_ingest.py fails if that changes);
+limited_walk enforces the same limits on the parsed message regardless
+"""
+class LimitedParser(BytesFeedParser):
+    def __init__(self, limits):
+        super().__init__(policy=policy.default)
+        self.limits = limits
+        self.parts = 0
+        self.root = None
+
+    """
+    _new_message
+
+    Counts each part before the feed parser creates it
+    """
+    def _new_message(self):
+        # The new part goes on top of the stack of open parts
+        if len(self._msgstack) > self.limits["max_depth"]:
+            raise PartLimitExceeded("depth")
+        if self.parts == self.limits["max_parts"]:
+            raise PartLimitExceeded("parts")
+        self.parts += 1
+        super()._new_message()
+        if self.root is None:
+            self.root = self._cur
+
+"""
+parse_limited
+
+Parses a message from a binary file or a bytes-like object, reading at most
+max_message_bytes and stopping at the first part past the part limits.
+Returns (message, names of the limits exceeded)
+"""
+def parse_limited(source, limits):
+    parser = LimitedParser(limits)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        chunks = (view[start:start + FEED_SIZE] for start in range(0, len(view), FEED_SIZE))
+    else:
+        chunks = iter(lambda: source.read(FEED_SIZE), b"")
+
+    exceeded = []
+    size = 0
+    try:
+        for chunk in chunks:
+            room = limits["max_message_bytes"] - size
+            if len(chunk) > room:
+                # Nothing past the limit is read
+                parser.feed(bytes(chunk[:room]))
+                exceeded.append("message_bytes")
+                break
+            parser.feed(bytes(chunk))
+            size += len(chunk)
+        return parser.close(), exceeded
+    except PartLimitExceeded as e:
+        exceeded.append(str(e))
+        return parser.root, exceeded
 
 """
 list_eml_files
@@ -26,14 +142,157 @@ def list_eml_files():
     # Return eml files only
     return sorted(email_folder.glob("*.eml"))
 
+"""
+load_eml
+
+Returns the parsed message object of the supplied eml file, read up to the
+part and size limits (see parse_limited)
+"""
+def load_eml(eml_path):
+    with open(eml_path, "rb") as binary_email:
+        return parse_limited(binary_email, _limits)[0]
+
+"""
+as_message
+
+Returns the supplied message unchanged if it is already parsed,
+otherwise parses the eml file it points to
+"""
+def as_message(eml):
+    if isinstance(eml, EmailMessage):
+        return eml
+    return load_eml(eml)
+
+"""
+parse_eml
+
+Parses the supplied eml file once and returns a structure holding everything
+the analyzers need (header, body, attachments and hop ips)
+"""
+def parse_eml(eml_path, limits=None):
+    limits = limits or _limits
+    with open(eml_path, "rb") as binary_email:
+        msg, exceeded = parse_limited(binary_email, limits)
+    return parse_message(msg, limits, exceeded)
+
+"""
+parse_eml_bytes
+
+Same as parse_eml for a message that is already in memory. With
+attachments False they are left for load_attachments
+"""
+def parse_eml_bytes(data, limits=None, attachments=True):
+    limits = limits or _limits
+    msg, exceeded = parse_limited(data, limits)
+    return parse_message(msg, limits, exceeded, attachments)
+
+"""
+split_header
+
+Returns the header and the body of a raw message as two bytes objects
+"""
+def split_header(data):
+    ends = [(end, len(separator)) for separator in (b"\r\n\r\n", b"\n\n")
+            for end in [data.find(separator)] if end != -1]
+    if not ends:
+        return data, b""
+    end, separator_length = min(ends)
+    return data[:end + separator_length], data[end + separator_length:]
+
+"""
+parse_eml_headers
+
+Returns only the header, Received chain and hop ips of a raw message,
+without parsing its body
+"""
+def parse_eml_headers(data):
+    msg = BytesParser(policy = policy.default).parsebytes(split_header(data)[0], headersonly=True)
+    header = parse_header(msg)
+    received = parse_received_chain(header["Received"])
+    return {"header": header, "received": received, "hop_ips": chain_ips(received)}
+
+"""
+parse_message
+
+Returns the structure described in parse_eml for a parsed message. Parts
+past the part limits are skipped, the body and attachments are cut at their
+limits, and every limit that was exceeded, including those in exceeded, is
+listed in limits_exceeded. With attachments False, attachments is None
+until load_attachments decodes them
+"""
+def parse_message(msg, limits=None, exceeded=(), attachments=True):
+    limits = limits or _limits
+    exceeded = list(exceeded)
+    header = parse_header(msg)
+    parts = list(limited_walk(msg, limits, exceeded))
+    content = extract_content(msg, limits, exceeded, parts)
+    received = parse_received_chain(header["Received"])
+    email_data = {
+        "header": header,
+        "body": content["body"],
+        "html_links": content["links"],
+        "link_mismatches": content["mismatches"],
+        "attachments": extract_attachments(msg, limits, exceeded, parts) if attachments else None,
+        "received": received,
+        "hop_ips": chain_ips(received),
+        "limits_exceeded": exceeded
+    }
+    if not attachments:
+        email_data["deferred"] = {"message": msg, "limits": limits, "parts": parts}
+    return email_data
+
+"""
+load_attachments
+
+Returns the attachments of parsed email data, decoding them first if
+parsing left them for later
+"""
+def load_attachments(email_data):
+    if email_data["attachments"] is None:
+        deferred = email_data.pop("deferred")
+        email_data["attachments"] = extract_attachments(deferred["message"], deferred["limits"],
+                                                        email_data["limits_exceeded"], deferred["parts"])
+    return email_data["attachments"]
+
+"""
+limited_walk
+
+Yields the parts of a message like msg.walk(), but at most max_parts of them
+and none nested deeper than max_depth. The limits hit are added to exceeded
+"""
+def limited_walk(msg, limits, exceeded):
+    count = 0
+    stack = [(msg, 0)]
+    while stack:
+        part, depth = stack.pop()
+        if depth > limits["max_depth"]:
+            note_exceeded(exceeded, "depth")
+            continue
+        count += 1
+        if count > limits["max_parts"]:
+            note_exceeded(exceeded, "parts")
+            return
+        yield part
+        if part.is_multipart():
+            stack.extend((child, depth + 1) for child in reversed(part.get_payload()))
+
+"""
+note_exceeded
+
+Adds a limit to the list of exceeded limits, once
+"""
+def note_exceeded(exceeded, limit):
+    if limit not in exceeded:
+        exceeded.append(limit)
+
 """
 parse_header
 
 Returns a header structure containing some fields from the eml header
+Accepts either a parsed message or a path to an eml file
 """
-def parse_header(eml_path):
-    with open(eml_path, "rb") as binary_email:
-        structured_email = BytesParser(policy = policy.default).parse(binary_email)
+def parse_header(eml):
+    structured_email = as_message(eml)
 
     # Gather info from header into a structure
     header = {
@@ -42,7 +301,8 @@ def parse_header(eml_path):
          "Reply-To": structured_email.get("Reply-To", "N/A"),
          "Subject": structured_email.get("Subject", "N/A"),
          "Date": structured_email.get("Date", "N/A"),
-         "Received": structured_email.get_all("Received", [])
+         # Only scanned for ips, so read as is instead of through the header parser
+         "Received": [value for name, value in structured_email.raw_items() if name.lower() == "received"]
     }
     return header
 
@@ -50,58 +310,121 @@ def parse_header(eml_path):
 extract_body
 
 Returns the extracted body of the supplied eml file
+Accepts either a parsed message or a path to an eml file
 """
-def extract_body(eml_path):
-    with open(eml_path, "rb") as binary_email:
-        msg = BytesParser(policy = policy.default).parse(binary_email)
+def extract_body(eml):
+    return extract_content(eml)["body"]
+
+"""
+extract_content
+
+Returns the body of the supplied eml file with the links found in its html as
+{"body", "links", "mismatches"}. An html body is reduced to its visible text
+(see html_extractor.py), a plain text body has no links or mismatches.
+The body is cut at max_body_chars, adding "body_chars" to exceeded, see
+part_text for bodies that are not text or have an unknown charset
+Accepts either a parsed message or a path to an eml file
+"""
+def extract_content(eml, limits=None, exceeded=None, parts=None):
+    msg = as_message(eml)
+    limits = limits or _limits
+    exceeded = [] if exceeded is None else exceeded
+    if parts is None:
+        parts = limited_walk(msg, limits, exceeded)
 
     # Multipart email logic
     if msg.is_multipart():
         plain_parts = []
         html_parts = []
-        for part in msg.walk():
+        for part in parts:
             # Skip attachments
             if part.get_content_disposition() == "attachment":
                 continue
 
             # Extract text/plain
             if part.get_content_type() == "text/plain":
-                plain_parts.append(part.get_content())
+                plain_parts.append(part_text(part, exceeded))
             # Html fallback only if no plain text exists
             elif part.get_content_type() == "text/html":
-                html_parts.append(part.get_content())
+                html_parts.append(part_text(part, exceeded))
 
         # Join all the text pieces together and return
         # Prefer to return plain text, if not exist then return html
         if plain_parts:
-            return "\n".join(plain_parts).strip()
+            return text_content(limit_body("\n".join(plain_parts), limits, exceeded))
         if html_parts:
-            return "\n".join(html_parts).strip()
-        return "--- Failed to extract body contents ---"
+            return html_content(limit_body("\n".join(html_parts), limits, exceeded))
+        return text_content("--- Failed to extract body contents ---")
 
     # Single part email logic
+    elif msg.get_content_type() == "text/html":
+        return html_content(limit_body(part_text(msg, exceeded), limits, exceeded))
     else:
-        return msg.get_content().strip()
+        return text_content(limit_body(part_text(msg, exceeded), limits, exceeded))
+
+"""
+part_text
+
+Returns the decoded text of a body part. A part that is not text (e.g. a
+single part application/pdf message) is skipped, adding "body_type" to
+exceeded, and one with an unknown charset is decoded as FALLBACK_CHARSET
+with replacement characters, adding "body_charset"
+"""
+def part_text(part, exceeded):
+    if part.get_content_maintype() != "text":
+        note_exceeded(exceeded, "body_type")
+        return ""
+    try:
+        return part.get_content()
+    except LookupError:
+        note_exceeded(exceeded, "body_charset")
+        return (part.get_payload(decode=True) or b"").decode(FALLBACK_CHARSET, "replace")
+
+"""
+limit_body
+
+Returns the body cut to max_body_chars
+"""
+def limit_body(body, limits, exceeded):
+    if len(body) > limits["max_body_chars"]:
+        note_exceeded(exceeded, "body_chars")
+        return body[:limits["max_body_chars"]]
+    return body
+
+"""
+text_content
+
+Returns the content structure of extract_content for a plain text body
+"""
+def text_content(text):
+    return {"body": text.strip(), "links": [], "mismatches": []}
+
+"""
+html_content
+
+Returns the content structure of extract_content for an html body
+"""
+def html_content(html):
+    extracted = extract_html(html)
+    return {"body": extracted["text"], "links": extracted["links"], "mismatches": extracted["mismatches"]}
 
 """
 extract_hop_ips
 
-Returns a list of all ips from the Received section of the header
+Returns a list of all ips (IPv4 and IPv6) from the Received section of the
+header, see received_parser.py
 """
 def extract_hop_ips(received_list):
-    ips = []
-    for hop in received_list:
-          # re matches IPv4
-          ip_match = re.findall(r'\[(\d{1,3}(?:\.\d{1,3}){3})\]', hop)
-          ips.extend(ip_match)
-    return ips
+    return chain_ips(parse_received_chain(received_list))
 
 
 """
 get_ip_classification
 
-Returns IP type of given IP (Loopback, private, public, invalid)
+Returns IP type of given IP (Loopback, private, public, invalid). The same
+relays turn up in message after message, so answers are remembered
 """
+@lru_cache(maxsize=IP_CLASSIFICATION_CACHE_SIZE)
 def get_ip_classification(ip):
      try:
           ipaddress_object = ipaddress.ip_address(ip)
@@ -131,14 +454,19 @@ def extract_urls(text):
 """
 extract_attachments
 
-Returns the attachments of the supplied eml file
+Returns the attachments of the supplied eml file, at most max_attachments
+of them ("attachments" is added to exceeded if there were more)
+Accepts either a parsed message or a path to an eml file
 """
-def extract_attachments(eml_path):
+def extract_attachments(eml, limits=None, exceeded=None, parts=None):
      attachments = []
-     with open(eml_path, "rb") as binary_email:
-        msg = BytesParser(policy = policy.default).parse(binary_email)
+     msg = as_message(eml)
+     limits = limits or _limits
+     exceeded = [] if exceeded is None else exceeded
+     if parts is None:
+          parts = limited_walk(msg, limits, exceeded)
 
-     for part in msg.walk():
+     for part in parts:
           # get attachments
           if part.get_content_disposition() == "attachment":
                filename = part.get_filename()
@@ -147,18 +475,24 @@ def extract_attachments(eml_path):
                if not filename:
                     continue
 
-               # Grab extension, mime, payload and size
+               if len(attachments) == limits["max_attachments"]:
+                    note_exceeded(exceeded, "attachments")
+                    break
+
+               # Grab extension and mime, then size, hash and real file type
+               # from the content, decoded a chunk at a time
                extension = os.path.splitext(filename)[1].lower()
                mime = part.get_content_type()
-               payload = part.get_payload(decode=True)
-               size = len(payload) if payload else 0
+               content = inspect_attachment(part)
 
                # Create a structure representing the attachment's data
                attachments.append({
                     "filename": filename,
                     "extension": extension,
                     "mime": mime,
-                    "size": size
+                    "size": content["size"],
+                    "sha256": content["sha256"],
+                    "sniffed_mime": content["sniffed_mime"]
                })
                
      return attachments
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+geolocation_cache.py
+
+This keeps geolocation results on disk between runs
+
+Uses a SQLite file keyed by ip. Entries expire after a TTL, failed lookups
+are cached for a shorter time and the least recently used entries are
+evicted once the cache holds more than max_entries ips.
+"""
+
+import sqlite3
+import threading
+import time
+from defaults import DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES
+
+DEFAULT_TTL = 30 * 24 * 3600            # 30 days
+DEFAULT_NEGATIVE_TTL = 24 * 3600        # 1 day
+
+"""
+GeolocationCache
+
+Persistent ip -> location cache shared by every run (and every worker process)
+"""
+class GeolocationCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.touched = {}       # ip -> last use time not yet written to disk
+
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets several worker processes read while one writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            "ip TEXT PRIMARY KEY, city TEXT, region TEXT, country TEXT, "
+            "found INTEGER, expires REAL, last_used REAL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS locations_last_used ON locations (last_used)")
+        self.connection.commit()
+
+    """
+    get
+
+    Returns the cached location for an ip, or None if it is missing or expired
+    """
+    def get(self, ip):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT city, region, country, expires FROM locations WHERE ip = ?",
+                (ip,)).fetchone()
+            if row is None or row[3] < now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touched[ip] = now
+        return {"ip": ip, "city": row[0], "region": row[1], "country": row[2]}
+
+    """
+    put_many
+
+    Stores a list of (location, found) pairs. Lookups that did not find
+    anything (found is False) are kept for negative_ttl instead of ttl
+    """
+    def put_many(self, results):
+        now = time.time()
+        rows = []
+        for location, found in results:
+            expires = now + (self.ttl if found else self.negative_ttl)
+            rows.append((location["ip"], location["city"], location["region"],
+                         location["country"], int(found), expires, now))
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._flush_touched()
+            self._evict()
+            self.connection.commit()
+
+    """
+    stats
+
+    Returns the hit, miss and eviction counters and the number of cached ips
+    """
+    def stats(self):
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": size
+            }
+
+    """
+    close
+
+    Writes the pending last-used times and closes the database
+    """
+    def close(self):
+        with self.lock:
+            self._flush_touched()
+            self.connection.commit()
+            self.connection.close()
+
+    # Hits only update memory, the last-used times are written in one go
+    def _flush_touched(self):
+        if self.touched:
+            self.connection.executemany(
+                "UPDATE locations SET last_used = ? WHERE ip = ?",
+                [(used, ip) for ip, used in self.touched.items()])
+            self.touched.clear()
+
+    # Drops the least recently used entries above max_entries
+    def _evict(self):
+        size = self.connection.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+        excess = size - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM locations WHERE ip IN "
+                "(SELECT ip FROM locations ORDER BY last_used LIMIT ?)", (excess,))
+            self.evictions += excess
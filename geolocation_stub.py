@@ -0,0 +1,105 @@
+"""
+geolocation_stub.py
+
+A local stand-in for the ip-api.com service, used to test and benchmark the
+geolocator without network access
+
+Serves POST /batch and GET /json/<ip> with made up but repeatable locations
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port the stub listens on when run from the command line
+DEFAULT_PORT = 8765
+
+# Locations handed out by the stub, picked from the characters of the ip
+STUB_LOCATIONS = [
+    {"city": "Ashburn", "regionName": "Virginia", "country": "United States"},
+    {"city": "Mountain View", "regionName": "California", "country": "United States"},
+    {"city": "Frankfurt am Main", "regionName": "Hesse", "country": "Germany"},
+    {"city": "Moscow", "regionName": "Moscow", "country": "Russia"},
+    {"city": "Sao Paulo", "regionName": "Sao Paulo", "country": "Brazil"}
+]
+
+"""
+stub_location
+
+Returns the ip-api.com style result the stub gives for an ip
+"""
+def stub_location(ip):
+    result = {"status": "success", "query": ip}
+    result.update(STUB_LOCATIONS[sum(ip.encode()) % len(STUB_LOCATIONS)])
+    return result
+
+"""
+StubHandler
+
+Answers ip-api.com style requests after waiting server.delay seconds
+"""
+class StubHandler(BaseHTTPRequestHandler):
+    def _respond(self, payload):
+        time.sleep(self.server.delay)
+        self.server.requests_served += 1
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        ip = self.path.split("?")[0].rsplit("/", 1)[-1]
+        self._respond(stub_location(ip))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        queries = json.loads(self.rfile.read(length) or b"[]")
+        ips = [query["query"] if isinstance(query, dict) else query for query in queries]
+        self._respond([stub_location(ip) for ip in ips])
+
+    def log_message(self, format, *args):
+        pass
+
+"""
+start_stub_server
+
+Starts the stub on a free local port in a background thread.
+Returns the server, its base url is in server.base_url and it is stopped
+with server.shutdown()
+"""
+def start_stub_server(delay=0.0, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.requests_served = 0
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+"""
+parse_args
+
+Parses the command line of the stub: the port to listen on and the delay
+before every answer
+"""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve made up ip-api.com style locations locally")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on, 0 picks a free one (default: {DEFAULT_PORT})")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds to wait before every answer, to mimic a slow service (default: 0)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    stub = start_stub_server(delay=args.delay, port=args.port)
+    print(f"Stub geolocation service listening on {stub.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -2,9 +2,342 @@
 geolocator.py
 
 This geolocates ips
+
+Uses the ip-api.com batch endpoint through a shared client that dedupes ips
+across the whole run, reuses connections and looks ips up in the background.
+Results can be kept between runs in a GeolocationCache.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from defaults import IP_API_URL
+from eml_ingest import get_ip_classification
+
+# ip-api.com accepts at most 100 ips per batch request
+BATCH_SIZE = 100
+FIELDS = "status,message,country,regionName,city,query"
+
+"""
+placeholder_location
+
+Returns the location used when an ip could not be geolocated
+"""
+def placeholder_location(ip):
+    return {"ip": ip, "city": "N/A", "region": "N/A", "country": "N/A"}
+
+"""
+skipped_location
+
+The location of an ip that was not looked up at all, e.g. because there was
+no time left. Unlike a placeholder it does not count as a foreign hop
+"""
+def skipped_location(ip):
+    return {"ip": ip, "city": None, "region": None, "country": None}
+
+"""
+is_found
+
+Returns True if an ip-api.com result (None if missing) holds a location
+"""
+def is_found(data):
+    return bool(data) and data.get("status") == "success"
+
+"""
+location_from_response
+
+Returns a location structure from one ip-api.com result (None if missing)
+"""
+def location_from_response(ip, data):
+    if not is_found(data):
+        return placeholder_location(ip)
+    return {
+        "ip": ip,
+        "city": data.get("city", "N/A"),
+        "region": data.get("regionName", "N/A"),
+        "country": data.get("country", "N/A")
+    }
+
+"""
+percentile
+
+Returns the given percentile (0-100) of a list of values using nearest rank
+"""
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+"""
+LocationRequest
+
+Handle for a geolocation lookup running in the background.
+result() waits for it and returns the locations in the order they were asked for
+"""
+class LocationRequest:
+    def __init__(self, futures, on_wait=None):
+        self.futures = futures
+        # Called before blocking, so queued ips can be sent without waiting for a full batch
+        self.on_wait = on_wait
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def result(self):
+        if self.on_wait is not None and not self.done():
+            self.on_wait()
+        return [future.result() for future in self.futures]
+
+"""
+GeolocationClient
+
+Geolocates ips with batched, concurrent requests over a pooled session.
+Each ip is only ever looked up once per client. Internal (private, loopback)
+and invalid ips never go to the network. If a cache is given it is checked
+before the network, receives every answer and is closed with the client.
 """
+class GeolocationClient:
+    def __init__(self, base_url=IP_API_URL, timeout=5, batch_size=BATCH_SIZE,
+                 max_concurrency=4, flush_interval=0.02, cache=None):
+        self.base_url = base_url.rstrip("/")
+        self.cache = cache
+        self.timeout = timeout
+        self.batch_size = batch_size
+        # How long to wait for more ips before sending a partial batch
+        self.flush_interval = flush_interval
+        self.max_concurrency = max_concurrency
 
-import requests
+        # Opened with the first batch, ips that are cached or internal never need it
+        self.session = None
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                           thread_name_prefix="geolocate")
+
+        self.lock = threading.Condition()
+        self.lookups = {}       # ip -> Future of its location
+        self.queue = []         # ips waiting to be batched
+        self.dispatcher = None
+        self.closed = False
+        self.flush_requested = False
+
+        # Statistics
+        self.batch_latencies = []
+        self.network_lookups = 0
+        self.first_request = None
+        self.last_response = None
+
+    """
+    lookup_async
+
+    Queues the ips for lookup and returns a LocationRequest without waiting
+    """
+    def lookup_async(self, ip_list):
+        futures = []
+        with self.lock:
+            for ip in ip_list:
+                future = self.lookups.get(ip)
+                if future is None:
+                    future = Future()
+                    self.lookups[ip] = future
+                    if get_ip_classification(ip) != "Public":
+                        future.set_result(placeholder_location(ip))
+                        futures.append(future)
+                        continue
+
+                    cached = self.cache.get(ip) if self.cache is not None else None
+                    if cached is not None:
+                        future.set_result(cached)
+                    else:
+                        self.queue.append(ip)
+                futures.append(future)
+
+            if self.queue:
+                self._start_dispatcher()
+                self.lock.notify_all()
+        return LocationRequest(futures, on_wait=self.flush)
+
+    """
+    flush
+
+    Sends the queued ips now instead of waiting for the batch to fill up
+    """
+    def flush(self):
+        with self.lock:
+            if self.queue:
+                self.flush_requested = True
+                self.lock.notify_all()
+
+    """
+    geolocate_ips
+
+    Returns a list of identified locations based on a list of ips
+    """
+    def geolocate_ips(self, ip_list):
+        return self.lookup_async(ip_list).result()
+
+    """
+    stats
+
+    Returns lookup counts, lookups per second, batch latency percentiles (ms)
+    and the cache counters if there is a cache
+    """
+    def stats(self):
+        cache_stats = self.cache.stats() if self.cache is not None else None
+        with self.lock:
+            latencies = [latency * 1000 for latency in self.batch_latencies]
+            elapsed = 0.0
+            if self.first_request is not None and self.last_response is not None:
+                elapsed = self.last_response - self.first_request
+            return {
+                "unique_ips": len(self.lookups),
+                "network_lookups": self.network_lookups,
+                "batch_requests": len(latencies),
+                "lookups_per_sec": self.network_lookups / elapsed if elapsed > 0 else 0.0,
+                "latency_p50_ms": percentile(latencies, 50),
+                "latency_p90_ms": percentile(latencies, 90),
+                "latency_p99_ms": percentile(latencies, 99),
+                "cache": cache_stats
+            }
+
+    """
+    close
+
+    Sends any queued ips, waits for outstanding lookups and releases the
+    session and cache
+    """
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+            dispatcher = self.dispatcher
+        if dispatcher is not None:
+            dispatcher.join()
+        self.executor.shutdown(wait=True)
+        if self.session is not None:
+            self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    # Returns a pooled session with a connection for every request thread
+    def _open_session(self):
+        # Imported here, requests is only needed once ips go to the network
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _start_dispatcher(self):
+        if self.dispatcher is None:
+            self.dispatcher = threading.Thread(target=self._dispatch, name="geolocate-dispatch",
+                                               daemon=True)
+            self.dispatcher.start()
+
+    # Groups queued ips into batches and hands them to the request threads
+    def _dispatch(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.lock.wait()
+                if not self.queue:
+                    return
+
+                # Give other messages a moment to fill up the batch
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self.queue) < self.batch_size and not self.closed
+                       and not self.flush_requested):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+
+                batch = self.queue[:self.batch_size]
+                del self.queue[:self.batch_size]
+                if not self.queue:
+                    self.flush_requested = False
+            if self.session is None:
+                try:
+                    self.session = self._open_session()
+                except Exception:
+                    # No session (requests missing), the batch is answered with placeholders
+                    pass
+            self.executor.submit(self._lookup_batch, batch)
+
+    # Looks up one batch of ips and resolves their futures. Whatever fails,
+    # every future of the batch gets a location, so no scan waits forever
+    def _lookup_batch(self, batch):
+        locations = None
+        try:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(f"{self.base_url}/batch", json=batch,
+                                             params={"fields": FIELDS}, timeout=self.timeout)
+                results = {item.get("query"): item for item in response.json()}
+            except Exception:
+                # Failed API request, every ip in the batch gets placeholders
+                results = None
+            end = time.perf_counter()
+
+            locations = [location_from_response(ip, (results or {}).get(ip)) for ip in batch]
+            with self.lock:
+                self.batch_latencies.append(end - start)
+                self.network_lookups += len(batch)
+                if self.first_request is None or start < self.first_request:
+                    self.first_request = start
+                if self.last_response is None or end > self.last_response:
+                    self.last_response = end
+
+            # Only answers from the service are cached, not transport failures
+            if self.cache is not None and results is not None:
+                self.cache.put_many([(location, is_found(results.get(location["ip"])))
+                                     for location in locations])
+        finally:
+            if locations is None:
+                locations = [placeholder_location(ip) for ip in batch]
+            with self.lock:
+                futures = [self.lookups[ip] for ip in batch]
+            for location, future in zip(locations, futures):
+                if not future.done():
+                    future.set_result(location)
+
+_default_client = None
+_default_client_options = {}
+
+"""
+configure_default_client
+
+Sets the options (a dict of GeolocationClient arguments) used for the shared
+client. A "cache" entry holds the GeolocationCache arguments instead of a cache
+so the options can be handed to worker processes. An "offline_db" entry selects
+the offline backend (see offline_geolocator.py) instead of the network
+"""
+def configure_default_client(options):
+    global _default_client, _default_client_options
+    _default_client_options = options
+    _default_client = None
+
+"""
+get_default_client
+
+Returns the client shared by everything in this process, creating it if needed
+"""
+def get_default_client():
+    global _default_client
+    if _default_client is None and _default_client_options.get("offline_db"):
+        # Imported here, the offline backend builds on this module
+        from offline_geolocator import OfflineGeolocator
+        _default_client = OfflineGeolocator(_default_client_options["offline_db"])
+    if _default_client is None:
+        options = dict(_default_client_options)
+        if options.get("cache") is not None:
+            # Imported here, sqlite3 is only needed with the cache on
+            from geolocation_cache import GeolocationCache
+            options["cache"] = GeolocationCache(**options["cache"])
+        _default_client = GeolocationClient(**options)
+    return _default_client
 
 """
 geolocate_ips
@@ -14,25 +347,4 @@ Returns a list of identified locations based on a list of ips
 Uses ip-api.com
 """
 def geolocate_ips(ip_list):
-    locations = []
-    for ip in ip_list:
-        # URL is ip-api.com with the ip set to current ip
-        url = f"http://ip-api.com/json/{ip}"
-        try:
-            response = requests.get(url, timeout=5)
-            data = response.json()
-            # Once response received, add the location
-            if data["status"] == "success":
-                locations.append({
-                    "ip": ip,
-                    "city": data.get("city", "N/A"),
-                    "region": data.get("regionName", "N/A"),
-                    "country": data.get("country", "N/A")
-                })
-            else:
-                # No successful response, return placeholders
-                locations.append({"ip": ip, "city": "N/A", "region": "N/A", "country": "N/A"})
-        except Exception as e:
-            #Failed API request, return placeholders
-            locations.append({"ip": ip, "city": "N/A", "region": "N/A", "country": "N/A"})
-    return locations
\ No newline at end of file
+    return get_default_client().geolocate_ips(ip_list)
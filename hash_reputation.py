@@ -0,0 +1,327 @@
+"""
+hash_reputation.py
+
+This checks attachments against a feed of known malicious file hashes
+
+A feed (one SHA-256 in hex per line, as the first field of a CSV or
+whitespace separated line) is built once into an index file holding a Bloom
+filter and the sorted hashes. The index is memory-mapped. Most attachments
+are not in the feed and are turned away by the Bloom filter after a few bit
+tests. The rest are confirmed with a binary search of the sorted hashes,
+narrowed first by a table of where each 2 byte prefix starts, so a lookup
+touches a handful of pages even with a feed of tens of millions of hashes.
+
+The build streams the feed: sorted runs of RUN_HASHES hashes are written to
+temporary files and merged, so memory stays bounded however large the feed.
+
+Build an index:  python hash_reputation.py build feed.txt hashes.idx
+Look up hashes:  python hash_reputation.py lookup hashes.idx SHA256 [SHA256 ...]
+"""
+
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+MAGIC = b"HASHIDX1"
+# magic, byte order, hash count, Bloom filter bits, Bloom filter hash functions, digest of the hashes
+HEADER = struct.Struct("<8s8sQQQ16s")
+HASH_SIZE = 32
+# Hashes are found from where their first 2 bytes start
+PREFIX_COUNT = 1 << 16
+# False positive rate of the Bloom filter, i.e. share of clean attachments searched for
+FALSE_POSITIVE_RATE = 0.001
+# Hashes sorted in memory at a time while building. A 32 byte bytes object
+# takes about 72 bytes plus 8 for its place in the list, so a run holds about
+# 80 MiB, and sorting it and writing it out adds under 10 MiB more
+RUN_HASHES = 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+"""
+parse_hash
+
+Returns the SHA-256 at the start of a feed line as 32 bytes, or None for
+blank lines, comments, headers and anything that is not a SHA-256
+"""
+def parse_hash(line):
+    field = line.split(b",", 1)[0].split(None, 1)
+    if not field or len(field[0]) != 2 * HASH_SIZE:
+        return None
+    try:
+        return bytes.fromhex(field[0].decode("ascii"))
+    except ValueError:
+        return None
+
+"""
+bloom_positions
+
+Returns the Bloom filter bits of a hash. The hash is a SHA-256 already, so
+its first 16 bytes make the two numbers of double hashing
+"""
+def bloom_positions(digest, bits, functions):
+    first = int.from_bytes(digest[:8], "little")
+    step = int.from_bytes(digest[8:16], "little") | 1
+    return [(first + function * step) % bits for function in range(functions)]
+
+"""
+write_run
+
+Sorts the hashes of a run in place, drops duplicates and writes them to a
+temporary file in folder, a block at a time. Returns its path
+"""
+def write_run(hashes, folder):
+    hashes.sort()
+    run_file = tempfile.NamedTemporaryFile("wb", dir=folder, suffix=".run", delete=False)
+    with run_file:
+        block = bytearray()
+        previous = None
+        for digest in hashes:
+            if digest != previous:
+                block += digest
+                previous = digest
+                if len(block) >= READ_SIZE:
+                    run_file.write(block)
+                    block.clear()
+        run_file.write(block)
+    return run_file.name
+
+"""
+read_run
+
+Yields the hashes of a run file in order
+"""
+def read_run(path):
+    with open(path, "rb") as run_file:
+        while True:
+            block = run_file.read(READ_SIZE)
+            if not block:
+                break
+            for start in range(0, len(block), HASH_SIZE):
+                yield block[start:start + HASH_SIZE]
+
+"""
+build_index
+
+Builds the index file from a feed. Returns (hashes written, lines that were
+not a SHA-256)
+"""
+def build_index(feed_path, index_path, false_positive_rate=FALSE_POSITIVE_RATE):
+    skipped = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(index_path))) as run_folder:
+        runs = []
+        hashes = []
+        with open(feed_path, "rb") as feed_file:
+            for line in feed_file:
+                digest = parse_hash(line)
+                if digest is None:
+                    skipped += line.strip() != b"" and not line.startswith(b"#")
+                    continue
+                hashes.append(digest)
+                if len(hashes) == RUN_HASHES:
+                    runs.append(write_run(hashes, run_folder))
+                    hashes = []
+        if hashes or not runs:
+            runs.append(write_run(hashes, run_folder))
+        del hashes
+
+        # Sized for every hash of the runs, duplicates between runs only make it a little larger
+        upper_count = sum(os.path.getsize(run) for run in runs) // HASH_SIZE
+        bits = max(64, math.ceil(-upper_count * math.log(false_positive_rate) / math.log(2) ** 2))
+        bits += -bits % 8
+        functions = max(1, round(bits / max(upper_count, 1) * math.log(2)))
+        bloom = bytearray(bits // 8)
+        prefix_counts = array("Q", bytes(8 * PREFIX_COUNT))
+        digest = hashlib.blake2b(digest_size=16)
+        bloom_start = HEADER.size + 8 * (PREFIX_COUNT + 1)
+
+        count = 0
+        with open(index_path, "wb") as index_file:
+            # Header, prefix table and Bloom filter are written once all hashes are known
+            index_file.seek(bloom_start + len(bloom))
+            previous = None
+            pending = []
+            for digest_bytes in heapq.merge(*(read_run(run) for run in runs)):
+                if digest_bytes == previous:
+                    continue
+                previous = digest_bytes
+                pending.append(digest_bytes)
+                prefix_counts[digest_bytes[0] << 8 | digest_bytes[1]] += 1
+                for position in bloom_positions(digest_bytes, bits, functions):
+                    bloom[position >> 3] |= 1 << (position & 7)
+                if len(pending) == READ_SIZE // HASH_SIZE:
+                    block = b"".join(pending)
+                    index_file.write(block)
+                    digest.update(block)
+                    count += len(pending)
+                    pending = []
+            block = b"".join(pending)
+            index_file.write(block)
+            digest.update(block)
+            count += len(pending)
+
+            # Start of each prefix's hashes, and the end of the last one
+            prefix_starts = array("Q", [0])
+            for prefix_count in prefix_counts:
+                prefix_starts.append(prefix_starts[-1] + prefix_count)
+            index_file.seek(0)
+            index_file.write(HEADER.pack(MAGIC, sys.byteorder.encode().ljust(8, b"\0"),
+                                         count, bits, functions, digest.digest()))
+            prefix_starts.tofile(index_file)
+            index_file.write(bloom)
+
+    return count, skipped
+
+"""
+HashIndex
+
+Looks SHA-256 hashes up in a memory-mapped index built by build_index
+"""
+class HashIndex:
+    def __init__(self, index_path):
+        self.index_file = open(index_path, "rb")
+        self.map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, self.count, self.bits, self.functions, digest = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path} is not a hash index")
+        if byteorder.rstrip(b"\0").decode() != sys.byteorder:
+            raise ValueError(f"{index_path} was built on a machine with a different byte order")
+        # Changes whenever the index is built from a different feed
+        self.version = digest.hex()
+
+        self.prefix_starts = memoryview(self.map)[HEADER.size:HEADER.size + 8 * (PREFIX_COUNT + 1)].cast("Q")
+        self.bloom_start = HEADER.size + 8 * (PREFIX_COUNT + 1)
+        self.hashes_start = self.bloom_start + self.bits // 8
+
+        # Lookups run on several threads (see smtp_service.py), the counters are updated together
+        self.stats_lock = threading.Lock()
+        self.lookups = 0
+        self.bloom_rejected = 0
+        self.matches = 0
+        self.lookup_time = 0.0
+
+    """
+    contains
+
+    Returns True if a SHA-256 (in hex) is in the index
+    """
+    def contains(self, sha256):
+        start = time.perf_counter()
+        found, bloom_rejected = self._find(sha256)
+        elapsed = time.perf_counter() - start
+        with self.stats_lock:
+            self.lookup_time += elapsed
+            self.lookups += 1
+            self.bloom_rejected += bloom_rejected
+            self.matches += found
+        return found
+
+    """
+    stats
+
+    Returns the number of lookups, how many the Bloom filter answered and
+    how many matched, and lookups per second
+    """
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "lookups": self.lookups,
+                "bloom_rejected": self.bloom_rejected,
+                "matches": self.matches,
+                "lookups_per_sec": self.lookups / self.lookup_time if self.lookup_time > 0 else 0.0
+            }
+
+    def close(self):
+        self.prefix_starts.release()
+        self.map.close()
+        self.index_file.close()
+
+    # Returns (whether the SHA-256 is in the index, whether the Bloom filter ruled it out)
+    def _find(self, sha256):
+        try:
+            digest = bytes.fromhex(sha256)
+        except (TypeError, ValueError):
+            return False, False
+        if len(digest) != HASH_SIZE:
+            return False, False
+
+        for position in bloom_positions(digest, self.bits, self.functions):
+            if not self.map[self.bloom_start + (position >> 3)] >> (position & 7) & 1:
+                return False, True
+
+        # Binary search over the hashes with the same 2 byte prefix
+        prefix = digest[0] << 8 | digest[1]
+        low, high = self.prefix_starts[prefix], self.prefix_starts[prefix + 1]
+        while low < high:
+            middle = (low + high) // 2
+            start = self.hashes_start + HASH_SIZE * middle
+            stored = self.map[start:start + HASH_SIZE]
+            if stored == digest:
+                return True, False
+            if stored < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return False, False
+
+_default_index = None
+_default_index_path = None
+_default_index_lock = threading.Lock()
+
+"""
+configure_hash_index
+
+Sets the index attachments are checked against in this process, or None
+for no checks. The index is opened on first use so the path can be handed
+to worker processes
+"""
+def configure_hash_index(index_path):
+    global _default_index, _default_index_path
+    if _default_index is not None:
+        _default_index.close()
+    _default_index = None
+    _default_index_path = index_path
+
+"""
+get_hash_index
+
+Returns the HashIndex of this process, or None when no index is configured
+"""
+def get_hash_index():
+    global _default_index
+    if _default_index is None and _default_index_path:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = HashIndex(_default_index_path)
+    return _default_index
+
+"""
+get_hash_index_path
+
+Returns the path of the index configured for this process, or None
+"""
+def get_hash_index_path():
+    return _default_index_path
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == "build":
+        start = time.perf_counter()
+        count, skipped = build_index(argv[1], argv[2])
+        print(f"Wrote {argv[2]}: {count} hashes in {time.perf_counter() - start:.1f} s"
+              + (f", {skipped} lines skipped" if skipped else ""))
+    elif len(argv) >= 3 and argv[0] == "lookup":
+        index = HashIndex(argv[1])
+        for sha256 in argv[2:]:
+            print(f"{sha256}: {'known bad' if index.contains(sha256.lower()) else 'not found'}")
+        index.close()
+    else:
+        print(__doc__.strip())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
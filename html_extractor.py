@@ -0,0 +1,151 @@
+"""
+html_extractor.py
+
+This pulls the visible text and the links out of an html body
+
+No document tree is built. The markup goes through a few regular expression
+scans, each of which runs at C speed over the whole document: comments and
+the content of script, style and similar elements are cut out (an element
+that is never closed only loses its opening tag, so it cannot hide the rest
+of the document), href / src /
+action targets and link texts are collected, block elements become line
+breaks, inline elements that take up space of their own (images, form
+fields) become spaces and every other tag is dropped. This is several times faster than
+handling the markup tag by tag in Python (html.parser), which matters for
+multi-MB marketing mail. Links whose text looks like a web address pointing
+somewhere other than the real target are reported as mismatches.
+"""
+
+import re
+from html import unescape
+
+# Elements whose content is never shown
+HIDDEN_ELEMENTS = ["script", "style", "head", "title", "template", "noscript", "svg", "object"]
+# Start of a comment or of a hidden element
+HIDDEN_START_PATTERN = re.compile(r"<!--|<(" + "|".join(HIDDEN_ELEMENTS) + r")\b[^>]*>", re.IGNORECASE)
+# End of a comment ("--") and of each hidden element
+HIDDEN_END_PATTERNS = {"--": re.compile(r"-->")}
+HIDDEN_END_PATTERNS.update((name, re.compile(rf"</{name}\s*>", re.IGNORECASE)) for name in HIDDEN_ELEMENTS)
+# Tags of elements that start a new line of text
+BLOCK_TAG_PATTERN = re.compile(
+    r"</?(?:p|div|br|li|ul|ol|dl|dt|dd|tr|td|th|thead|tbody|tfoot|table|caption|h[1-6]|blockquote|pre|"
+    r"hr|section|article|header|footer|nav|main|aside|address|figure|figcaption|details|summary|"
+    r"fieldset|legend|center|form|option)\b[^>]*>", re.IGNORECASE)
+# Tags of inline elements that take up space of their own, their text does not join up
+SPACED_TAG_PATTERN = re.compile(r"</?(?:img|input|button|select|textarea|label)\b[^>]*>", re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]*>")
+# The rest of an address after its scheme. Searching for the literal "://"
+# is much faster than for the scheme in any letter case
+ADDRESS_REST_PATTERN = re.compile(r"""://[^"'\s<>]+""")
+# What has to come before it for the address to be a link target
+LINK_ATTRIBUTE_PATTERN = re.compile(r"""\s(?:href|src|action)\s*=\s*["']?\s*(https?)$""", re.IGNORECASE)
+# A link and its text
+ANCHOR_PATTERN = re.compile(
+    r"""<a\s[^>]*?\bhref\s*=\s*["']?\s*(https?://[^"'\s>]+)[^>]*>(.{0,256}?)</a\s*>""",
+    re.DOTALL | re.IGNORECASE)
+# Link text that reads like a web address, e.g. "www.paypal.com" or "https://bank.com/login"
+ADDRESS_TEXT_PATTERN = re.compile(r"^(?:https?://)?((?:[a-z0-9-]+\.)+[a-z]{2,})(?::\d+)?(?:[/?#]\S*)?$",
+                                  re.IGNORECASE)
+# Hostname of a link target, after any user info and before any port or path
+LINK_HOST_PATTERN = re.compile(r"^https?://(?:[^/?#@]*@)?(\[[^\]/]*\]|[^/?#:]*)", re.IGNORECASE)
+# Runs of whitespace other than a single space, which is left alone
+SPACES_PATTERN = re.compile(r"[^\S\n]{2,}|[^\S\n ]")
+LINE_BREAKS_PATTERN = re.compile(r" ?\n[\s]*")
+
+"""
+same_site
+
+Returns True if two hostnames are the same, or one is a subdomain of the
+other (www. is ignored)
+"""
+def same_site(first, second):
+    first = first.removeprefix("www.")
+    second = second.removeprefix("www.")
+    return first == second or first.endswith("." + second) or second.endswith("." + first)
+
+"""
+remove_hidden
+
+Returns html without its comments and hidden elements. A comment or element
+that is never closed only loses its start. An element found unclosed once
+is not searched for again, so the scan stays linear
+"""
+def remove_hidden(html):
+    pieces = []
+    position = 0
+    unclosed = set()
+    while True:
+        start = HIDDEN_START_PATTERN.search(html, position)
+        if start is None:
+            break
+        name = (start.group(1) or "--").lower()
+        end = None
+        if name not in unclosed:
+            end = HIDDEN_END_PATTERNS[name].search(html, start.end())
+            if end is None:
+                unclosed.add(name)
+        pieces.append(html[position:start.start()])
+        position = end.end() if end is not None else start.end()
+    if not pieces:
+        return html
+    pieces.append(html[position:])
+    return "".join(pieces)
+
+"""
+strip_tags
+
+Returns the text of a piece of html with block elements on lines of their
+own, spaced inline elements apart from their neighbours and every other tag
+dropped. Entities are left as they are
+"""
+def strip_tags(html):
+    if "<" not in html:
+        return html
+    return TAG_PATTERN.sub("", SPACED_TAG_PATTERN.sub(" ", BLOCK_TAG_PATTERN.sub("\n", html)))
+
+"""
+anchor_mismatch
+
+Returns {"text", "href"} if a line of the text of a link reads like a web
+address on a different site than the link's target, otherwise None
+"""
+def anchor_mismatch(text, href):
+    href_host = LINK_HOST_PATTERN.match(href).group(1).strip("[]").lower()
+    if not href_host:
+        return None
+    for line in unescape(strip_tags(text)).splitlines():
+        line = line.strip()
+        address = ADDRESS_TEXT_PATTERN.match(line)
+        if address is not None and not same_site(address.group(1).lower(), href_host):
+            return {"text": line, "href": href}
+    return None
+
+"""
+extract_html
+
+Returns the visible text, links and link mismatches of an html document as
+{"text", "links", "mismatches"}. Only http and https links are collected
+"""
+def extract_html(html):
+    visible = remove_hidden(html)
+
+    links = []
+    for rest in ADDRESS_REST_PATTERN.finditer(visible):
+        # Only http(s) values of link attributes, not addresses in the text
+        start = rest.start()
+        attribute = LINK_ATTRIBUTE_PATTERN.search(visible, max(0, start - 24), start)
+        if attribute is not None:
+            links.append(unescape(attribute.group(1) + rest.group()))
+
+    mismatches = []
+    for href, text in ANCHOR_PATTERN.findall(visible):
+        mismatch = anchor_mismatch(text, unescape(href))
+        if mismatch is not None:
+            mismatches.append(mismatch)
+
+    text = strip_tags(visible)
+    if "&" in text:
+        text = unescape(text)
+    # Collapse the whitespace of the markup, keeping one line per block
+    text = LINE_BREAKS_PATTERN.sub("\n", SPACES_PATTERN.sub(" ", text)).strip()
+    return {"text": text, "links": links, "mismatches": mismatches}
@@ -0,0 +1,163 @@
+"""
+keyword_matcher.py
+
+This finds many phrases in a text in a single pass
+
+Builds an Aho-Corasick automaton from categorized phrases once, then every
+phrase of every category is found in one scan of the text, so scan time does
+not grow with the number of phrases. Matching is case-insensitive.
+"""
+
+import re
+import string
+from collections import deque
+
+TOKEN_PATTERN = re.compile(r"\S+")
+# Stripped from both ends of each whitespace separated word
+WORD_PUNCTUATION = string.punctuation + "\u201c\u201d\u2018\u2019"
+
+"""
+split_words
+
+Returns the whitespace separated words of a text without surrounding punctuation
+"""
+def split_words(text):
+    return [token.strip(WORD_PUNCTUATION) for token in text.split()]
+
+"""
+word_span
+
+Returns the (start, end) offsets of a whitespace token match without its
+surrounding punctuation
+"""
+def word_span(token):
+    word = token.group()
+    start = token.start() + len(word) - len(word.lstrip(WORD_PUNCTUATION))
+    end = token.end() - (len(word) - len(word.rstrip(WORD_PUNCTUATION)))
+    return start, end
+
+"""
+KeywordMatcher
+
+Multi-pattern phrase matcher. phrases_by_category maps a category name to a
+collection of phrases.
+
+By default phrases match anywhere, like a substring search. With whole_words
+the automaton steps over whitespace separated words instead of characters,
+so a phrase only matches complete words ("rent" does not match "current" or
+"rent-free", and neither does "gift card" match "gift cards") and may be
+wrapped over lines.
+"""
+class KeywordMatcher:
+    def __init__(self, phrases_by_category, whole_words=False):
+        self.whole_words = whole_words
+        self.categories = list(phrases_by_category)
+        # State 0 is the root. Each state has its transitions and the
+        # (category, phrase, length in symbols) entries that end there
+        self.transitions = [{}]
+        self.outputs = [[]]
+
+        for category, phrases in phrases_by_category.items():
+            for phrase in sorted(phrases):
+                self._add_phrase(category, phrase.lower())
+        self.failures = self._link_failures()
+
+    """
+    find_all
+
+    Returns every match as (start, end, category, phrase), in text order.
+    Offsets index into text.lower(), which is text itself for almost all input
+    """
+    def find_all(self, text):
+        if not text:
+            return []
+        text = text.lower()
+        hits = self._scan(text)
+        if not hits:
+            return []
+
+        # Word positions are only turned into text offsets when something matched
+        if self.whole_words:
+            spans = [word_span(token) for token in TOKEN_PATTERN.finditer(text)]
+        matches = []
+        for end, found in hits:
+            for category, phrase, length in found:
+                if self.whole_words:
+                    matches.append((spans[end - length][0], spans[end - 1][1], category, phrase))
+                else:
+                    matches.append((end - length, end, category, phrase))
+        matches.sort()
+        return matches
+
+    """
+    match_categories
+
+    Returns a dict of category -> distinct phrases found, in the order
+    they first appear in the text. Cheaper than find_all as no offsets are worked out
+    """
+    def match_categories(self, text):
+        found = {category: [] for category in self.categories}
+        if not text:
+            return found
+        seen = set()
+        for _, outputs in self._scan(text.lower()):
+            for category, phrase, _ in outputs:
+                if (category, phrase) not in seen:
+                    seen.add((category, phrase))
+                    found[category].append(phrase)
+        return found
+
+    # Runs the automaton over lowercased text, returns (end position in
+    # symbols, outputs) for every state that completes at least one phrase
+    def _scan(self, text):
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+
+        hits = []
+        state = 0
+        symbols = split_words(text) if self.whole_words else text
+        for position, symbol in enumerate(symbols):
+            while state and symbol not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(symbol, 0)
+            if outputs[state]:
+                hits.append((position + 1, outputs[state]))
+        return hits
+
+    def _add_phrase(self, category, phrase):
+        symbols = split_words(phrase) if self.whole_words else phrase
+        if not symbols:
+            return
+        state = 0
+        for symbol in symbols:
+            next_state = self.transitions[state].get(symbol)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][symbol] = next_state
+                self.transitions.append({})
+                self.outputs.append([])
+            state = next_state
+        output = (category, phrase, len(symbols))
+        if output not in self.outputs[state]:
+            self.outputs[state].append(output)
+
+    # Breadth first so a state's failure state is always linked before it.
+    # Outputs of the failure state are merged in, so shorter phrases that end
+    # inside a longer one are still reported
+    def _link_failures(self):
+        failures = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                failure = failures[state]
+                while failure and symbol not in self.transitions[failure]:
+                    failure = failures[failure]
+                failure = self.transitions[failure].get(symbol, 0)
+                failures[next_state] = failure
+                self.outputs[next_state] = self.outputs[next_state] + [
+                    output for output in self.outputs[failure]
+                    if output not in self.outputs[next_state]]
+        return failures
@@ -0,0 +1,192 @@
+"""
+mail_sources.py
+
+This reads messages out of mailboxes and archives for analysis
+
+Supports single .eml files, folders of .eml files, Maildir folders, mbox files
+and zip / tar (optionally compressed) archives of .eml files. Containers are
+read one message at a time and never extracted to disk.
+"""
+
+import os
+import re
+import tarfile
+import zipfile
+from pathlib import Path
+from eml_ingest import get_limits, parse_eml, parse_eml_bytes
+
+"""
+ContainedMessage
+
+A message read out of a container (mbox, Maildir, archive).
+location says where in the container it was found
+"""
+class ContainedMessage:
+    def __init__(self, container, location, data):
+        self.container = Path(container)
+        self.location = location
+        self.data = data
+        self.name = f"{self.container.name} ({location})"
+        # Used to name the report, e.g. inbox.mbox_offset_1024
+        self.report_stem = re.sub(r"[^A-Za-z0-9._-]+", "_", f"{self.container.name}_{location}")
+
+    def __str__(self):
+        return self.name
+
+"""
+parse_source
+
+Parses an eml file path or a ContainedMessage (see parse_eml)
+"""
+def parse_source(source):
+    if isinstance(source, ContainedMessage):
+        return parse_eml_bytes(source.data)
+    return parse_eml(source)
+
+"""
+source_bytes
+
+Returns the raw message of an eml file or a ContainedMessage, read up to
+the message size limit
+"""
+def source_bytes(source):
+    if isinstance(source, ContainedMessage):
+        return source.data
+    with open(source, "rb") as binary_email:
+        return read_limited(binary_email)
+
+"""
+source_size
+
+Returns the size in bytes of an eml file or a ContainedMessage
+"""
+def source_size(source):
+    if isinstance(source, ContainedMessage):
+        return len(source.data)
+    return os.path.getsize(source)
+
+"""
+is_mbox
+
+Returns True if the file looks like an mbox (starts with a "From " line)
+"""
+def is_mbox(path):
+    with open(path, "rb") as mbox_file:
+        return mbox_file.read(5) == b"From "
+
+"""
+read_limited
+
+Returns the content of a binary file object, read up to one byte past the
+message size limit so the parser can tell the message was cut
+"""
+def read_limited(binary_file):
+    return binary_file.read(get_limits()["max_message_bytes"] + 1)
+
+"""
+iter_mbox
+
+Yields every message of an mbox file, streamed line by line.
+The location is the byte offset of the message's "From " line
+"""
+def iter_mbox(mbox_path):
+    offset = 0
+    start = None
+    lines = []
+    size = 0
+    max_size = get_limits()["max_message_bytes"]
+    previous_blank = True
+    with open(mbox_path, "rb") as mbox_file:
+        for line in mbox_file:
+            if line.startswith(b"From ") and previous_blank:
+                if start is not None:
+                    yield ContainedMessage(mbox_path, f"offset {start}", mbox_message(lines))
+                start = offset
+                lines = []
+                size = 0
+            elif start is not None and size <= max_size:
+                # Lines past the size limit are not kept
+                lines.append(line)
+                size += len(line)
+            previous_blank = not line.strip()
+            offset += len(line)
+
+    if start is not None:
+        yield ContainedMessage(mbox_path, f"offset {start}", mbox_message(lines))
+
+"""
+mbox_message
+
+Returns the message bytes from its mbox lines, dropping the blank separator
+line and undoing the ">From " quoting
+"""
+def mbox_message(lines):
+    if lines and not lines[-1].strip():
+        lines = lines[:-1]
+    return b"".join(line[1:] if re.match(rb">+From ", line) else line for line in lines)
+
+"""
+iter_maildir
+
+Yields every message in the new and cur folders of a Maildir
+"""
+def iter_maildir(maildir_path):
+    maildir_path = Path(maildir_path)
+    for folder in ("new", "cur"):
+        for message_path in sorted((maildir_path / folder).glob("*")):
+            if message_path.is_file() and not message_path.name.startswith("."):
+                with open(message_path, "rb") as message_file:
+                    data = read_limited(message_file)
+                yield ContainedMessage(maildir_path, f"{folder}/{message_path.name}", data)
+
+"""
+iter_zip
+
+Yields every .eml member of a zip archive
+"""
+def iter_zip(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            if not member.is_dir() and member.filename.lower().endswith(".eml"):
+                with archive.open(member) as member_file:
+                    data = read_limited(member_file)
+                yield ContainedMessage(zip_path, member.filename, data)
+
+"""
+iter_tar
+
+Yields every .eml member of a tar archive (plain, gz, bz2 or xz), reading it
+as a stream so compressed archives are only decompressed once
+"""
+def iter_tar(tar_path):
+    with tarfile.open(tar_path, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(".eml"):
+                yield ContainedMessage(tar_path, member.name, read_limited(archive.extractfile(member)))
+
+"""
+iter_sources
+
+Yields the messages of every given path: eml files as paths, everything in
+a container as a ContainedMessage
+"""
+def iter_sources(paths):
+    for path in map(Path, paths):
+        if not path.exists():
+            print(f"{path} not found.")
+        elif path.is_dir():
+            if (path / "cur").is_dir() or (path / "new").is_dir():
+                yield from iter_maildir(path)
+            else:
+                yield from sorted(path.glob("*.eml"))
+        elif path.suffix.lower() == ".eml":
+            yield path
+        elif zipfile.is_zipfile(path):
+            yield from iter_zip(path)
+        elif tarfile.is_tarfile(path):
+            yield from iter_tar(path)
+        elif is_mbox(path):
+            yield from iter_mbox(path)
+        else:
+            # Anything else is taken to be a single message
+            yield path
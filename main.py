@@ -3,24 +3,738 @@ main.py
 
 The main file for the email analyzer project. Identifies .eml files and
 starts up report generation.
+
+Scans the ./emails folder, or the .eml files, folders, Maildirs, mbox files
+and zip / tar archives given on the command line.
+Run with "--workers N" to spread the work across N processes and with
+"--metrics" to time each stage of the analysis.
+
+Commands: "scan FILE..." scans a few messages serially and starts quickly,
+"scan-dir [SOURCE...]" takes every option above (and is what main.py does
+without a command), "rescore [FEATURES]" re-grades a saved feature matrix,
+"query" counts or lists the results stored with "--store" and
+"geolocate IP..." prints the location of ips. Heavy modules (requests,
+numpy, process pools, the profiler) are only imported by the commands and
+options that need them.
 """
 
-from eml_ingest import *
-from geolocator import *
-from report_generator import *
+import argparse
+import os
+import sys
+from collections import deque
+from fnmatch import fnmatch
+from defaults import (DEFAULT_CACHE_PATH, DEFAULT_MANIFEST_PATH, DEFAULT_MAX_DISTANCE, DEFAULT_MAX_ENTRIES,
+                      DEFAULT_METRICS_PATH, DEFAULT_POLL_INTERVAL, DEFAULT_STORE_PATH, IP_API_URL)
+from eml_ingest import DEFAULT_LIMITS, configure_limits, get_limits, list_eml_files, parse_eml_headers
+from geolocator import configure_default_client, get_default_client
+from hash_reputation import configure_hash_index, get_hash_index, get_hash_index_path
+from mail_sources import iter_sources, parse_source, source_bytes, source_size
+from pipeline_metrics import DISABLED_METRICS, finish_metrics
+from report_generator import (analyze_email, configure_scoring, configure_triage, describe_source, get_scoring,
+                              get_triage, load_scoring, report_path, write_text_report)
+from result_writer import DEFAULT_FEATURES_PATH, DEFAULT_RESULTS_PATH, JsonlWriter
+from text_analyzer import configure_whole_words, get_whole_words
+from url_analyzer import HOSTNAME_VERDICTS
 
-def main():
-    eml_files = list_eml_files()
-    if not eml_files:
-        return
-    
+# Whether this process looks for campaigns, campaign_index is only imported when it does
+_campaigns = False
+
+"""
+configure_campaign_detection
+
+Turns campaign detection (see campaign_index.py) on or off for this process
+"""
+def configure_campaign_detection(enabled, max_distance=DEFAULT_MAX_DISTANCE):
+    global _campaigns
+    _campaigns = enabled
+    if enabled:
+        # Imported here, only --campaigns needs it
+        from campaign_index import configure_campaigns
+        configure_campaigns(True, max_distance)
+
+"""
+get_campaigns
+
+Returns the campaign index of this process, or None with campaign detection off
+"""
+def get_campaigns():
+    if not _campaigns:
+        return None
+    from campaign_index import get_campaign_index
+    return get_campaign_index()
+
+"""
+describe_error
+
+Returns a short description of an exception for the run summary
+"""
+def describe_error(e):
+    return f"{type(e).__name__}: {e}"
+
+"""
+start_email
+
+Parses an eml file (or a message from a container) and starts geolocating
+its hops in the background. With campaigns on, a message of an analyzed
+campaign only has its header parsed, and so does every message with triage
+on (the body is parsed later, if the header leaves the grade open). Returns (email data, location request,
+error message)
+"""
+def start_email(email, client, metrics=DISABLED_METRICS):
+    metrics.resume()
+    try:
+        # Parse once, every analyzer works off the same structure
+        metrics.add("bytes", source_size(email))
+        campaigns = get_campaigns()
+        if campaigns is not None:
+            email_data = campaigns.parse(source_bytes(email), email.name)
+        elif get_triage():
+            data = source_bytes(email)
+            email_data = dict(parse_eml_headers(data), raw=data)
+        else:
+            email_data = parse_source(email)
+        metrics.add("ips", len(email_data["hop_ips"]))
+        metrics.lap("parse")
+        return email_data, client.lookup_async(email_data["hop_ips"]), None
+    except Exception as e:
+        return None, None, describe_error(e)
+    finally:
+        metrics.pause()
+
+"""
+finish_email
+
+Waits for the hop locations of a started eml file, analyzes it and writes
+its text report (unless text_reports is False). Returns (result, None) or
+(None, error message) so one malformed file never stops the rest of the run
+"""
+def finish_email(email, started, metrics=DISABLED_METRICS, text_reports=True):
+    email_data, location_request, error = started
+    if error:
+        return None, error
+    metrics.resume()
+    try:
+        # Only the time spent waiting counts, lookups run while earlier files are reported
+        locations = location_request.result()
+        metrics.lap("geolocation")
+        campaigns = get_campaigns()
+        if campaigns is not None:
+            email_data = campaigns.complete(email_data)
+            metrics.add("campaign_reused", email_data.get("campaign", {}).get("reused", False))
+            metrics.lap("parse")
+        result = analyze_email(email_data, locations, email, metrics)
+        if campaigns is not None:
+            campaigns.remember(email_data, result)
+        if text_reports:
+            write_text_report(result, email)
+        metrics.lap("report")
+        return result, None
+    except Exception as e:
+        return None, describe_error(e)
+    finally:
+        metrics.pause()
+
+"""
+new_metrics
+
+Returns the MessageMetrics to follow an eml file with, or DISABLED_METRICS.
+Files whose name matches the profile pattern are profiled
+"""
+def new_metrics(email, timed, profile=None):
+    if not timed:
+        return DISABLED_METRICS
+    # Imported here, only a timed run needs it
+    from pipeline_metrics import MessageMetrics
+    return MessageMetrics(profile=profile is not None and fnmatch(email.name, profile))
+
+"""
+process_email
+
+Parses, analyzes and writes the report for a single eml file.
+Returns ((result, error), message metrics or None)
+"""
+def process_email(email, timed=False, profile=None, text_reports=True):
+    metrics = new_metrics(email, timed, profile)
+    started = start_email(email, get_default_client(), metrics)
+    return finish_email(email, started, metrics, text_reports), finish_metrics(metrics, email.name)
+
+"""
+scan_serial
+
+Yields (eml file, (result, error), message metrics or None) for every eml
+file, one after the other. Hop lookups for the next few files run while the
+current report is written
+"""
+def scan_serial(eml_files, client, lookahead=8, timed=False, profile=None, text_reports=True):
+    started = deque()
     for email in eml_files:
-        header = parse_header(email)
-        received_list = header["Received"]
-        ips = extract_hop_ips(received_list)
-        locations = geolocate_ips(ips)
-        generate_report(header, locations, email)
-        # print(extract_body(email))
+        metrics = new_metrics(email, timed, profile)
+        started.append((email, metrics, start_email(email, client, metrics)))
+        if len(started) > lookahead:
+            oldest_email, oldest_metrics, oldest_started = started.popleft()
+            yield (oldest_email, finish_email(oldest_email, oldest_started, oldest_metrics, text_reports),
+                   finish_metrics(oldest_metrics, oldest_email.name))
+
+    while started:
+        oldest_email, oldest_metrics, oldest_started = started.popleft()
+        yield (oldest_email, finish_email(oldest_email, oldest_started, oldest_metrics, text_reports),
+               finish_metrics(oldest_metrics, oldest_email.name))
+
+"""
+configure_worker
+
+Sets up a worker process with the geolocation options, message limits,
+campaign settings (enabled, max distance), scoring, hash index, triage and
+keyword matching settings of the main process
+"""
+def configure_worker(geo_options, limits, campaigns, scoring, hash_index_path, triage, whole_words):
+    configure_default_client(geo_options)
+    configure_limits(limits)
+    configure_campaign_detection(*campaigns)
+    configure_scoring(scoring)
+    configure_hash_index(hash_index_path)
+    configure_triage(triage)
+    configure_whole_words(whole_words)
+
+"""
+scan_parallel
+
+Yields (eml file, (result, error), message metrics or None) for every eml
+file using a pool of worker processes. At most max_in_flight files are queued at once
+and results are yielded in the same order as eml_files, regardless of which
+worker finishes first
+"""
+def scan_parallel(eml_files, workers, geo_options, max_in_flight=None, timed=False, profile=None,
+                  text_reports=True, campaigns=(False, DEFAULT_MAX_DISTANCE)):
+    # Imported here, only a scan with workers needs it
+    from concurrent.futures import ProcessPoolExecutor
+    if max_in_flight is None:
+        max_in_flight = workers * 4
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure_worker,
+                             initargs=(geo_options, get_limits(), campaigns, get_scoring(),
+                                       get_hash_index_path(), get_triage(), get_whole_words())) as executor:
+        in_flight = deque()
+        for email in eml_files:
+            in_flight.append((email, executor.submit(process_email, email, timed, profile, text_reports)))
+            # Window is full, wait on the oldest file before queueing more
+            if len(in_flight) >= max_in_flight:
+                oldest_email, future = in_flight.popleft()
+                yield (oldest_email, *future.result())
+
+        while in_flight:
+            oldest_email, future = in_flight.popleft()
+            yield (oldest_email, *future.result())
+
+"""
+scan_watched
+
+Yields (eml file, (result, error), message metrics or None) for every eml
+file the watcher picks up, as soon as it is analyzed, until interrupted.
+Analyzed files are moved to processed_folder and failed ones to
+failed_folder (or marked in place when the folder is None)
+"""
+def scan_watched(watcher, client, processed_folder=None, failed_folder=None,
+                 timed=False, profile=None, text_reports=True):
+    # Imported here, only a watched folder needs it
+    from watcher import move_processed
+    while True:
+        email = watcher.get(timeout=1)
+        if email is None:
+            continue
+        metrics = new_metrics(email, timed, profile)
+        result, error = finish_email(email, start_email(email, client, metrics), metrics, text_reports)
+        try:
+            if error:
+                move_processed(email, failed_folder, "failed")
+            else:
+                move_processed(email, processed_folder, "done")
+        except OSError as e:
+            print(f"{email.name}: could not be moved ({describe_error(e)}), it will be ignored")
+        watcher.done(email)
+        yield email, (result, error), finish_metrics(metrics, email.name)
+
+"""
+skip_unchanged
+
+Yields only the sources the manifest says need analyzing. The manifest key
+of every source is added to seen. With text_reports a source whose report
+is missing is analyzed again
+"""
+def skip_unchanged(sources, manifest, seen, text_reports=True):
+    for source in sources:
+        seen.add(manifest.key(source))
+        if manifest.needs_update(source, report_path(source) if text_reports else None):
+            yield source
+
+"""
+add_geo_arguments
+
+Adds the geolocation options to an argument parser
+"""
+def add_geo_arguments(parser):
+    parser.add_argument("--geo-url", default=IP_API_URL,
+                        help="base url of the ip-api.com compatible geolocation service")
+    parser.add_argument("--geo-db", metavar="INDEX",
+                        help="geolocate offline from an index built by offline_geolocator.py")
+    parser.add_argument("--geo-cache", default=DEFAULT_CACHE_PATH,
+                        help=f"geolocation cache file (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--geo-cache-ttl", type=float, default=30,
+                        help="days before a cached location is looked up again (default: 30)")
+    parser.add_argument("--geo-cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"most ips kept in the geolocation cache (default: {DEFAULT_MAX_ENTRIES})")
+    parser.add_argument("--no-geo-cache", action="store_true",
+                        help="always geolocate over the network")
+
+"""
+geo_options_from_args
+
+Returns the options for configure_default_client from the parsed geolocation arguments
+"""
+def geo_options_from_args(args):
+    if args.geo_db:
+        return {"offline_db": args.geo_db}
+    geo_options = {"base_url": args.geo_url}
+    if not args.no_geo_cache:
+        geo_options["cache"] = {
+            "path": args.geo_cache,
+            "ttl": args.geo_cache_ttl * 24 * 3600,
+            "max_entries": args.geo_cache_size
+        }
+    return geo_options
+
+"""
+add_limit_arguments
+
+Adds the message size limits (see DEFAULT_LIMITS in eml_ingest.py) to an
+argument parser
+"""
+def add_limit_arguments(parser):
+    parser.add_argument("--max-message-bytes", type=int, default=DEFAULT_LIMITS["max_message_bytes"],
+                        help="bytes of a message read, the rest is skipped (default: %(default)s)")
+    parser.add_argument("--max-parts", type=int, default=DEFAULT_LIMITS["max_parts"],
+                        help="MIME parts of a message parsed (default: %(default)s)")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_LIMITS["max_depth"],
+                        help="deepest nesting of MIME parts parsed (default: %(default)s)")
+    parser.add_argument("--max-body-chars", type=int, default=DEFAULT_LIMITS["max_body_chars"],
+                        help="characters of the body analyzed (default: %(default)s)")
+    parser.add_argument("--max-attachments", type=int, default=DEFAULT_LIMITS["max_attachments"],
+                        help="attachments of a message inspected (default: %(default)s)")
+
+"""
+limits_from_args
+
+Returns the limits for configure_limits from the parsed limit arguments
+"""
+def limits_from_args(args):
+    return {limit: getattr(args, limit) for limit in DEFAULT_LIMITS}
+
+"""
+add_analysis_arguments
+
+Adds the options of every scan to an argument parser: where results go,
+geolocation, message limits, triage, keyword matching, hash index and scoring
+"""
+def add_analysis_arguments(parser):
+    parser.add_argument("--format", choices=["text", "jsonl", "both"], default="text",
+                        help="write a text report per file, JSON Lines results or both (default: text)")
+    parser.add_argument("--jsonl", default=DEFAULT_RESULTS_PATH, metavar="PATH",
+                        help=f"file the JSON Lines results are appended to (default: {DEFAULT_RESULTS_PATH})")
+    parser.add_argument("--store", nargs="?", const=DEFAULT_STORE_PATH, metavar="PATH",
+                        help="also add every result to a SQLite database for \"main.py query\" "
+                             f"(default path: {DEFAULT_STORE_PATH})")
+    add_geo_arguments(parser)
+    add_limit_arguments(parser)
+    parser.add_argument("--triage", action="store_true",
+                        help="check the sender and hops first and stop analyzing a message as soon as it "
+                             "is certain to be HIGH RISK, skipping the body, url, keyword and attachment "
+                             "checks left (without it every check runs)")
+    parser.add_argument("--whole-words", action="store_true",
+                        help="only match keywords as complete words (\"gift card\" no longer matches "
+                             "\"gift cards\"), by default they match anywhere in the text")
+    parser.add_argument("--hash-index", metavar="INDEX",
+                        help="check attachments against known malicious hashes in an index built by "
+                             "hash_reputation.py")
+    parser.add_argument("--scoring", metavar="FILE",
+                        help="JSON file with the indicator weights and grade thresholds to use (see README)")
+
+"""
+parse_args
+
+Returns the parsed command line arguments of scan-dir, which are also those
+of main.py without a command
+"""
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Scan .eml files for email threat indicators",
+                                     epilog="commands: scan FILE..., scan-dir [SOURCE...], rescore [FEATURES], query, "
+                                            "geolocate IP... (see \"main.py COMMAND --help\"). "
+                                            "Without a command main.py works like scan-dir")
+    parser.add_argument("sources", nargs="*",
+                        help=".eml files, folders, Maildirs, mbox files or zip/tar archives "
+                             "(default: the emails folder)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes (default: 1, no pool)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only analyze eml files that are new or changed since the last run")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH,
+                        help=f"manifest used by --incremental (default: {DEFAULT_MANIFEST_PATH})")
+    add_analysis_arguments(parser)
+    parser.add_argument("--campaigns", action="store_true",
+                        help="analyze the body, URLs and attachments of near-identical messages once")
+    parser.add_argument("--campaign-distance", type=int, default=DEFAULT_MAX_DISTANCE, choices=range(4),
+                        help="bits two message fingerprints may differ in to be one campaign "
+                             f"(default: {DEFAULT_MAX_DISTANCE})")
+    parser.add_argument("--features", nargs="?", const=DEFAULT_FEATURES_PATH, metavar="PATH",
+                        help="save the indicator counts of every message as a matrix for risk_scoring.py "
+                             f"(default path: {DEFAULT_FEATURES_PATH})")
+    parser.add_argument("--watch", metavar="FOLDER",
+                        help="keep running and analyze .eml files as they arrive in FOLDER")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"seconds between checks of the watched folder (default: {DEFAULT_POLL_INTERVAL})")
+    parser.add_argument("--processed", metavar="FOLDER",
+                        help="where watched files go once analyzed (default: FOLDER/processed)")
+    parser.add_argument("--failed", metavar="FOLDER",
+                        help="where watched files that could not be analyzed go (default: FOLDER/failed)")
+    parser.add_argument("--mark-processed", action="store_true",
+                        help="rename watched files to NAME.eml.done / NAME.eml.failed instead of moving them")
+    parser.add_argument("--metrics", nargs="?", const=DEFAULT_METRICS_PATH, metavar="PATH",
+                        help="time each stage, print a summary and write the metrics as JSON "
+                             f"(default path: {DEFAULT_METRICS_PATH})")
+    parser.add_argument("--profile", metavar="NAME",
+                        help="run cProfile while analyzing the files whose name matches "
+                             "this pattern, e.g. \"phish*.eml\" (implies --metrics)")
+    args = parser.parse_args(argv)
+    if args.watch and (args.sources or args.incremental or args.workers > 1):
+        parser.error("--watch cannot be combined with sources, --incremental or --workers")
+    return args
+
+"""
+parse_scan_args
+
+Returns the parsed command line arguments of scan
+"""
+def parse_scan_args(argv):
+    parser = argparse.ArgumentParser(prog="main.py scan",
+                                     description="Scan a few messages one after the other, starting quickly")
+    parser.add_argument("sources", nargs="+",
+                        help=".eml files, mbox files or zip/tar archives")
+    add_analysis_arguments(parser)
+    # The batch options of scan-dir, all off
+    parser.set_defaults(workers=1, incremental=False, campaigns=False, campaign_distance=DEFAULT_MAX_DISTANCE,
+                        features=None, watch=None, metrics=None, profile=None)
+    return parser.parse_args(argv)
+
+"""
+print_geolocation_stats
+
+Prints the lookup rate, latency and cache counters of the geolocation client
+"""
+def print_geolocation_stats(stats):
+    if "offline_lookups" in stats:
+        print(f"Geolocation: {stats['offline_lookups']} offline lookups, "
+              f"{stats['lookups_per_sec']:.0f} lookups/sec")
+        return
+    cache = stats["cache"]
+    if cache is not None:
+        print(f"Geolocation cache: {cache['hits']} hits, {cache['misses']} misses, "
+              f"{cache['evictions']} evictions, {cache['entries']} entries")
+    if not stats["network_lookups"]:
+        return
+    print(f"Geolocation: {stats['network_lookups']} lookups in {stats['batch_requests']} requests, "
+          f"{stats['lookups_per_sec']:.1f} lookups/sec, latency p50 {stats['latency_p50_ms']:.1f} ms, "
+          f"p90 {stats['latency_p90_ms']:.1f} ms, p99 {stats['latency_p99_ms']:.1f} ms")
+
+"""
+print_campaigns
+
+Prints how many messages came in campaigns and the largest campaigns
+"""
+def print_campaigns(campaigns, largest=5):
+    repeated = [campaign for campaign in campaigns if campaign["size"] > 1]
+    messages = sum(campaign["size"] for campaign in repeated)
+    reused = sum(campaign["reused"] for campaign in campaigns)
+    print(f"Campaigns: {messages} messages in {len(repeated)} campaigns of two or more, "
+          f"findings reused for {reused} messages")
+    for campaign in repeated[:largest]:
+        print(f"  {campaign['id']}: {campaign['size']} messages, first {campaign['representative']}")
+
+"""
+run_scan
+
+Scans the sources of parsed scan or scan-dir arguments
+"""
+def run_scan(args):
+    limits = limits_from_args(args)
+    configure_limits(limits)
+    configure_campaign_detection(args.campaigns, args.campaign_distance)
+    if args.scoring:
+        try:
+            configure_scoring(load_scoring(args.scoring))
+        except (OSError, ValueError) as e:
+            print(f"{args.scoring}: {describe_error(e)}")
+            return
+    settings = {"scoring": get_scoring()} if args.scoring else {}
+    if args.triage:
+        configure_triage(True)
+        settings["triage"] = True
+    if args.whole_words:
+        configure_whole_words(True)
+        settings["whole_words"] = True
+    if limits != DEFAULT_LIMITS:
+        settings["limits"] = limits
+    if args.campaigns:
+        settings["campaign_distance"] = args.campaign_distance
+    # Hops are classified as foreign from their locations
+    if args.geo_db:
+        settings["geolocation"] = {"offline_db": os.path.abspath(args.geo_db)}
+    elif args.geo_url != IP_API_URL:
+        settings["geolocation"] = {"url": args.geo_url}
+    if args.hash_index:
+        configure_hash_index(args.hash_index)
+        try:
+            settings["hash_index"] = get_hash_index().version
+        except (OSError, ValueError) as e:
+            print(f"{args.hash_index}: {describe_error(e)}")
+            return
+    if args.watch:
+        if not os.path.isdir(args.watch):
+            print(f"{args.watch} not found.")
+            return
+        sources = None
+    elif args.sources:
+        sources = iter_sources(args.sources)
+    else:
+        sources = list_eml_files()
+        if not sources:
+            return
+
+    text_reports = args.format != "jsonl"
+    # Skipped messages are not written again, their results must already be in these
+    output_paths = []
+    if args.format != "text":
+        output_paths.append(args.jsonl)
+    if args.store:
+        output_paths.append(args.store)
+    if output_paths:
+        settings["outputs"] = [os.path.abspath(path) for path in output_paths]
+    manifest = None
+    seen = set()
+    if args.incremental:
+        # Imported here, only an incremental scan keeps a manifest
+        from manifest import Manifest, rules_version
+        # Results from other settings (weights, hash index, limits, geolocation, outputs) are of no use either
+        manifest = Manifest(args.manifest, rules_version(settings) if settings else None)
+        # A new JSONL file or database would lack the results of skipped messages
+        if not all(os.path.exists(path) for path in output_paths):
+            manifest.forget()
+        sources = skip_unchanged(sources, manifest, seen, text_reports)
+
+    geo_options = geo_options_from_args(args)
+    if args.profile and not args.metrics:
+        args.metrics = DEFAULT_METRICS_PATH
+    timed = args.metrics is not None
+    run_metrics = None
+    if timed:
+        # Imported here, only a timed run needs it
+        from pipeline_metrics import RunMetrics, print_profile, print_run_metrics
+        run_metrics = RunMetrics()
+
+    client = None
+    watcher = None
+    if args.watch:
+        # Imported here, only a watched folder needs it
+        from watcher import FolderWatcher, stop_on_sigterm
+        configure_default_client(geo_options)
+        client = get_default_client()
+        watcher = FolderWatcher(args.watch, args.poll_interval)
+        processed_folder = failed_folder = None
+        if not args.mark_processed:
+            processed_folder = args.processed or os.path.join(args.watch, "processed")
+            failed_folder = args.failed or os.path.join(args.watch, "failed")
+        results = scan_watched(watcher, client, processed_folder, failed_folder, timed=timed,
+                               profile=args.profile, text_reports=text_reports)
+        stop_on_sigterm()
+        watcher.start()
+        print(f"Watching {args.watch} for .eml files, press Ctrl+C to stop")
+    elif args.workers > 1:
+        results = scan_parallel(sources, args.workers, geo_options, timed=timed, profile=args.profile,
+                                text_reports=text_reports, campaigns=(args.campaigns, args.campaign_distance))
+    else:
+        configure_default_client(geo_options)
+        client = get_default_client()
+        results = scan_serial(sources, client, timed=timed, profile=args.profile,
+                              text_reports=text_reports)
+    jsonl_writer = JsonlWriter(args.jsonl) if args.format != "text" else None
+    store = None
+    if args.store:
+        # Imported here, sqlite3 is only needed with --store
+        from results_store import ResultsStore
+        store = ResultsStore(args.store)
+    feature_matrix = None
+    if args.features:
+        # Imported here, numpy is only needed for the feature matrix
+        from risk_scoring import FeatureMatrix
+        feature_matrix = FeatureMatrix(get_scoring())
+
+    analyzed = 0
+    failed = 0
+    campaigns = []
+    try:
+        for email, (result, error), message_metrics in results:
+            analyzed += 1
+            if run_metrics is not None:
+                run_metrics.add(email.name, message_metrics, failed=bool(error))
+            if error:
+                failed += 1
+                print(f"{email.name}: failed ({error})")
+                if jsonl_writer is not None:
+                    jsonl_writer.write({"source": describe_source(email), "error": error})
+                if store is not None:
+                    store.add({"source": describe_source(email), "error": error})
+            else:
+                print(f"{email.name}: {result['risk_rating']} ({result['risk_grade']})")
+                if jsonl_writer is not None:
+                    jsonl_writer.write(result)
+                if store is not None:
+                    store.add(result)
+                if manifest is not None:
+                    manifest.record(email, (result["risk_rating"], result["risk_grade"]))
+                if result["campaign"] is not None:
+                    campaigns.append(result["campaign"])
+                if feature_matrix is not None:
+                    feature_matrix.add(email.name, result["indicators"])
+            # A watched folder gets files one at a time, make each result visible
+            if watcher is not None and watcher.idle():
+                if jsonl_writer is not None:
+                    jsonl_writer.flush()
+                if store is not None:
+                    store.flush()
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+        print("Stopped watching")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+
+    if jsonl_writer is not None:
+        jsonl_writer.close()
+        print(f"{jsonl_writer.written} results written to {args.jsonl}")
+    if store is not None:
+        store.close()
+        print(f"{store.written} results stored in {args.store}")
+    if feature_matrix is not None:
+        feature_matrix.save(args.features)
+        print(f"Indicator counts of {len(feature_matrix.names)} messages written to {args.features}")
+
+    if failed:
+        print(f"{failed} of {analyzed} files could not be analyzed")
+    if args.campaigns:
+        from campaign_index import summarize_campaigns
+        print_campaigns(summarize_campaigns(campaigns))
+    if manifest is not None:
+        print(f"{len(seen) - analyzed} unchanged files skipped")
+        manifest.prune(seen)
+        manifest.save()
+
+    stats = None
+    if client is not None:
+        stats = client.stats()
+        client.close()
+        print_geolocation_stats(stats)
+    elif args.workers > 1:
+        # Every worker process has its own client, caches and hash index
+        print("Geolocation, URL cache and hash index statistics are not collected with --workers")
+
+    # Workers keep their own index, only a serial run knows the counts
+    if get_hash_index() is not None and get_hash_index().lookups:
+        hash_stats = get_hash_index().stats()
+        print(f"Hash index: {hash_stats['lookups']} attachments checked, {hash_stats['matches']} known bad, "
+              f"{hash_stats['bloom_rejected']} ruled out by the Bloom filter, "
+              f"{hash_stats['lookups_per_sec']:.0f} lookups/sec")
+
+    if run_metrics is not None:
+        # Workers keep their own caches, only a serial run knows the counts
+        url_cache = HOSTNAME_VERDICTS.stats() if client is not None else None
+        summary = run_metrics.summary(geolocation=stats, url_cache=url_cache)
+        print_run_metrics(summary)
+        run_metrics.save(args.metrics, summary)
+        print(f"Metrics written to {args.metrics}")
+        for path in run_metrics.profiles:
+            print_profile(path)
+
+"""
+scan_command
+
+Scans the messages given on the command line serially, without the batch
+machinery (workers, manifest, watcher) of scan-dir
+"""
+def scan_command(argv):
+    run_scan(parse_scan_args(argv))
+
+"""
+scan_dir_command
+
+Scans folders, Maildirs, mbox files or archives, by default the emails folder
+"""
+def scan_dir_command(argv):
+    run_scan(parse_args(argv, prog="main.py scan-dir"))
+
+"""
+rescore_command
+
+Grades a saved feature matrix with other weights (see risk_scoring.py)
+"""
+def rescore_command(argv):
+    # Imported here, numpy is only needed for re-scoring
+    import risk_scoring
+    risk_scoring.main(["rescore"] + argv)
+
+"""
+query_command
+
+Counts or lists the results stored with --store (see results_store.py)
+"""
+def query_command(argv):
+    # Imported here, only this command reads the store
+    from results_store import parse_query_args, run_query
+    run_query(parse_query_args(argv, prog="main.py query"))
+
+"""
+geolocate_command
+
+Prints the location of every ip given on the command line
+"""
+def geolocate_command(argv):
+    parser = argparse.ArgumentParser(prog="main.py geolocate", description="Print the location of ip addresses")
+    parser.add_argument("ips", nargs="+", metavar="IP")
+    add_geo_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_default_client(geo_options_from_args(args))
+    client = get_default_client()
+    try:
+        for location in client.geolocate_ips(args.ips):
+            print(f"{location['ip']}: {location['city']}, {location['region']}, {location['country']}")
+    finally:
+        client.close()
+
+# Subcommand name -> function taking the rest of the command line
+COMMANDS = {
+    "scan": scan_command,
+    "scan-dir": scan_dir_command,
+    "rescore": rescore_command,
+    "query": query_command,
+    "geolocate": geolocate_command
+}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        # No command, as before subcommands existed
+        run_scan(parse_args(argv))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
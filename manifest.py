@@ -0,0 +1,190 @@
+"""
+manifest.py
+
+This remembers which eml files have already been analyzed
+
+The manifest records the size, mtime and SHA-256 of every analyzed eml file
+along with its result and the version of the rules used. A file is analyzed
+again only if it is new, its content changed, its report is missing or the
+rules changed. Unchanged files are recognised from a stat call alone.
+Messages from mailboxes and archives are recognised by their content hash,
+under the resolved path of their container and their location in it.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from defaults import DEFAULT_MANIFEST_PATH
+
+# Modules whose rule sets, weights or logic decide the results. Editing any of
+# them invalidates every entry in the manifest
+RULE_MODULES = [
+    "eml_ingest.py",
+    "received_parser.py",
+    "html_extractor.py",
+    "campaign_index.py",
+    "attachment_inspector.py",
+    "hash_reputation.py",
+    "header_analyzer.py",
+    "url_analyzer.py",
+    "keyword_matcher.py",
+    "text_analyzer.py",
+    "report_generator.py"
+]
+
+"""
+rules_version
+
+Returns a hash of the modules in RULE_MODULES, and of any settings that
+change the results, such as the scoring config (see load_scoring in
+report_generator.py) or the version of the hash index
+"""
+def rules_version(settings=None):
+    version = hashlib.sha256()
+    source_folder = Path(__file__).resolve().parent
+    for module in RULE_MODULES:
+        version.update(module.encode())
+        version.update((source_folder / module).read_bytes())
+    if settings:
+        version.update(json.dumps(settings, sort_keys=True).encode())
+    return version.hexdigest()[:16]
+
+"""
+file_sha256
+
+Returns the SHA-256 of a file, read a block at a time
+"""
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as binary_file:
+        for block in iter(lambda: binary_file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+"""
+Manifest
+
+The analyzed files of a previous run. Load it, ask needs_update for each
+file, record what was analyzed and save it at the end of the run
+"""
+class Manifest:
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, version=None):
+        self.path = path
+        self.version = version or rules_version()
+        self.entries = {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                saved = json.load(manifest_file)
+        except (OSError, ValueError):
+            saved = None
+        # Results from other rules are of no use
+        if saved and saved.get("rules_version") == self.version:
+            self.entries = saved.get("files", {})
+
+    """
+    key
+
+    Returns the manifest entry name of an eml file path or of a message from a
+    container (see mail_sources.py). Containers are resolved, so equally named
+    mailboxes in different folders are kept apart
+    """
+    def key(self, eml_path):
+        container = getattr(eml_path, "container", None)
+        if container is not None:
+            return f"{Path(container).resolve()} ({eml_path.location})"
+        return str(eml_path)
+
+    """
+    needs_update
+
+    Returns True if the eml file has to be analyzed, otherwise False.
+    report_filepath is the report the file should have
+    """
+    def needs_update(self, eml_path, report_filepath=None):
+        entry = self.entries.get(self.key(eml_path))
+        if entry is None:
+            return True
+        if report_filepath is not None and not os.path.exists(report_filepath):
+            return True
+
+        # Messages from containers (see mail_sources.py) are already in memory
+        data = getattr(eml_path, "data", None)
+        if data is not None:
+            return hashlib.sha256(data).hexdigest() != entry["sha256"]
+
+        status = os.stat(eml_path)
+        if status.st_size != entry["size"]:
+            return True
+        if status.st_mtime_ns == entry["mtime_ns"]:
+            return False
+
+        # Touched but possibly unchanged, only the content decides
+        if file_sha256(eml_path) != entry["sha256"]:
+            return True
+        entry["mtime_ns"] = status.st_mtime_ns
+        return False
+
+    """
+    forget
+
+    Drops every entry, so every file is analyzed again
+    """
+    def forget(self):
+        self.entries = {}
+
+    """
+    record
+
+    Stores an analyzed eml file and its (risk rating, risk grade) result
+    """
+    def record(self, eml_path, result):
+        data = getattr(eml_path, "data", None)
+        if data is not None:
+            self.entries[self.key(eml_path)] = {
+                "size": len(data),
+                "mtime_ns": None,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "result": list(result)
+            }
+            return
+
+        status = os.stat(eml_path)
+        self.entries[self.key(eml_path)] = {
+            "size": status.st_size,
+            "mtime_ns": status.st_mtime_ns,
+            "sha256": file_sha256(eml_path),
+            "result": list(result)
+        }
+
+    """
+    result
+
+    Returns the recorded (risk rating, risk grade) of an eml file
+    """
+    def result(self, eml_path):
+        return tuple(self.entries[self.key(eml_path)]["result"])
+
+    """
+    prune
+
+    Forgets files that are no longer in eml_paths (paths or their keys)
+    """
+    def prune(self, eml_paths):
+        keep = {self.key(eml_path) for eml_path in eml_paths}
+        for key in list(self.entries):
+            if key not in keep:
+                del self.entries[key]
+
+    """
+    save
+
+    Writes the manifest, replacing the old one only once it is complete
+    """
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump({"rules_version": self.version, "files": self.entries}, manifest_file)
+        os.replace(temp_path, self.path)
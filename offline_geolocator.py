@@ -0,0 +1,227 @@
+"""
+offline_geolocator.py
+
+This geolocates ips without network access, from a local ip range database
+
+A CSV of CIDR ranges (network,city,region,country) is built once into a
+compact index file of sorted range arrays. The index is memory-mapped and
+searched with binary search, so loading it is instant even with millions of
+ranges. Ranges are expected not to overlap, like the common GeoIP CSV exports.
+
+Build an index:  python offline_geolocator.py build ranges.csv ranges.idx
+Look up ips:     python offline_geolocator.py lookup ranges.idx 8.8.8.8 2001:db8::1
+"""
+
+import bisect
+import csv
+import ipaddress
+import mmap
+import socket
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import Future
+from geolocator import LocationRequest, placeholder_location
+
+MAGIC = b"GEOIDX01"
+# magic, byte order, ipv4 range count, ipv6 range count, location count
+HEADER = struct.Struct("<8s8sQQQ")
+
+"""
+read_ranges
+
+Yields (network, city, region, country) rows from a range CSV,
+skipping a header row and blank or comment lines
+"""
+def read_ranges(csv_path):
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        for row in csv.reader(csv_file):
+            if not row or row[0].startswith("#") or row[0].strip().lower() == "network":
+                continue
+            network = ipaddress.ip_network(row[0].strip(), strict=False)
+            city, region, country = (row[1:4] + ["N/A"] * 3)[:3]
+            yield network, city or "N/A", region or "N/A", country or "N/A"
+
+"""
+build_index
+
+Builds the index file from a range CSV. Returns the number of
+(ipv4, ipv6) ranges written
+"""
+def build_index(csv_path, index_path):
+    location_ids = {}
+    ipv4_ranges = []
+    ipv6_ranges = []
+
+    for network, city, region, country in read_ranges(csv_path):
+        location_id = location_ids.setdefault((city, region, country), len(location_ids))
+        entry = (int(network.network_address), int(network.broadcast_address), location_id)
+        if network.version == 4:
+            ipv4_ranges.append(entry)
+        else:
+            ipv6_ranges.append(entry)
+    ipv4_ranges.sort()
+    ipv6_ranges.sort()
+
+    # Location strings are stored once each, as "city\tregion\tcountry"
+    location_blob = bytearray()
+    location_offsets = array("Q", [0])
+    for city, region, country in location_ids:
+        location_blob += "\t".join((city, region, country)).encode("utf-8")
+        location_offsets.append(len(location_blob))
+
+    with open(index_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, sys.byteorder.encode().ljust(8, b"\0"),
+                                     len(ipv4_ranges), len(ipv6_ranges), len(location_ids)))
+        # IPv4 ranges as native uint32 arrays so they can be searched in place
+        for column in range(3):
+            array("I", (entry[column] for entry in ipv4_ranges)).tofile(index_file)
+        # IPv6 addresses as 16 byte big endian strings, which sort like the numbers
+        for column in range(2):
+            for entry in ipv6_ranges:
+                index_file.write(entry[column].to_bytes(16, "big"))
+        array("I", (entry[2] for entry in ipv6_ranges)).tofile(index_file)
+        location_offsets.tofile(index_file)
+        index_file.write(location_blob)
+
+    return len(ipv4_ranges), len(ipv6_ranges)
+
+"""
+OfflineGeolocator
+
+Looks ips up in a memory-mapped index built by build_index. Has the same
+lookup interface as geolocator.GeolocationClient so it can replace it
+"""
+class OfflineGeolocator:
+    def __init__(self, index_path):
+        self.index_file = open(index_path, "rb")
+        self.map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, ipv4_count, ipv6_count, location_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path} is not a geolocation index")
+        if byteorder.rstrip(b"\0").decode() != sys.byteorder:
+            raise ValueError(f"{index_path} was built on a machine with a different byte order")
+
+        view = memoryview(self.map)
+        offset = HEADER.size
+        self.ipv4_starts, offset = view[offset:offset + 4 * ipv4_count].cast("I"), offset + 4 * ipv4_count
+        self.ipv4_ends, offset = view[offset:offset + 4 * ipv4_count].cast("I"), offset + 4 * ipv4_count
+        self.ipv4_locations, offset = view[offset:offset + 4 * ipv4_count].cast("I"), offset + 4 * ipv4_count
+        self.ipv6_count = ipv6_count
+        self.ipv6_starts, offset = offset, offset + 16 * ipv6_count
+        self.ipv6_ends, offset = offset, offset + 16 * ipv6_count
+        self.ipv6_locations, offset = view[offset:offset + 4 * ipv6_count].cast("I"), offset + 4 * ipv6_count
+        self.location_offsets = view[offset:offset + 8 * (location_count + 1)].cast("Q")
+        self.location_blob = offset + 8 * (location_count + 1)
+
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    """
+    lookup
+
+    Returns the location of a single ip (placeholders if it is not covered)
+    """
+    def lookup(self, ip):
+        start = time.perf_counter()
+        # inet_pton is much cheaper than building an ipaddress object
+        try:
+            location_id = self._find_ipv4(int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big"))
+        except OSError:
+            try:
+                location_id = self._find_ipv6(socket.inet_pton(socket.AF_INET6, ip))
+            except OSError:
+                location_id = None
+        location = self._location(ip, location_id)
+        self.lookup_time += time.perf_counter() - start
+        self.lookups += 1
+        return location
+
+    """
+    geolocate_ips
+
+    Returns a list of identified locations based on a list of ips
+    """
+    def geolocate_ips(self, ip_list):
+        return [self.lookup(ip) for ip in ip_list]
+
+    """
+    lookup_async
+
+    Looks the ips up straight away, returns an already finished LocationRequest
+    """
+    def lookup_async(self, ip_list):
+        futures = []
+        for location in self.geolocate_ips(ip_list):
+            future = Future()
+            future.set_result(location)
+            futures.append(future)
+        return LocationRequest(futures)
+
+    """
+    stats
+
+    Returns the number of lookups and lookups per second
+    """
+    def stats(self):
+        return {
+            "offline_lookups": self.lookups,
+            "lookups_per_sec": self.lookups / self.lookup_time if self.lookup_time > 0 else 0.0,
+            "network_lookups": 0,
+            "cache": None
+        }
+
+    def close(self):
+        for name in ("ipv4_starts", "ipv4_ends", "ipv4_locations", "ipv6_locations",
+                     "location_offsets"):
+            getattr(self, name).release()
+        self.map.close()
+        self.index_file.close()
+
+    # Binary search for the range holding an IPv4 address
+    def _find_ipv4(self, value):
+        position = bisect.bisect_right(self.ipv4_starts, value) - 1
+        if position >= 0 and self.ipv4_ends[position] >= value:
+            return self.ipv4_locations[position]
+        return None
+
+    # Binary search over the 16 byte IPv6 starts directly in the mapped file
+    def _find_ipv6(self, packed):
+        low, high = 0, self.ipv6_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.ipv6_starts + 16 * middle
+            if self.map[start:start + 16] <= packed:
+                low = middle + 1
+            else:
+                high = middle
+        position = low - 1
+        if position >= 0:
+            end = self.ipv6_ends + 16 * position
+            if self.map[end:end + 16] >= packed:
+                return self.ipv6_locations[position]
+        return None
+
+    def _location(self, ip, location_id):
+        if location_id is None:
+            return placeholder_location(ip)
+        start = self.location_blob + self.location_offsets[location_id]
+        end = self.location_blob + self.location_offsets[location_id + 1]
+        city, region, country = self.map[start:end].decode("utf-8").split("\t")
+        return {"ip": ip, "city": city, "region": region, "country": country}
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == "build":
+        ipv4_count, ipv6_count = build_index(argv[1], argv[2])
+        print(f"Wrote {argv[2]}: {ipv4_count} IPv4 ranges, {ipv6_count} IPv6 ranges")
+    elif len(argv) >= 3 and argv[0] == "lookup":
+        geolocator = OfflineGeolocator(argv[1])
+        for location in geolocator.geolocate_ips(argv[2:]):
+            print(f"{location['ip']}: {location['city']}, {location['region']}, {location['country']}")
+        geolocator.close()
+    else:
+        print(__doc__.strip())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,256 @@
+"""
+pipeline_metrics.py
+
+This times the stages of the analysis of each message
+
+A MessageMetrics follows one message through the pipeline. Each stage ends
+with a call to lap, which adds the time since the previous lap to that stage,
+and add counts things like bytes parsed and urls checked. RunMetrics collects
+the messages of a run into a summary and a JSON metrics file.
+
+When metrics are off the pipeline is handed DISABLED_METRICS, whose methods
+do nothing, so the cost is a few empty method calls per message.
+"""
+
+import heapq
+import json
+import os
+import time
+from geolocator import percentile
+
+PROFILE_FOLDER = os.path.join("reports", "profiles")
+# Messages listed with their stage breakdown in the summary
+SLOWEST_MESSAGES = 5
+
+"""
+MessageMetrics
+
+Stage times (seconds) and counters of one message. With profile, cProfile
+runs whenever the message is being worked on
+"""
+class MessageMetrics:
+    def __init__(self, profile=False):
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+        if profile:
+            # Imported here, only profiled runs need it
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.last = time.perf_counter()
+
+    """
+    resume
+
+    Starts timing again, after the message waited for its turn
+    """
+    def resume(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.last = time.perf_counter()
+
+    """
+    pause
+
+    Stops the profiler while other messages are worked on
+    """
+    def pause(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    """
+    lap
+
+    Adds the time since the previous lap to stage
+    """
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    """
+    add
+
+    Adds amount to a counter
+    """
+    def add(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    """
+    as_dict
+
+    Returns the stage times in ms and the counters, picklable for worker processes
+    """
+    def as_dict(self):
+        stages_ms = {stage: seconds * 1000 for stage, seconds in self.stages.items()}
+        return {"total_ms": sum(stages_ms.values()), "stages_ms": stages_ms, **self.counters}
+
+"""
+DisabledMetrics
+
+Stands in for MessageMetrics when metrics are off
+"""
+class DisabledMetrics:
+    profiler = None
+
+    def resume(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def add(self, counter, amount=1):
+        pass
+
+    def as_dict(self):
+        return None
+
+DISABLED_METRICS = DisabledMetrics()
+
+"""
+profile_path
+
+Returns the path of the cProfile output written for a message
+"""
+def profile_path(name):
+    safe_name = "".join(c if c.isalnum() or c in "._-" else "_" for c in str(name))
+    return os.path.join(PROFILE_FOLDER, safe_name + ".prof")
+
+"""
+finish_metrics
+
+Writes the profile of a message, if it was profiled, and returns its
+metrics as a dict (None when metrics are off)
+"""
+def finish_metrics(metrics, name):
+    message = metrics.as_dict()
+    if metrics.profiler is not None:
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        metrics.profiler.dump_stats(profile_path(name))
+        message["profile"] = profile_path(name)
+    return message
+
+"""
+print_profile
+
+Prints the functions with the most cumulative time from a profile file
+"""
+def print_profile(path, limit=15):
+    # Imported here, only profiled runs need it
+    import pstats
+    print(f"Profile written to {path}")
+    pstats.Stats(path).sort_stats("cumulative").print_stats(limit)
+
+"""
+RunMetrics
+
+Collects the metrics of every message in a run
+"""
+class RunMetrics:
+    def __init__(self, slowest=SLOWEST_MESSAGES):
+        self.started = time.perf_counter()
+        self.messages = 0
+        self.failed = 0
+        self.stage_times = {}
+        self.counters = {}
+        self.slowest_count = slowest
+        # Min-heap of (total ms, order, name, message metrics) holding the slowest messages
+        self.slowest = []
+        self.profiles = []
+
+    """
+    add
+
+    Adds the metrics of one message (see MessageMetrics.as_dict)
+    """
+    def add(self, name, message, failed=False):
+        self.messages += 1
+        if failed:
+            self.failed += 1
+        if message is None:
+            return
+        for stage, ms in message["stages_ms"].items():
+            self.stage_times.setdefault(stage, []).append(ms)
+        for counter, amount in message.items():
+            if isinstance(amount, int):
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+        if "profile" in message:
+            self.profiles.append(message["profile"])
+
+        entry = (message["total_ms"], self.messages, str(name), message)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    """
+    summary
+
+    Returns the run metrics as a dict. geolocation and url_cache are the
+    stats of the geolocation client and the URL hostname cache, if known
+    """
+    def summary(self, geolocation=None, url_cache=None):
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for stage, times in self.stage_times.items():
+            stages[stage] = {
+                "total_ms": sum(times),
+                "mean_ms": sum(times) / len(times),
+                "p50_ms": percentile(times, 50),
+                "p90_ms": percentile(times, 90),
+                "p99_ms": percentile(times, 99)
+            }
+        return {
+            "messages": self.messages,
+            "failed": self.failed,
+            "elapsed_s": elapsed,
+            "messages_per_sec": self.messages / elapsed if elapsed else 0.0,
+            "counters": dict(self.counters),
+            "stages": stages,
+            "slowest": [{"name": name, **message}
+                        for _, _, name, message in sorted(self.slowest, reverse=True)],
+            "geolocation": geolocation,
+            "url_cache": url_cache
+        }
+
+    """
+    save
+
+    Writes the summary as JSON to path
+    """
+    def save(self, path, summary):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            json.dump(summary, metrics_file, indent=2)
+
+"""
+print_run_metrics
+
+Prints the end of run summary
+"""
+def print_run_metrics(summary):
+    counters = summary["counters"]
+    print(f"Analyzed {summary['messages']} messages in {summary['elapsed_s']:.2f} s "
+          f"({summary['messages_per_sec']:.1f} messages/sec), "
+          f"{counters.get('bytes', 0) / 1024:.0f} KiB parsed, {counters.get('urls', 0)} urls checked, "
+          f"{counters.get('ips', 0)} hop ips, {counters.get('attachments', 0)} attachments")
+
+    total = sum(stage["total_ms"] for stage in summary["stages"].values()) or 1
+    print(f"  {'stage':<12} {'total ms':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'share':>6}")
+    for name, stage in summary["stages"].items():
+        print(f"  {name:<12} {stage['total_ms']:>10.1f} {stage['p50_ms']:>8.2f} {stage['p90_ms']:>8.2f} "
+              f"{stage['p99_ms']:>8.2f} {stage['total_ms'] / total:>6.1%}")
+
+    url_cache = summary["url_cache"]
+    if url_cache is not None:
+        print(f"URL hostname cache: {url_cache['hits']} hits, {url_cache['misses']} misses "
+              f"({url_cache['hit_rate']:.0%} hit rate), {url_cache['entries']} hostnames")
+
+    if summary["slowest"]:
+        print("Slowest messages:")
+        for message in summary["slowest"]:
+            breakdown = ", ".join(f"{stage} {ms:.1f}" for stage, ms in message["stages_ms"].items())
+            print(f"  {message['name']}: {message['total_ms']:.1f} ms ({breakdown})")
@@ -0,0 +1,145 @@
+"""
+received_parser.py
+
+This reads the Received headers of a message as a chain of relay hops
+
+Each relay a message passes through adds a Received header on top, e.g.
+    from mx1.example.ru (mx1.example.ru [91.123.45.67])
+        by mail.example.com with ESMTP id abc123; Mon, 1 Dec 2025 15:25:00 +0000
+A hop is read into its from and by hosts, every IPv4 and IPv6 literal in it
+and the time it was received, with patterns compiled once for all messages.
+Hops without any ip (hostname only) are kept. From the times, the delay of
+each hop after the one before it is worked out, which shows relays whose
+clocks run backwards or that held a message implausibly long, typical of
+forged or replayed headers.
+"""
+
+import calendar
+import re
+import socket
+from email.utils import parsedate_to_datetime
+from datetime import timezone
+
+# The host named after "from", which comes first, and the comments that follow it
+FROM_PATTERN = re.compile(r"^from\s+([^\s;()]+)((?:\s*\([^()]*\))*)", re.IGNORECASE)
+# The host named after "by", looked for outside comments
+BY_PATTERN = re.compile(r"\bby\s+([^\s;()]+)", re.IGNORECASE)
+COMMENT_PATTERN = re.compile(r"\([^()]*\)")
+# Address literals: [1.2.3.4], [IPv6:2001:db8::1] or [2001:db8::1]
+IP_LITERAL_PATTERN = re.compile(r"\[(?:IPv6:)?([0-9A-Fa-f:.]{2,45})\]", re.IGNORECASE)
+# Bare addresses, only looked for in the comments of the from host when it has no literal,
+# e.g. "from unknown (HELO mail.example.com) (203.0.113.5)"
+BARE_IP_PATTERN = re.compile(r"(?<![\w.:])(\d{1,3}(?:\.\d{1,3}){3}|[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7})(?![\w.:])")
+IPV4_PATTERN = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}")
+# The usual date of a Received header, e.g. "Mon, 1 Dec 2025 15:25:00 +0000",
+# read directly. Anything else goes through the full date parser
+DATE_PATTERN = re.compile(r"(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+"
+                          r"(\d{1,2}):(\d{2})(?::(\d{2}))?\s+([+-])(\d{2})(\d{2})\b")
+MONTHS = {month.lower(): number for number, month in enumerate(calendar.month_abbr) if month}
+# Relays may be this many seconds out of step with each other
+MAX_CLOCK_SKEW = 5 * 60
+# Longer than this between two relays is more than any queue retry explains
+MAX_RELAY_DELAY = 2 * 24 * 60 * 60
+
+"""
+is_ip
+
+Returns the address, lowercased, if text is an IPv4 or IPv6 address,
+otherwise None. Dotted quads are returned as written, even when a number
+is out of range, so they are still reported (and classified as Invalid)
+"""
+def is_ip(text):
+    if ":" not in text:
+        return text if IPV4_PATTERN.fullmatch(text) else None
+    try:
+        socket.inet_pton(socket.AF_INET6, text)
+    except OSError:
+        return None
+    return text.lower()
+
+"""
+received_time
+
+Returns the time at the end of a Received header as seconds since the
+epoch, or None if it is missing or unreadable. Times without a zone count
+as UTC
+"""
+def received_time(date_text):
+    date = DATE_PATTERN.match(date_text.strip())
+    if date is not None and date.group(2).lower() in MONTHS:
+        day, month, year, hour, minute, second, sign, zone_hours, zone_minutes = date.groups()
+        year, month, day = int(year), MONTHS[month.lower()], int(day)
+        if not 1 <= day <= calendar.monthrange(year, month)[1]:
+            return None
+        offset = (int(zone_hours) * 60 + int(zone_minutes)) * 60 * (-1 if sign == "-" else 1)
+        return float(calendar.timegm((year, month, day, int(hour), int(minute), int(second or 0))) - offset)
+    try:
+        received = parsedate_to_datetime(date_text.strip())
+    except (TypeError, ValueError, IndexError):
+        return None
+    if received.tzinfo is None:
+        received = received.replace(tzinfo=timezone.utc)
+    return received.timestamp()
+
+"""
+parse_received
+
+Returns a hop from the value of a Received header as {"from_host",
+"by_host", "ips", "timestamp"}, None for whatever is not there
+"""
+def parse_received(value):
+    # Unfold, and split the time off at the last semicolon
+    clauses, separator, date_text = " ".join(value.split()).rpartition(";")
+    if not separator:
+        clauses, date_text = date_text, ""
+
+    ips = [ip for ip in map(is_ip, IP_LITERAL_PATTERN.findall(clauses)) if ip is not None]
+    from_match = FROM_PATTERN.match(clauses)
+    if not ips and from_match is not None and from_match.group(2):
+        ips = [ip for ip in map(is_ip, BARE_IP_PATTERN.findall(from_match.group(2))) if ip is not None]
+    by_match = BY_PATTERN.search(COMMENT_PATTERN.sub(" ", clauses))
+    return {
+        "from_host": from_match.group(1) if from_match is not None else None,
+        "by_host": by_match.group(1) if by_match is not None else None,
+        "ips": ips,
+        "timestamp": received_time(date_text) if date_text else None
+    }
+
+"""
+parse_received_chain
+
+Returns the hops of a list of Received header values, in header order (the
+last relay first). Each hop also has "delay", the seconds between the hop
+before it (the next one in the list) and it, or None if either time is unknown
+"""
+def parse_received_chain(received_list):
+    chain = [parse_received(str(value)) for value in received_list]
+    for hop, earlier in zip(chain, chain[1:] + [None]):
+        if earlier is None or hop["timestamp"] is None or earlier["timestamp"] is None:
+            hop["delay"] = None
+        else:
+            hop["delay"] = hop["timestamp"] - earlier["timestamp"]
+    return chain
+
+"""
+chain_ips
+
+Returns every ip of a chain of hops, in header order
+"""
+def chain_ips(chain):
+    return [ip for hop in chain for ip in hop["ips"]]
+
+"""
+relay_timing_issues
+
+Returns the hops of a chain (numbered in chronological order, the first
+relay is 1) that were received too long before or after the hop before
+them, as a list of {"hop", "delay"}
+"""
+def relay_timing_issues(chain):
+    issues = []
+    for number, hop in enumerate(reversed(chain), start=1):
+        delay = hop["delay"]
+        if delay is not None and (delay < -MAX_CLOCK_SKEW or delay > MAX_RELAY_DELAY):
+            issues.append({"hop": number, "delay": delay})
+    return issues
@@ -2,13 +2,20 @@
 report_generator.py
 
 This generates the report on the eml file
+
+analyze_email turns a parsed eml file into a result: a dict of plain values
+that can be written as JSON. The text report is rendered from that result
 """
 
+import json
 import os
-from eml_ingest import *
-from url_analyzer import *
-from text_analyzer import *
-from header_analyzer import *
+from eml_ingest import extract_urls, get_ip_classification, load_attachments, parse_eml_bytes
+from hash_reputation import get_hash_index
+from header_analyzer import has_from_replyTo_mismatch
+from pipeline_metrics import DISABLED_METRICS
+from received_parser import relay_timing_issues
+from text_analyzer import LANGUAGE_CATEGORIES, has_dangerous_extension, has_mismatched_mime, scan_language
+from url_analyzer import analyze_urls
 
 WEIGHT_SUS_TLD              = 3
 WEIGHT_IP_DOMAIN            = 5
@@ -20,157 +27,489 @@ WEIGHT_ATTCH_EXT            = 5
 WEIGHT_ATTCH_MIME_MISMATCH  = 10
 WEIGHT_FOREIGN_HOP          = 5
 WEIGHT_FROM_REPLY_MISMATCH  = 6
+WEIGHT_LINK_TEXT_MISMATCH   = 6
+WEIGHT_KNOWN_BAD_ATTACHMENT = 16
+# Relay timing anomalies are reported but not scored, clocks of relays are
+# often out of step. Give it a weight with --scoring to count it
+WEIGHT_RELAY_TIMING         = 0
 
-def generate_report(header, locations, eml_filename):
-    count_suspicious_tld = 0
-    count_ip_as_domain = 0
-    count_long_url = 0
-    count_language_urgent = 0
-    count_language_credential = 0
-    count_language_financial = 0
-    count_attachment_extension = 0
-    count_attachment_mime_mismatch = 0
-    count_foreign_hop = 0
-    count_from_reply_mismatch = 0
-   
-    os.makedirs("reports", exist_ok=True)
+# Every counted indicator and its weight in the risk rating
+INDICATOR_WEIGHTS = {
+    "ip_as_domain": WEIGHT_IP_DOMAIN,
+    "suspicious_tld": WEIGHT_SUS_TLD,
+    "long_url": WEIGHT_LONG_URL,
+    "language_urgent": WEIGHT_LANG_URGENT,
+    "language_credential": WEIGHT_LANG_CREDENTIAL,
+    "language_financial": WEIGHT_LANG_FINANCIAL,
+    "attachment_extension": WEIGHT_ATTCH_EXT,
+    "attachment_mime_mismatch": WEIGHT_ATTCH_MIME_MISMATCH,
+    "foreign_hop": WEIGHT_FOREIGN_HOP,
+    "from_reply_mismatch": WEIGHT_FROM_REPLY_MISMATCH,
+    "link_text_mismatch": WEIGHT_LINK_TEXT_MISMATCH,
+    "known_bad_attachment": WEIGHT_KNOWN_BAD_ATTACHMENT,
+    "relay_timing": WEIGHT_RELAY_TIMING
+}
+
+# Lowest rating of each risk grade, highest grade first. Values are mostly
+# arbitrary and could be tuned to liking
+RISK_THRESHOLDS = {
+    "HIGH RISK": 16,
+    "MODERATE RISK": 8
+}
+LOWEST_GRADE = "LOW RISK"
+
+# Weights and thresholds in use, see configure_scoring
+_scoring = {"weights": dict(INDICATOR_WEIGHTS), "thresholds": dict(RISK_THRESHOLDS)}
+# Whether analysis stops once the grade is settled, see configure_triage
+_triage = False
+# Stages of the content analysis, cheapest first. "body" only runs for
+# messages whose header was parsed on its own (see parse_eml_headers)
+CONTENT_STAGES = ["body", "urls", "keywords", "attachments"]
+
+REPORT_HEADER_FIELDS = ["From", "To", "Reply-To", "Subject", "Date"]
+# How the text report shows url detections and keyword categories
+URL_DETECTION_LABELS = {
+    "ip_as_domain": "(Raw IP) ",
+    "suspicious_tld": "(Suspicious TLD) ",
+    "long_url": "(Excessively long)"
+}
+KEYWORD_DESCRIPTIONS = {
+    "urgent": "urgency",
+    "credential": "credential",
+    "financial": "financial"
+}
+
+"""
+report_path
 
-    #Make report name based on eml file name
-    #get everything between the path and the extension, just the actual file name
-    base_filename = os.path.splitext(os.path.basename(eml_filename))[0]
+Returns the path of the report written for an eml file, or for a message
+read from a mailbox or archive (see mail_sources.py)
+"""
+def report_path(eml_filename):
+    #Messages from containers carry their own name
+    base_filename = getattr(eml_filename, "report_stem", None)
+    if base_filename is None:
+        #Make report name based on eml file name
+        #get everything between the path and the extension, just the actual file name
+        base_filename = os.path.splitext(os.path.basename(eml_filename))[0]
     #use that to make report file name
     report_filename = base_filename + "_report.txt"
-    report_filepath = os.path.join("reports", report_filename)
-
-    #Write the report
-    with open(report_filepath, "w", encoding="utf-8") as report_file:
-        report_file.write("-------------------- EMAIL ANALYSIS REPORT --------------------\n\n")
-        report_file.write(f"From: {header['From']}\n")
-        report_file.write(f"To: {header['To']}\n")
-        report_file.write(f"Reply-To: {header['Reply-To']}\n")
-        report_file.write(f"Subject: {header['Subject']}\n")
-        report_file.write(f"Date: {header['Date']}\n\n")
-
-        # Check From Vs Reply-To
-        if has_from_replyTo_mismatch(header):
-            count_from_reply_mismatch = 1
-            report_file.write("Detected a mismatch between From and Reply-To\n\n")
-
-        # Analysis of hops
-        if locations:
-            report_file.write("Identified hops:\n\n")
-            # use reversed so that the report gives hops in chronological order
-            for i, location in enumerate(reversed(locations), start=1):
-                city = location['city']
-                region = location['region']
-                country = location['country']
-                ip = location['ip']
-                ip_classification = get_ip_classification(ip)
-
-                if ip_classification == "Invalid":
-                    continue
-                elif ip_classification == "Loopback" or ip_classification == "Private":
-                    report_file.write(f"Hop {i}: ({ip} - Classification: {ip_classification}) - No location data for internal IP addresses\n\n")
-                else:
-                    report_file.write(f"Hop {i}: ({ip} - Classification: {ip_classification}) - {city}, {region}, {country}\n")
-                    if country != "United States":
-                        count_foreign_hop += 1
-                        report_file.write("Detected hop was outside of the United States\n")
-                    report_file.write("\n")
-                    
-
-        # Extract body
-        body_contents = extract_body(eml_filename)
-        
-        # Analysis of URLs
-        urls = extract_urls(body_contents)
-
-        #test
-        #urls.append("http://185.224.12.55/login")
-        #urls.append("thisisascam.shop")
-
-        url_is_sus = False
-        if urls:
-            report_file.write("Identified URLs:\n")
-            for url in urls:
-                report_file.write("\n"+url+"\nDetections: ")
-                if is_raw_ip(url):
-                    count_ip_as_domain += 1
-                    url_is_sus = True
-                    report_file.write("(Raw IP) ")
-                if has_suspicious_tld(url):
-                    count_suspicious_tld += 1
-                    url_is_sus = True
-                    report_file.write("(Suspicious TLD) ")
-                if is_very_long(url):
-                    count_long_url += 1
-                    url_is_sus = True
-                    report_file.write("(Excessively long)")
-                if not url_is_sus:
-                    report_file.write("Nothing suspicious detected.")
-                else:
-                    url_is_sus = False
-                report_file.write("\n")
-            report_file.write("\n")
-                
-
-        # Analysis of body
-        language_urgent = get_urgent_language(body_contents)
-        language_credential = get_credential_language(body_contents)
-        language_financial = get_financial_language(body_contents)
-
-        count_language_urgent = len(language_urgent)
-        count_language_credential = len(language_credential)
-        count_language_financial = len(language_financial)
-
-        if language_urgent:
-            report_file.write(f"Identified urgency keyphrases: {language_urgent}\n\n")
-        if language_credential:
-            report_file.write(f"Identified credential keyphrases: {language_credential}\n\n")
-        if language_financial:
-            report_file.write(f"Identified financial keyphrases: {language_financial}\n\n")
-
-        # Analysis of attachments
-        attachments = extract_attachments(eml_filename)
-        if attachments:
-            report_file.write("Identified attachments:\n\n")
-            for attachment in attachments:
-                report_file.write(attachment["filename"]+"\n")
-                if has_dangerous_extension(attachment["extension"]):
-                    count_attachment_extension += 1
-                    report_file.write("Risky extension detected\n")
-                if has_mismatched_mime(attachment["extension"], attachment["mime"]):
-                    count_attachment_mime_mismatch += 1
-                    report_file.write("Extension-Mime mismatch detected\n")
-                report_file.write("\n")
-
-        # Determine numerical risk rating and decide severity
-        risk_rating = (
-            count_ip_as_domain*WEIGHT_IP_DOMAIN                         +
-            count_suspicious_tld*WEIGHT_SUS_TLD                         +
-            count_long_url*WEIGHT_LONG_URL                              +
-            count_language_urgent*WEIGHT_LANG_URGENT                    +
-            count_language_credential*WEIGHT_LANG_CREDENTIAL            +
-            count_language_financial*WEIGHT_LANG_FINANCIAL              +
-            count_attachment_extension*WEIGHT_ATTCH_EXT                 +
-            count_attachment_mime_mismatch*WEIGHT_ATTCH_MIME_MISMATCH   +
-            count_foreign_hop*WEIGHT_FOREIGN_HOP                        +
-            count_from_reply_mismatch*WEIGHT_FROM_REPLY_MISMATCH
-        )
-
-        # Values are mostly arbitrary and could be tuned to liking
-        if risk_rating >= 16:
-            risk_grade = "HIGH RISK"
-        elif risk_rating >= 8:
-            risk_grade = "MODERATE RISK"
-        else:
-            risk_grade = "LOW RISK"
-
-
-        report_file.write(f"Risk rating: {risk_rating} ({risk_grade})\n\n")
-
-        # if body_contents:
-        #     report_file.write("\nExtracted body contents:\n\n")
-        #     report_file.write(body_contents)
-
-        report_file.write("-------------------- EMAIL ANALYSIS REPORT --------------------")
\ No newline at end of file
+    return os.path.join("reports", report_filename)
+
+"""
+describe_source
+
+Returns where a message came from: its name and either its path or the
+container and location it was read from
+"""
+def describe_source(eml_filename):
+    if eml_filename is None:
+        return {"name": None}
+    if hasattr(eml_filename, "container"):
+        return {"name": eml_filename.name, "container": str(eml_filename.container),
+                "location": eml_filename.location}
+    return {"name": os.path.basename(eml_filename), "path": str(eml_filename)}
+
+"""
+get_risk_grade
+
+Returns the severity of a risk rating
+"""
+def get_risk_grade(risk_rating, thresholds=None):
+    thresholds = thresholds or _scoring["thresholds"]
+    for grade, threshold in thresholds.items():
+        if risk_rating >= threshold:
+            return grade
+    return LOWEST_GRADE
+
+"""
+get_risk_rating
+
+Returns the risk rating of indicator counts, the sum of each count times
+the weight of its indicator
+"""
+def get_risk_rating(counts, weights=None):
+    weights = weights or _scoring["weights"]
+    return sum(counts[indicator] * weight for indicator, weight in weights.items())
+
+"""
+load_scoring
+
+Returns the weights and thresholds of a scoring config file, e.g.
+    {"weights": {"foreign_hop": 2}, "thresholds": {"HIGH RISK": 20}}
+as {"weights", "thresholds"}. Anything left out keeps its default.
+Raises ValueError if the file names an unknown indicator or grade
+"""
+def load_scoring(path):
+    with open(path, "r", encoding="utf-8") as scoring_file:
+        config = json.load(scoring_file)
+
+    weights = dict(INDICATOR_WEIGHTS)
+    thresholds = dict(RISK_THRESHOLDS)
+    for values, defaults, section in ((weights, INDICATOR_WEIGHTS, "weights"),
+                                      (thresholds, RISK_THRESHOLDS, "thresholds")):
+        for name, value in config.get(section, {}).items():
+            if name not in defaults:
+                raise ValueError(f"unknown {section[:-1]} {name!r}, expected one of {', '.join(defaults)}")
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{section[:-1]} {name!r} must be a number")
+            values[name] = value
+    # Grades are checked from the highest threshold down
+    thresholds = dict(sorted(thresholds.items(), key=lambda item: item[1], reverse=True))
+    return {"weights": weights, "thresholds": thresholds}
+
+"""
+configure_scoring
+
+Sets the weights and thresholds (see load_scoring) used by every analysis
+in this process, or the defaults with None
+"""
+def configure_scoring(scoring):
+    global _scoring
+    if scoring is None:
+        scoring = {"weights": dict(INDICATOR_WEIGHTS), "thresholds": dict(RISK_THRESHOLDS)}
+    _scoring = scoring
+
+"""
+get_scoring
+
+Returns the weights and thresholds used by this process
+"""
+def get_scoring():
+    return _scoring
+
+"""
+grade_settled
+
+Returns True if no further finding can change the grade of a risk rating:
+it reached the highest grade and no weight is negative
+"""
+def grade_settled(risk_rating):
+    if any(weight < 0 for weight in _scoring["weights"].values()):
+        return False
+    return risk_rating >= max(_scoring["thresholds"].values())
+
+"""
+configure_triage
+
+Turns triage on or off for this process. With triage the content checks
+run cheapest first and stop as soon as the grade is settled
+"""
+def configure_triage(enabled):
+    global _triage
+    _triage = enabled
+
+"""
+get_triage
+
+Returns True if triage is on in this process
+"""
+def get_triage():
+    return _triage
+
+"""
+analyze_email
+
+Runs every check on an eml file's parsed structure (see parse_eml) and the
+geolocated hops, and returns the findings as a dict of plain values (see
+the README for the fields). Time spent on the header and hops, urls,
+keywords, attachments and scoring is added to metrics (see
+pipeline_metrics.py), writing the report is left to the caller. source replaces the description
+of where the message came from, for messages that are not files. Messages
+of a known campaign bring the findings of its first message as their
+content (see campaign_index.py) and those checks are not run again. With
+triage (by default as set by configure_triage) the sender and hops are
+checked first and the content checks stop once the grade is settled
+"""
+def analyze_email(email_data, locations, eml_filename=None, metrics=DISABLED_METRICS, source=None,
+                  triage=None):
+    triage = _triage if triage is None else triage
+    header = email_data["header"]
+    counts = dict.fromkeys(INDICATOR_WEIGHTS, 0)
+
+    # Check From Vs Reply-To
+    from_reply_mismatch = has_from_replyTo_mismatch(header)
+    if from_reply_mismatch:
+        counts["from_reply_mismatch"] = 1
+
+    # Analysis of hops
+    # use reversed so that hops are in chronological order
+    hops = []
+    for i, location in enumerate(reversed(locations or []), start=1):
+        ip = location["ip"]
+        ip_classification = get_ip_classification(ip)
+        if ip_classification == "Invalid":
+            continue
+        hop = {"number": i, "ip": ip, "classification": ip_classification,
+               "city": None, "region": None, "country": None, "foreign": False}
+        # No location data for internal IP addresses, or for hops that were not looked up
+        if (ip_classification != "Loopback" and ip_classification != "Private"
+                and location["country"] is not None):
+            hop["city"] = location["city"]
+            hop["region"] = location["region"]
+            hop["country"] = location["country"]
+            hop["foreign"] = location["country"] != "United States"
+            counts["foreign_hop"] += hop["foreign"]
+        hops.append(hop)
+
+    # The Received chain in chronological order, and relays out of step with the one before
+    received = [{"number": number, "from_host": hop["from_host"], "by_host": hop["by_host"],
+                 "ips": hop["ips"], "timestamp": hop["timestamp"], "delay": hop["delay"]}
+                for number, hop in enumerate(reversed(email_data.get("received", [])), start=1)]
+    relay_timing = relay_timing_issues(email_data.get("received", []))
+    # One bad timestamp puts two hops out of step, count the message once
+    counts["relay_timing"] = 1 if relay_timing else 0
+    metrics.lap("header")
+
+    # Findings on the body, links and attachments, handed on for messages
+    # of a campaign whose first message was already analyzed
+    content = email_data.get("content")
+    if content is None:
+        content = analyze_content(email_data, metrics, counts if triage else None)
+    count_content(content, counts)
+
+    # Determine numerical risk rating and decide severity
+    risk_rating = get_risk_rating(counts)
+    metrics.lap("scoring")
+
+    return {
+        "source": source if source is not None else describe_source(eml_filename),
+        "header": {field: str(header[field]) for field in REPORT_HEADER_FIELDS},
+        "from_reply_mismatch": from_reply_mismatch,
+        "hops": hops,
+        "received": received,
+        "relay_timing": relay_timing,
+        "urls": content["urls"],
+        "link_mismatches": content["link_mismatches"],
+        "keywords": content["keywords"],
+        "attachments": content["attachments"],
+        "indicators": counts,
+        "risk_rating": risk_rating,
+        "risk_grade": get_risk_grade(risk_rating),
+        "limits_exceeded": content["limits_exceeded"],
+        "skipped_stages": content.get("skipped_stages", []),
+        "campaign": email_data.get("campaign")
+    }
+
+"""
+analyze_content
+
+Runs the url, keyword and attachment checks on an eml file's parsed
+structure, parsing the body first if only the header was parsed (the raw
+message is then in email data's raw). Returns {"urls", "link_mismatches",
+"keywords", "attachments", "limits_exceeded", "skipped_stages"}. With
+counts, the indicators found so far, stages stop once the grade is settled
+and the rest are listed in skipped_stages
+"""
+def analyze_content(email_data, metrics=DISABLED_METRICS, counts=None):
+    content = {
+        "urls": [],
+        "link_mismatches": [],
+        "keywords": {category: [] for category in LANGUAGE_CATEGORIES},
+        "attachments": [],
+        "limits_exceeded": email_data.get("limits_exceeded", []),
+        "skipped_stages": []
+    }
+    stages = CONTENT_STAGES if "raw" in email_data else CONTENT_STAGES[1:]
+    for number, stage in enumerate(stages):
+        if counts is not None:
+            found = dict(counts)
+            count_content(content, found)
+            if grade_settled(get_risk_rating(found)):
+                content["skipped_stages"] = stages[number:]
+                break
+
+        if stage == "body":
+            email_data = dict(email_data, **parse_eml_bytes(email_data["raw"], attachments=counts is None))
+            content["limits_exceeded"] = email_data["limits_exceeded"]
+            metrics.lap("parse")
+
+        elif stage == "urls":
+            # Links of an html body come first, then addresses written in its text
+            html_links = email_data.get("html_links", [])
+            linked = set(html_links)
+            content["urls"] = analyze_urls(html_links + [url for url in extract_urls(email_data["body"])
+                                                         if url not in linked])
+            content["link_mismatches"] = email_data.get("link_mismatches", [])
+            metrics.add("urls", len(content["urls"]))
+            metrics.lap("urls")
+
+        elif stage == "keywords":
+            content["keywords"] = scan_language(email_data["body"])
+            metrics.lap("keywords")
+
+        elif stage == "attachments":
+            content["attachments"] = analyze_attachments(load_attachments(email_data), metrics)
+    return content
+
+"""
+analyze_attachments
+
+Returns the attachments with the results of the extension, mime and, when
+a hash index is configured, reputation checks
+"""
+def analyze_attachments(attachments, metrics=DISABLED_METRICS):
+    analyzed = []
+    for attachment in attachments:
+        dangerous_extension = has_dangerous_extension(attachment["extension"])
+        mime_mismatch = has_mismatched_mime(attachment["extension"], attachment["mime"],
+                                            attachment["sniffed_mime"])
+        analyzed.append(dict(attachment, dangerous_extension=dangerous_extension,
+                             mime_mismatch=mime_mismatch))
+    metrics.add("attachments", len(analyzed))
+    metrics.lap("attachments")
+
+    # Reputation of attachments, when a hash index is configured
+    hash_index = get_hash_index()
+    for attachment in analyzed:
+        attachment["known_bad"] = hash_index is not None and hash_index.contains(attachment["sha256"])
+    if hash_index is not None:
+        metrics.lap("reputation")
+    return analyzed
+
+"""
+count_content
+
+Adds the indicators found by analyze_content to counts
+"""
+def count_content(content, counts):
+    for url in content["urls"]:
+        for detection in url["detections"]:
+            counts[detection] += 1
+    counts["link_text_mismatch"] = len(content["link_mismatches"])
+    counts["language_urgent"] = len(content["keywords"]["urgent"])
+    counts["language_credential"] = len(content["keywords"]["credential"])
+    counts["language_financial"] = len(content["keywords"]["financial"])
+    for attachment in content["attachments"]:
+        counts["attachment_extension"] += attachment["dangerous_extension"]
+        counts["attachment_mime_mismatch"] += attachment["mime_mismatch"]
+        counts["known_bad_attachment"] += attachment["known_bad"]
+
+"""
+describe_duration
+
+Returns a number of seconds (either sign) as minutes, hours or days
+"""
+def describe_duration(seconds):
+    seconds = abs(seconds)
+    if seconds < 2 * 60 * 60:
+        return f"{seconds / 60:.0f} minutes"
+    if seconds < 2 * 24 * 60 * 60:
+        return f"{seconds / 60 / 60:.1f} hours"
+    return f"{seconds / 24 / 60 / 60:.1f} days"
+
+"""
+render_text_report
+
+Returns the text report of a result from analyze_email
+"""
+def render_text_report(result):
+    lines = ["-------------------- EMAIL ANALYSIS REPORT --------------------\n\n"]
+    source = result["source"]
+    if "container" in source:
+        lines.append(f"Source: {source['container']} ({source['location']})\n")
+    for field in REPORT_HEADER_FIELDS:
+        lines.append(f"{field}: {result['header'][field]}\n")
+    lines.append("\n")
+
+    campaign = result.get("campaign")
+    if campaign is not None:
+        lines.append(f"Campaign: {campaign['id']}\n")
+        if campaign["reused"]:
+            lines.append(f"Body, URLs and attachments as analyzed for {campaign['representative']}\n")
+        lines.append("\n")
+
+    if result["limits_exceeded"]:
+        lines.append(f"Message exceeded the limits on {', '.join(result['limits_exceeded'])}, "
+                     "only part of it was analyzed\n\n")
+
+    if result.get("skipped_stages"):
+        lines.append(f"Triage: grade settled early, skipped {', '.join(result['skipped_stages'])}\n\n")
+
+    if result["from_reply_mismatch"]:
+        lines.append("Detected a mismatch between From and Reply-To\n\n")
+
+    if result["hops"]:
+        lines.append("Identified hops:\n\n")
+        for hop in result["hops"]:
+            hop_name = f"Hop {hop['number']}: ({hop['ip']} - Classification: {hop['classification']})"
+            if hop["classification"] == "Loopback" or hop["classification"] == "Private":
+                lines.append(f"{hop_name} - No location data for internal IP addresses\n\n")
+                continue
+            if hop["country"] is None:
+                lines.append(f"{hop_name} - Location not looked up\n\n")
+                continue
+            lines.append(f"{hop_name} - {hop['city']}, {hop['region']}, {hop['country']}\n")
+            if hop["foreign"]:
+                lines.append("Detected hop was outside of the United States\n")
+            lines.append("\n")
+
+    if result.get("relay_timing"):
+        lines.append("Identified relay timing anomalies:\n\n")
+        for issue in result["relay_timing"]:
+            when = "after" if issue["delay"] > 0 else "before"
+            lines.append(f"Relay {issue['hop']} received the message {describe_duration(issue['delay'])} "
+                         f"{when} relay {issue['hop'] - 1}\n")
+        lines.append("\n")
+
+    if result["urls"]:
+        lines.append("Identified URLs:\n")
+        for url in result["urls"]:
+            lines.append("\n" + url["url"] + "\nDetections: ")
+            if url["detections"]:
+                lines.append("".join(URL_DETECTION_LABELS[detection] for detection in url["detections"]))
+            else:
+                lines.append("Nothing suspicious detected.")
+            lines.append("\n")
+        lines.append("\n")
+
+    if result["link_mismatches"]:
+        lines.append("Identified link text mismatches:\n\n")
+        for mismatch in result["link_mismatches"]:
+            lines.append(f"Link text {mismatch['text']} leads to {mismatch['href']}\n")
+        lines.append("\n")
+
+    for category, description in KEYWORD_DESCRIPTIONS.items():
+        if result["keywords"][category]:
+            lines.append(f"Identified {description} keyphrases: {result['keywords'][category]}\n\n")
+
+    if result["attachments"]:
+        lines.append("Identified attachments:\n\n")
+        for attachment in result["attachments"]:
+            lines.append(attachment["filename"] + "\n")
+            if attachment["dangerous_extension"]:
+                lines.append("Risky extension detected\n")
+            if attachment["mime_mismatch"]:
+                lines.append("Extension-Mime mismatch detected\n")
+            if attachment["known_bad"]:
+                lines.append(f"Known malicious file (SHA-256 {attachment['sha256']})\n")
+            if attachment["sniffed_mime"]:
+                lines.append(f"Content identified as {attachment['sniffed_mime']}\n")
+            lines.append("\n")
+
+    lines.append(f"Risk rating: {result['risk_rating']} ({result['risk_grade']})\n\n")
+    lines.append("-------------------- EMAIL ANALYSIS REPORT --------------------")
+    return "".join(lines)
+
+"""
+write_text_report
+
+Writes the text report of a result to the report path of the eml file
+"""
+def write_text_report(result, eml_filename):
+    os.makedirs("reports", exist_ok=True)
+    # One write per report instead of one per line
+    with open(report_path(eml_filename), "w", encoding="utf-8") as report_file:
+        report_file.write(render_text_report(result))
+
+"""
+generate_report
+
+Writes the report for an eml file from its parsed structure (see parse_eml)
+and the geolocated hops. Returns the risk rating and risk grade
+"""
+def generate_report(email_data, locations, eml_filename, metrics=DISABLED_METRICS):
+    result = analyze_email(email_data, locations, eml_filename, metrics)
+    write_text_report(result, eml_filename)
+    metrics.lap("report")
+    return result["risk_rating"], result["risk_grade"]
@@ -0,0 +1,61 @@
+"""
+result_writer.py
+
+This writes analysis results as JSON Lines
+
+Every result from analyze_email (see report_generator.py) becomes one line of
+JSON, appended to a single file that stays open for the whole run. Lines are
+collected in a large write buffer and reach the disk a buffer at a time, so
+writing many results costs a few writes instead of a file open per message.
+"""
+
+import json
+import os
+
+DEFAULT_RESULTS_PATH = os.path.join("reports", "results.jsonl")
+# Indicator counts saved by main.py --features, see risk_scoring.py
+DEFAULT_FEATURES_PATH = os.path.join("reports", "features.npz")
+BUFFER_SIZE = 1024 * 1024
+
+"""
+JsonlWriter
+
+Appends results to a JSON Lines file. Use it as a context manager or call close
+"""
+class JsonlWriter:
+    def __init__(self, path=DEFAULT_RESULTS_PATH, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.results_file = open(path, "a", encoding="utf-8", buffering=buffer_size)
+
+    """
+    write
+
+    Adds one result as a line
+    """
+    def write(self, result):
+        self.results_file.write(json.dumps(result, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.written += 1
+
+    """
+    flush
+
+    Writes out the buffered results now
+    """
+    def flush(self):
+        self.results_file.flush()
+
+    """
+    close
+
+    Writes out what is buffered and closes the file
+    """
+    def close(self):
+        self.results_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,341 @@
+"""
+results_store.py
+
+This keeps analysis results in a SQLite database for questions about a whole corpus
+
+Every result from analyze_email (see report_generator.py) becomes a row of
+messages, with its indicators, hops, URLs, keyword hits and attachments in
+tables of their own, indexed by sender domain, URL host, hop ip, attachment
+hash and risk grade. Results are collected in memory and inserted a batch
+at a time in one transaction, so storing keeps up with a parallel scan.
+The database is in WAL mode, queries can run while a scan is adding to it.
+
+Questions are answered with
+    python results_store.py query --since 30 --indicator ip_as_domain --indicator foreign_hop --list
+(or "python main.py query ..."), which counts the matching messages by
+grade, sender domain, URL host, hop country or ip, attachment hash,
+indicator or day, or lists them. "--sql" runs any read-only query.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from email.utils import parseaddr
+from defaults import DEFAULT_STORE_PATH
+from received_parser import received_time
+from url_analyzer import url_hostname
+
+# Messages inserted per transaction
+BATCH_MESSAGES = 1000
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "id INTEGER PRIMARY KEY, name TEXT, path TEXT, container TEXT, location TEXT, "
+    "sender TEXT, sender_domain TEXT, reply_to TEXT, subject TEXT, sent REAL, scanned REAL, "
+    "risk_rating REAL, risk_grade TEXT, campaign TEXT, skipped_stages TEXT, error TEXT)",
+    # Only indicators that were found, with how often
+    "CREATE TABLE IF NOT EXISTS indicators (message_id INTEGER, indicator TEXT, count INTEGER)",
+    "CREATE TABLE IF NOT EXISTS hops ("
+    "message_id INTEGER, number INTEGER, ip TEXT, classification TEXT, "
+    "city TEXT, region TEXT, country TEXT, foreign_hop INTEGER)",
+    "CREATE TABLE IF NOT EXISTS urls (message_id INTEGER, url TEXT, host TEXT, detections TEXT)",
+    "CREATE TABLE IF NOT EXISTS keywords (message_id INTEGER, category TEXT, phrase TEXT)",
+    "CREATE TABLE IF NOT EXISTS attachments ("
+    "message_id INTEGER, filename TEXT, extension TEXT, mime TEXT, sniffed_mime TEXT, size INTEGER, "
+    "sha256 TEXT, dangerous_extension INTEGER, mime_mismatch INTEGER, known_bad INTEGER)",
+    "CREATE INDEX IF NOT EXISTS messages_sender_domain ON messages (sender_domain)",
+    "CREATE INDEX IF NOT EXISTS messages_risk_grade ON messages (risk_grade)",
+    "CREATE INDEX IF NOT EXISTS messages_sent ON messages (sent)",
+    "CREATE INDEX IF NOT EXISTS indicators_indicator ON indicators (indicator, message_id)",
+    "CREATE INDEX IF NOT EXISTS hops_ip ON hops (ip)",
+    "CREATE INDEX IF NOT EXISTS hops_message ON hops (message_id)",
+    "CREATE INDEX IF NOT EXISTS urls_host ON urls (host)",
+    "CREATE INDEX IF NOT EXISTS urls_message ON urls (message_id)",
+    "CREATE INDEX IF NOT EXISTS keywords_message ON keywords (message_id)",
+    "CREATE INDEX IF NOT EXISTS attachments_sha256 ON attachments (sha256)",
+    "CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message_id)"
+]
+
+# --group-by choice -> (table joined to messages or None, expression grouped by)
+GROUPS = {
+    "grade": (None, "m.risk_grade"),
+    "sender_domain": (None, "m.sender_domain"),
+    "day": (None, "date(COALESCE(m.sent, m.scanned), 'unixepoch')"),
+    "url_host": ("urls", "t.host"),
+    "hop_country": ("hops", "t.country"),
+    "hop_ip": ("hops", "t.ip"),
+    "sha256": ("attachments", "t.sha256"),
+    "indicator": ("indicators", "t.indicator")
+}
+
+"""
+sender_domain
+
+Returns the lowercased domain of the address in a From header, or None
+"""
+def sender_domain(sender):
+    address = parseaddr(sender)[1]
+    if "@" not in address:
+        return None
+    return address.rpartition("@")[2].lower() or None
+
+"""
+ResultsStore
+
+Adds results to a results database, a batch per transaction. Use it as a
+context manager or call close. One process should write to a database at a
+time, any number may read it
+"""
+class ResultsStore:
+    def __init__(self, path=DEFAULT_STORE_PATH, batch_messages=BATCH_MESSAGES):
+        self.path = path
+        self.batch_messages = batch_messages
+        self.pending = []
+        self.written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Losing the last batch on power failure is fine, results can be analyzed again
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+
+    """
+    add
+
+    Adds a result, or {"source", "error"} for a message that could not be
+    analyzed. It is written with the rest of its batch
+    """
+    def add(self, result):
+        self.pending.append((result, time.time()))
+        if len(self.pending) >= self.batch_messages:
+            self.flush()
+
+    """
+    flush
+
+    Writes the results added so far in one transaction
+    """
+    def flush(self):
+        if not self.pending:
+            return
+        rows = {table: [] for table in ("messages", "indicators", "hops", "urls", "keywords", "attachments")}
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Ids are handed out here so every table can be inserted with executemany
+            message_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+            for result, scanned in self.pending:
+                message_id += 1
+                add_rows(rows, message_id, result, scanned)
+            self.connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                                        "?, ?, ?)", rows["messages"])
+            self.connection.executemany("INSERT INTO indicators VALUES (?, ?, ?)", rows["indicators"])
+            self.connection.executemany("INSERT INTO hops VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows["hops"])
+            self.connection.executemany("INSERT INTO urls VALUES (?, ?, ?, ?)", rows["urls"])
+            self.connection.executemany("INSERT INTO keywords VALUES (?, ?, ?)", rows["keywords"])
+            self.connection.executemany("INSERT INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        rows["attachments"])
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.written += len(self.pending)
+        self.pending = []
+
+    """
+    close
+
+    Writes out what is pending and closes the database
+    """
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+"""
+add_rows
+
+Adds the rows of one result, stored as message number message_id, to the
+lists of rows per table
+"""
+def add_rows(rows, message_id, result, scanned):
+    source = result.get("source") or {}
+    if "error" in result:
+        rows["messages"].append((message_id, source.get("name"), source.get("path"), source.get("container"),
+                                 source.get("location"), None, None, None, None, None, scanned,
+                                 None, None, None, None, result["error"]))
+        return
+
+    header = result["header"]
+    sender = header.get("From")
+    campaign = result.get("campaign")
+    rows["messages"].append((
+        message_id, source.get("name"), source.get("path"), source.get("container"), source.get("location"),
+        sender, sender_domain(sender or ""), header.get("Reply-To"), header.get("Subject"),
+        received_time(header.get("Date") or ""), scanned, result["risk_rating"], result["risk_grade"],
+        campaign["id"] if campaign else None, ",".join(result.get("skipped_stages", [])) or None, None))
+    rows["indicators"].extend((message_id, indicator, count)
+                              for indicator, count in result["indicators"].items() if count)
+    rows["hops"].extend((message_id, hop["number"], hop["ip"], hop["classification"], hop["city"],
+                         hop["region"], hop["country"], int(hop["foreign"])) for hop in result["hops"])
+    rows["urls"].extend((message_id, url["url"], url_hostname(url["url"]), ",".join(url["detections"]))
+                        for url in result["urls"])
+    rows["keywords"].extend((message_id, category, phrase)
+                            for category, phrases in result["keywords"].items() for phrase in phrases)
+    rows["attachments"].extend((message_id, attachment["filename"], attachment["extension"], attachment["mime"],
+                                attachment.get("sniffed_mime"), attachment["size"], attachment["sha256"],
+                                int(attachment["dangerous_extension"]), int(attachment["mime_mismatch"]),
+                                int(attachment.get("known_bad", False)))
+                               for attachment in result["attachments"])
+
+"""
+parse_since
+
+Returns the seconds since the epoch of --since, a number of days back or a
+date (YYYY-MM-DD, read as UTC)
+"""
+def parse_since(since):
+    if since.isdigit():
+        return time.time() - int(since) * 24 * 3600
+    return datetime.fromisoformat(since).replace(tzinfo=timezone.utc).timestamp()
+
+"""
+build_filter
+
+Returns (SQL condition on messages m, parameters) from the query arguments.
+Messages that could not be analyzed never match
+"""
+def build_filter(args):
+    conditions = ["m.error IS NULL"]
+    parameters = []
+    if args.since:
+        conditions.append("COALESCE(m.sent, m.scanned) >= ?")
+        parameters.append(parse_since(args.since))
+    if args.grade:
+        conditions.append("m.risk_grade = ?")
+        parameters.append(args.grade)
+    if args.sender_domain:
+        conditions.append("m.sender_domain = ?")
+        parameters.append(args.sender_domain.lower())
+    # Each is looked up through its index, then matched to the message
+    for indicator in args.indicator or []:
+        conditions.append("m.id IN (SELECT message_id FROM indicators WHERE indicator = ?)")
+        parameters.append(indicator)
+    for table, column, value in (("urls", "host", args.url_host), ("hops", "ip", args.hop_ip),
+                                 ("hops", "country", args.hop_country),
+                                 ("attachments", "sha256", args.sha256)):
+        if value:
+            conditions.append(f"m.id IN (SELECT message_id FROM {table} WHERE {column} = ?)")
+            parameters.append(value.lower() if column in ("host", "sha256") else value)
+    return " AND ".join(conditions), parameters
+
+"""
+query_counts
+
+Returns (value, messages) of the matching messages grouped by one of
+GROUPS, most messages first
+"""
+def query_counts(connection, group_by, where, parameters, limit):
+    table, expression = GROUPS[group_by]
+    join = f"JOIN {table} t ON t.message_id = m.id" if table else ""
+    return connection.execute(
+        f"SELECT {expression}, COUNT(DISTINCT m.id) FROM messages m {join} WHERE {where} "
+        f"GROUP BY 1 ORDER BY 2 DESC, 1 LIMIT ?", parameters + [limit]).fetchall()
+
+"""
+query_messages
+
+Returns (name, container, location, sender, subject, rating, grade) of the
+matching messages, highest rating first
+"""
+def query_messages(connection, where, parameters, limit):
+    return connection.execute(
+        f"SELECT COALESCE(m.path, m.name), m.container, m.location, m.sender, m.subject, m.risk_rating, "
+        f"m.risk_grade FROM messages m WHERE {where} ORDER BY m.risk_rating DESC, m.id LIMIT ?",
+        parameters + [limit]).fetchall()
+
+"""
+run_query
+
+Prints the answer to a query command
+"""
+def run_query(args):
+    if not os.path.exists(args.store):
+        print(f"{args.store} not found, scan with --store first")
+        return
+    # Read only, a scan can keep writing meanwhile
+    connection = sqlite3.connect(f"file:{args.store}?mode=ro", uri=True, timeout=30)
+    try:
+        if args.sql:
+            cursor = connection.execute(args.sql)
+            print("\t".join(column[0] for column in cursor.description or []))
+            for row in cursor:
+                print("\t".join("" if value is None else str(value) for value in row))
+            return
+
+        where, parameters = build_filter(args)
+        start = time.perf_counter()
+        total = connection.execute(f"SELECT COUNT(*) FROM messages m WHERE {where}", parameters).fetchone()[0]
+        if args.list:
+            rows = query_messages(connection, where, parameters, args.limit)
+        else:
+            rows = query_counts(connection, args.group_by, where, parameters, args.limit)
+        elapsed = time.perf_counter() - start
+
+        print(f"{total} matching messages ({elapsed * 1000:.1f} ms)")
+        if args.list:
+            for name, container, location, sender, subject, rating, grade in rows:
+                source = f"{container} ({location})" if container else name
+                print(f"  {rating:g} ({grade})  {source}  From: {sender}  Subject: {subject}")
+        else:
+            for value, messages in rows:
+                print(f"  {'(none)' if value is None else value:<40} {messages:>9}")
+    except sqlite3.Error as e:
+        print(f"{args.store}: {type(e).__name__}: {e}")
+    finally:
+        connection.close()
+
+"""
+parse_query_args
+
+Returns the parsed arguments of the query command
+"""
+def parse_query_args(argv, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Count or list stored results")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH,
+                        help=f"results database written with --store (default: {DEFAULT_STORE_PATH})")
+    parser.add_argument("--since", metavar="DAYS|DATE",
+                        help="only messages sent in the last DAYS days or since DATE (YYYY-MM-DD), by when "
+                             "they were scanned if they have no Date header")
+    parser.add_argument("--grade", help="only messages with this risk grade, e.g. \"HIGH RISK\"")
+    parser.add_argument("--sender-domain", help="only messages from this domain")
+    parser.add_argument("--indicator", action="append",
+                        help="only messages with this indicator, e.g. ip_as_domain (repeat for all of several)")
+    parser.add_argument("--url-host", help="only messages linking to this host")
+    parser.add_argument("--hop-ip", help="only messages relayed through this ip")
+    parser.add_argument("--hop-country", help="only messages relayed through this country")
+    parser.add_argument("--sha256", help="only messages with an attachment with this SHA-256")
+    parser.add_argument("--group-by", choices=list(GROUPS), default="grade",
+                        help="count the matching messages by this (default: grade)")
+    parser.add_argument("--list", action="store_true", help="list the matching messages instead of counting")
+    parser.add_argument("--limit", type=int, default=20, help="most rows printed (default: 20)")
+    parser.add_argument("--sql", help="run this read-only SQL query instead")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "query":
+        run_query(parse_query_args(argv[1:], prog="results_store.py query"))
+    else:
+        print(__doc__.strip())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+risk_scoring.py
+
+This scores many analyzed messages at once, for trying out new weights
+
+The indicator counts of a batch of results form a feature matrix, one row
+per message and one column per indicator (see INDICATOR_WEIGHTS in
+report_generator.py). Ratings are then a single matrix-vector product and
+grades a comparison against the thresholds, so a million messages are
+re-scored in well under a second without parsing anything again.
+
+Matrices are saved as .npz files, with the scoring the messages were graded
+with: by main.py with "--features", or built from stored JSON Lines results with
+    python risk_scoring.py build reports/results.jsonl reports/features.npz
+(adding "--scoring FILE" if the results were graded with one) and re-scored
+with the weights and thresholds of a scoring config file with
+    python risk_scoring.py rescore reports/features.npz --scoring scoring.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+import numpy as np
+from report_generator import INDICATOR_WEIGHTS, LOWEST_GRADE, RISK_THRESHOLDS, load_scoring
+from result_writer import DEFAULT_FEATURES_PATH
+
+INDICATORS = list(INDICATOR_WEIGHTS)
+# Rows added to a matrix at a time while building it
+BLOCK_ROWS = 65536
+
+"""
+FeatureMatrix
+
+Collects the indicator counts and names of messages, a block of rows at a
+time, and saves them as an .npz file. scoring is the one the messages were
+graded with (see load_scoring), by default the default weights and thresholds
+"""
+class FeatureMatrix:
+    def __init__(self, scoring=None):
+        self.scoring = scoring or default_scoring()
+        self.blocks = []
+        self.block = np.zeros((BLOCK_ROWS, len(INDICATORS)), dtype=np.int32)
+        self.rows = 0
+        self.names = []
+
+    """
+    add
+
+    Adds the indicator counts (a dict, see analyze_email) of one message
+    """
+    def add(self, name, indicators):
+        self.block[self.rows] = [indicators.get(indicator, 0) for indicator in INDICATORS]
+        self.names.append(name)
+        self.rows += 1
+        if self.rows == BLOCK_ROWS:
+            self.blocks.append(self.block)
+            self.block = np.zeros((BLOCK_ROWS, len(INDICATORS)), dtype=np.int32)
+            self.rows = 0
+
+    """
+    features
+
+    Returns the counts added so far as a matrix
+    """
+    def features(self):
+        return np.concatenate(self.blocks + [self.block[:self.rows]])
+
+    """
+    save
+
+    Writes the matrix, the indicator of each column, the name of each row and
+    the scoring to path
+    """
+    def save(self, path=DEFAULT_FEATURES_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Names are stored as one UTF-8 block, a fixed width string array would be mostly padding
+        names = "\n".join(name.replace("\n", " ") for name in self.names).encode("utf-8")
+        np.savez(path, features=self.features(), indicators=np.array(INDICATORS),
+                 names=np.frombuffer(names, dtype=np.uint8), scoring=np.array(json.dumps(self.scoring)))
+
+"""
+default_scoring
+
+Returns the default weights and thresholds in the form load_scoring returns
+"""
+def default_scoring():
+    return {"weights": dict(INDICATOR_WEIGHTS), "thresholds": dict(RISK_THRESHOLDS)}
+
+"""
+load_features
+
+Returns (features, names, scoring) of an .npz file written by
+FeatureMatrix.save, with the columns in the order of INDICATORS. Indicators
+the file does not have count as 0. Files saved before the scoring was kept
+are taken to be graded with the defaults
+"""
+def load_features(path):
+    with np.load(path) as saved:
+        stored = list(saved["indicators"])
+        names = saved["names"].tobytes().decode("utf-8").split("\n") if saved["names"].size else []
+        scoring = default_scoring()
+        if "scoring" in saved.files:
+            saved_scoring = json.loads(str(saved["scoring"]))
+            # Indicators added since keep their default weight
+            scoring = {"weights": {**scoring["weights"], **saved_scoring["weights"]},
+                       "thresholds": saved_scoring["thresholds"]}
+        features = np.zeros((saved["features"].shape[0], len(INDICATORS)), dtype=np.int32)
+        for column, indicator in enumerate(INDICATORS):
+            if indicator in stored:
+                features[:, column] = saved["features"][:, stored.index(indicator)]
+    return features, names, scoring
+
+"""
+json_object_at
+
+Returns the flat JSON object that follows key in a line of JSON, or None.
+Saves decoding the whole of a large result for a few fields
+"""
+def json_object_at(line, key):
+    start = line.find(key)
+    if start == -1:
+        return None
+    start += len(key)
+    return json.loads(line[start:line.index("}", start) + 1])
+
+"""
+source_name
+
+Returns the name of a message from the source of its result
+"""
+def source_name(source):
+    if "container" in source:
+        return f"{os.path.basename(source['container'])} ({source['location']})"
+    return source.get("name") or ""
+
+"""
+build_features
+
+Returns a FeatureMatrix of the results in a JSON Lines file (see
+result_writer.py) graded with scoring. Lines of messages that could not be
+analyzed are skipped
+"""
+def build_features(jsonl_path, scoring=None):
+    matrix = FeatureMatrix(scoring)
+    with open(jsonl_path, "r", encoding="utf-8") as results_file:
+        for line in results_file:
+            try:
+                # Written compactly by JsonlWriter, so the keys appear exactly like this
+                indicators = json_object_at(line, '"indicators":')
+                source = json_object_at(line, '"source":')
+            except ValueError:
+                # A "}" inside the source's strings, decode the whole result
+                result = json.loads(line)
+                indicators = result.get("indicators")
+                source = result.get("source")
+            if indicators is None:
+                continue
+            matrix.add(source_name(source or {}), indicators)
+    return matrix
+
+"""
+score
+
+Returns the risk rating of every row of a feature matrix
+"""
+def score(features, weights):
+    weight_vector = np.array([weights[indicator] for indicator in INDICATORS], dtype=np.float64)
+    ratings = features @ weight_vector
+    # Integer weights give integer ratings, as analyze_email does
+    if all(float(weight).is_integer() for weight in weights.values()):
+        return ratings.astype(np.int64)
+    return ratings
+
+"""
+grade
+
+Returns the grades of an array of ratings as (grade names, index of each
+rating's grade in grade names)
+"""
+def grade(ratings, thresholds):
+    names = list(thresholds) + [LOWEST_GRADE]
+    grades = np.full(len(ratings), len(names) - 1, dtype=np.int8)
+    # Lowest threshold first, so higher grades overwrite lower ones
+    for index in reversed(range(len(thresholds))):
+        grades[ratings >= thresholds[names[index]]] = index
+    return names, grades
+
+"""
+rescore
+
+Returns the ratings and grades of a feature matrix with the scoring it was
+graded with (by default the default one) and with the given one, and how
+many messages changed grade
+"""
+def rescore(features, scoring, graded_with=None):
+    graded_with = graded_with or default_scoring()
+    before = score(features, graded_with["weights"])
+    after = score(features, scoring["weights"])
+    names_before, grades_before = grade(before, graded_with["thresholds"])
+    names_after, grades_after = grade(after, scoring["thresholds"])
+    grades_before = np.array(names_before)[grades_before]
+    grades_after = np.array(names_after)[grades_after]
+    return {
+        "ratings_before": before,
+        "ratings_after": after,
+        "grades_before": grades_before,
+        "grades_after": grades_after,
+        "changed": int(np.count_nonzero(grades_before != grades_after))
+    }
+
+"""
+print_rescore
+
+Prints the number of messages in each grade before and after re-scoring
+"""
+def print_rescore(rescored, elapsed):
+    count = len(rescored["ratings_after"])
+    print(f"Re-scored {count} messages in {elapsed * 1000:.1f} ms, {rescored['changed']} changed grade")
+    for grade_name in list(RISK_THRESHOLDS) + [LOWEST_GRADE]:
+        before = int(np.count_nonzero(rescored["grades_before"] == grade_name))
+        after = int(np.count_nonzero(rescored["grades_after"] == grade_name))
+        print(f"  {grade_name:<14} {before:>9} -> {after:<9}")
+
+"""
+write_changes
+
+Writes the messages whose grade changed to a CSV file
+"""
+def write_changes(path, names, rescored):
+    changed = np.flatnonzero(rescored["grades_before"] != rescored["grades_after"])
+    with open(path, "w", encoding="utf-8", newline="") as changes_file:
+        writer = csv.writer(changes_file)
+        writer.writerow(["message", "rating_before", "grade_before", "rating_after", "grade_after"])
+        for row in changed:
+            writer.writerow([names[row] if row < len(names) else row,
+                             rescored["ratings_before"][row], rescored["grades_before"][row],
+                             rescored["ratings_after"][row], rescored["grades_after"][row]])
+    return len(changed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and re-score feature matrices of analyzed messages")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build a feature matrix from JSON Lines results")
+    build.add_argument("results", help="JSON Lines results written with --format jsonl")
+    build.add_argument("features", nargs="?", default=DEFAULT_FEATURES_PATH,
+                       help=f"feature matrix to write (default: {DEFAULT_FEATURES_PATH})")
+    build.add_argument("--scoring", help="scoring config file the results were graded with (default: the defaults)")
+
+    rescore_command = commands.add_parser("rescore", help="score a feature matrix with other weights")
+    rescore_command.add_argument("features", nargs="?", default=DEFAULT_FEATURES_PATH,
+                                 help=f"feature matrix (default: {DEFAULT_FEATURES_PATH})")
+    rescore_command.add_argument("--scoring", help="scoring config file with the new weights and thresholds")
+    rescore_command.add_argument("--changes", metavar="CSV", help="write the messages that changed grade here")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        matrix = build_features(args.results, load_scoring(args.scoring) if args.scoring else None)
+        matrix.save(args.features)
+        print(f"{len(matrix.names)} messages written to {args.features} in {time.perf_counter() - start:.1f} s")
+        return
+
+    scoring = load_scoring(args.scoring) if args.scoring else default_scoring()
+    features, names, graded_with = load_features(args.features)
+    start = time.perf_counter()
+    rescored = rescore(features, scoring, graded_with)
+    print_rescore(rescored, time.perf_counter() - start)
+    if args.changes:
+        print(f"{write_changes(args.changes, names, rescored)} changed messages written to {args.changes}")
+
+if __name__ == "__main__":
+    main()
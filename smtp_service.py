@@ -0,0 +1,330 @@
+"""
+smtp_service.py
+
+This scores messages as they pass through a mail relay
+
+An SMTP (or, with --lmtp, LMTP) listener built on asyncio. Every message
+received is analyzed like a scanned eml file and the risk grade is sent back
+in the reply to DATA, e.g. "250 2.0.0 Ok: HIGH RISK (21)". With --forward
+HOST:PORT the message is passed on to the next relay with X-Threat-Risk
+headers added, and the reply to DATA waits for that relay to accept it.
+A message that cannot be analyzed is accepted and marked "not analyzed":
+asking the sender to retry would only fail the same way again.
+
+Each message has a latency budget. Parsing and the checks always run;
+geolocation of the hops gets whatever is left of the budget, and if the
+lookups are not back by then the hops are reported without a location and
+the result is marked partial. Lookups that finish late still fill the cache.
+One event loop serves all connections, the analysis runs in a thread pool.
+
+Run with "python smtp_service.py --port 10025" and try it with smtplib:
+    smtplib.SMTP("127.0.0.1", 10025).sendmail(sender, [recipient], message)
+"""
+
+import argparse
+import asyncio
+import smtplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from eml_ingest import configure_limits, parse_eml_bytes, parse_eml_headers
+from geolocator import configure_default_client, get_default_client, skipped_location
+from hash_reputation import configure_hash_index, get_hash_index
+from main import add_geo_arguments, add_limit_arguments, geo_options_from_args, limits_from_args
+from report_generator import analyze_email, configure_scoring, configure_triage, get_triage, load_scoring
+from text_analyzer import configure_whole_words
+
+DEFAULT_PORT = 10025
+DEFAULT_BUDGET_MS = 500
+MAX_MESSAGE_SIZE = 25 * 1024 * 1024
+# Longest command line accepted, longer message lines are read in pieces of this size
+MAX_LINE_LENGTH = 64 * 1024
+# Grade given to messages that could not be analyzed
+NOT_ANALYZED = "not analyzed"
+
+"""
+risk_headers
+
+Returns the X-Threat-Risk headers added to forwarded messages, for a
+result of None those of a message that could not be analyzed
+"""
+def risk_headers(result):
+    if result is None:
+        return f"X-Threat-Risk: {NOT_ANALYZED}\r\n".encode("ascii")
+    headers = (f"X-Threat-Risk: {result['risk_grade']}\r\n"
+               f"X-Threat-Risk-Rating: {result['risk_rating']}\r\n")
+    if result["partial"]:
+        headers += f"X-Threat-Risk-Partial: skipped {', '.join(result['skipped_stages'])}\r\n"
+    return headers.encode("ascii")
+
+"""
+forward_message
+
+Sends a message on to the next relay with the risk headers added
+"""
+def forward_message(host, port, sender, recipients, data, result):
+    with smtplib.SMTP(host, port, timeout=30) as relay:
+        relay.sendmail(sender, recipients, risk_headers(result) + data)
+
+"""
+ScanService
+
+Analyzes the messages received on each connection. client is the
+geolocation client, budget the seconds one message may take
+"""
+class ScanService:
+    def __init__(self, client, budget=DEFAULT_BUDGET_MS / 1000, lmtp=False, forward=None, threads=None):
+        self.client = client
+        self.budget = budget
+        self.lmtp = lmtp
+        self.forward = forward
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.hostname = socket.getfqdn()
+        self.received = 0
+
+    """
+    analyze
+
+    Returns the result for a received message, within the latency budget
+    """
+    async def analyze(self, data, name):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.budget
+        if get_triage():
+            # The body is parsed later, if the header leaves the grade open
+            email_data = await loop.run_in_executor(self.executor, parse_eml_headers, data)
+            email_data["raw"] = data
+        else:
+            email_data = await loop.run_in_executor(self.executor, parse_eml_bytes, data)
+
+        hop_ips = email_data["hop_ips"]
+        location_request = self.client.lookup_async(hop_ips)
+        skipped_stages = []
+        if location_request.done():
+            locations = location_request.result()
+        else:
+            # Queued lookups are sent now rather than waiting for a full batch
+            self.client.flush()
+            waiting = [asyncio.wrap_future(future) for future in location_request.futures]
+            done, pending = await asyncio.wait(waiting, timeout=max(0.0, deadline - time.monotonic()))
+            locations = [future.result() if future.done() else skipped_location(ip)
+                         for ip, future in zip(hop_ips, location_request.futures)]
+            if pending:
+                skipped_stages.append("geolocation")
+
+        result = await loop.run_in_executor(self.executor, lambda: analyze_email(
+            email_data, locations, source={"name": name}))
+        result["partial"] = bool(skipped_stages)
+        result["skipped_stages"] = skipped_stages + result["skipped_stages"]
+        return result
+
+    """
+    handle
+
+    Talks SMTP / LMTP with one client until it quits or disconnects
+    """
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        greeting = "LMTP" if self.lmtp else "ESMTP"
+
+        async def reply(*lines):
+            writer.write("".join(line + "\r\n" for line in lines).encode("utf-8"))
+            await writer.drain()
+
+        sender = None
+        recipients = []
+        try:
+            await reply(f"220 {self.hostname} {greeting} threat scanner ready")
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    await reply("500 5.5.2 Line too long")
+                    break
+                command, _, argument = line.decode("utf-8", "replace").strip().partition(" ")
+                command = command.upper()
+
+                if command in ("HELO", "EHLO", "LHLO"):
+                    sender = None
+                    recipients = []
+                    if command == "HELO":
+                        await reply(f"250 {self.hostname}")
+                    else:
+                        await reply(f"250-{self.hostname}", f"250-SIZE {MAX_MESSAGE_SIZE}", "250-8BITMIME",
+                                    "250-PIPELINING", "250 ENHANCEDSTATUSCODES")
+                elif command == "MAIL":
+                    sender = argument.partition(":")[2].strip().split(" ")[0].strip("<>")
+                    recipients = []
+                    await reply("250 2.1.0 Ok")
+                elif command == "RCPT":
+                    if sender is None:
+                        await reply("503 5.5.1 Need MAIL first")
+                    else:
+                        recipients.append(argument.partition(":")[2].strip().split(" ")[0].strip("<>"))
+                        await reply("250 2.1.5 Ok")
+                elif command == "DATA":
+                    if not recipients:
+                        await reply("503 5.5.1 Need RCPT first")
+                        continue
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = await self.read_data(reader)
+                    if data is None:
+                        replies = ["552 5.3.4 Message too big"]
+                    else:
+                        replies = await self.scan(peer, sender, recipients, data)
+                    # LMTP answers for every recipient
+                    await reply(*(replies * len(recipients) if self.lmtp else replies))
+                    sender = None
+                    recipients = []
+                elif command == "RSET":
+                    sender = None
+                    recipients = []
+                    await reply("250 2.0.0 Ok")
+                elif command == "NOOP":
+                    await reply("250 2.0.0 Ok")
+                elif command == "QUIT":
+                    await reply("221 2.0.0 Bye")
+                    break
+                else:
+                    await reply("502 5.5.2 Command not recognized")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    """
+    read_data
+
+    Returns the message sent after DATA, with dot-stuffing undone, or None if
+    it was larger than MAX_MESSAGE_SIZE (the rest is read and dropped). Lines
+    longer than MAX_LINE_LENGTH (unwrapped html, say) are read in pieces
+    """
+    async def read_data(self, reader):
+        pieces = []
+        size = 0
+        line_start = True
+        while True:
+            try:
+                piece = await reader.readuntil(b"\n")
+            except asyncio.LimitOverrunError as e:
+                # No line break in the buffer, take what is there and read on
+                piece = await reader.readexactly(e.consumed)
+            if line_start:
+                if piece in (b".\r\n", b".\n"):
+                    break
+                if piece.startswith(b"."):
+                    piece = piece[1:]
+            line_start = piece.endswith(b"\n")
+            size += len(piece)
+            if size <= MAX_MESSAGE_SIZE:
+                pieces.append(piece)
+        if size > MAX_MESSAGE_SIZE:
+            return None
+        return b"".join(pieces)
+
+    """
+    scan
+
+    Analyzes a received message, forwards it if configured and returns the
+    reply lines for DATA. A message that cannot be analyzed is accepted as
+    not analyzed, the same message would fail again if it were retried
+    """
+    async def scan(self, peer, sender, recipients, data):
+        self.received += 1
+        name = f"{peer[0]}:{peer[1]} #{self.received}" if peer else f"#{self.received}"
+        started = time.perf_counter()
+        try:
+            result = await self.analyze(data, name)
+        except Exception as e:
+            print(f"{name}: failed ({type(e).__name__}: {e})")
+            result = None
+
+        if result is None:
+            reply = f"250 2.0.0 Ok: {NOT_ANALYZED}"
+        else:
+            partial = " partial" if result["partial"] else ""
+            reply = f"250 2.0.0 Ok: {result['risk_grade']} ({result['risk_rating']}){partial}"
+            print(f"{name}: {result['risk_rating']} ({result['risk_grade']}){partial}, "
+                  f"{(time.perf_counter() - started) * 1000:.0f} ms")
+        if self.forward:
+            host, port = self.forward
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self.executor, forward_message, host, port,
+                                           sender, recipients, data, result)
+            except (OSError, smtplib.SMTPException) as e:
+                print(f"{name}: could not be forwarded ({type(e).__name__}: {e})")
+                return ["451 4.4.0 Next relay unavailable"]
+        return [reply]
+
+    """
+    serve
+
+    Accepts connections on host:port until cancelled
+    """
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_LENGTH, backlog=512)
+        addresses = ", ".join(f"{address[0]}:{address[1]}" for address in
+                              (sock.getsockname() for sock in server.sockets))
+        print(f"Listening for {'LMTP' if self.lmtp else 'SMTP'} on {addresses}")
+        async with server:
+            await server.serve_forever()
+
+"""
+parse_args
+
+Returns the parsed command line arguments
+"""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score messages passing through an SMTP or LMTP relay")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--lmtp", action="store_true", help="speak LMTP instead of SMTP")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"time allowed per message before geolocation is skipped (default: {DEFAULT_BUDGET_MS})")
+    parser.add_argument("--forward", metavar="HOST:PORT",
+                        help="pass messages on to this SMTP relay with X-Threat-Risk headers added")
+    parser.add_argument("--threads", type=int, help="threads analyzing messages (default: based on CPUs)")
+    parser.add_argument("--triage", action="store_true",
+                        help="stop analyzing a message as soon as it is certain to be HIGH RISK")
+    parser.add_argument("--whole-words", action="store_true",
+                        help="only match keywords as complete words (by default they match anywhere)")
+    parser.add_argument("--hash-index", metavar="INDEX",
+                        help="check attachments against known malicious hashes in an index built by "
+                             "hash_reputation.py")
+    parser.add_argument("--scoring", metavar="FILE",
+                        help="JSON file with the indicator weights and grade thresholds to use (see README)")
+    add_geo_arguments(parser)
+    add_limit_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.forward:
+        host, _, port = args.forward.rpartition(":")
+        if not host or not port.isdigit():
+            parser.error("--forward must be HOST:PORT")
+        args.forward = (host, int(port))
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_limits(limits_from_args(args))
+    if args.scoring:
+        configure_scoring(load_scoring(args.scoring))
+    configure_hash_index(args.hash_index)
+    configure_triage(args.triage)
+    configure_whole_words(args.whole_words)
+    # Opened now rather than by the first message
+    get_hash_index()
+    configure_default_client(geo_options_from_args(args))
+    client = get_default_client()
+    service = ScanService(client, args.budget_ms / 1000, args.lmtp, args.forward, args.threads)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+synthetic_corpus.py
+
+This generates reproducible synthetic phishing corpora for benchmarking
+
+Messages are modeled on the samples in ./emails: spoofed senders with
+mismatched Reply-To, chains of Received hops, bodies mixing ordinary text
+with urgency/credential/financial phrases, links on suspicious TLDs and raw
+ips, and risky attachments, optionally nested in multipart/mixed parts.
+The same seed and settings always produce the same messages.
+
+Run with "python synthetic_corpus.py OUTPUT_FOLDER COUNT [CAMPAIGN_SIZE]" to
+write a corpus, with CAMPAIGN_SIZE near-identical messages per campaign
+"""
+
+import random
+import sys
+from email.message import EmailMessage
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from text_analyzer import URGENT_LANGUAGE, CREDENTIAL_LANGUAGE, FINANCIAL_LANGUAGE
+from url_analyzer import SUSPICIOUS_TLDS
+
+FILLER_WORDS = [
+    "please", "review", "the", "attached", "document", "and", "let", "us", "know",
+    "your", "account", "team", "meeting", "update", "schedule", "recent", "order",
+    "support", "customer", "service", "thank", "you", "for", "regards", "today"
+]
+SAFE_DOMAINS = ["example.com", "company.com", "mail.example.org", "partner.net"]
+SENDER_NAMES = ["Accounts Dept", "PayPal Support", "IT Helpdesk", "CEO", "Amazon Billing"]
+ATTACHMENTS = [
+    ("invoice.pdf", "application", "pdf", b"%PDF-1.4\n"),
+    ("update.js", "application", "javascript", b"alert('x');\n"),
+    ("report.docx", "application", "vnd.openxmlformats-officedocument.wordprocessingml.document", b"PK\x03\x04"),
+    ("setup.exe", "application", "x-msdownload", b"MZ"),
+    ("statement.pdf", "application", "pdf", b"MZ"),
+    ("photo.jpg", "image", "jpeg", b"\xff\xd8\xff\xe0")
+]
+DEFAULT_SETTINGS = {
+    "body_kib": 2,
+    "urls": 3,
+    "hops": 4,
+    "attachments": 1,
+    "attachment_kib": 64,
+    "multipart_depth": 1,
+    # Messages per campaign, near-identical apart from recipient and tracking token
+    "campaign_size": 1
+}
+
+"""
+random_public_ip
+
+Returns a random ip outside the private and reserved ranges
+"""
+def random_public_ip(rng):
+    while True:
+        first = rng.randint(1, 223)
+        if first not in (10, 100, 127, 169, 172, 192, 198, 203):
+            return f"{first}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+"""
+random_url
+
+Returns a link that is sometimes on a suspicious TLD, a raw ip or very long
+"""
+def random_url(rng):
+    kind = rng.random()
+    if kind < 0.3:
+        host = f"secure-login-{rng.randint(1, 999)}.{rng.choice(sorted(SUSPICIOUS_TLDS))}"
+    elif kind < 0.45:
+        host = random_public_ip(rng)
+    else:
+        host = rng.choice(SAFE_DOMAINS)
+    path = "/".join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.1:
+        path += "?token=" + "".join(rng.choice("abcdef0123456789") for _ in range(160))
+    return f"http{'s' if rng.random() < 0.7 else ''}://{host}/{path}"
+
+"""
+random_body
+
+Returns roughly body_kib KiB of text with phrases and links mixed in
+"""
+def random_body(rng, body_kib, url_count):
+    phrases = sorted(URGENT_LANGUAGE | CREDENTIAL_LANGUAGE | FINANCIAL_LANGUAGE)
+    lines = ["Dear customer,", ""]
+    size = 0
+    while size < body_kib * 1024:
+        line = " ".join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(8, 14)))
+        if rng.random() < 0.15:
+            line += " " + rng.choice(phrases)
+        lines.append(line.capitalize() + ".")
+        size += len(line) + 2
+    # Links spread through the text
+    for _ in range(url_count):
+        lines.insert(rng.randint(2, len(lines)), random_url(rng))
+    lines += ["", "Thank you,", "Support Team"]
+    return "\n".join(lines) + "\n"
+
+"""
+generate_message
+
+Returns one synthetic message as bytes
+"""
+def generate_message(rng, settings=None):
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+
+    # Body and attachments first, so they can be nested in further
+    # multipart/mixed layers for deeper MIME trees
+    content = EmailMessage()
+    content.set_content(random_body(rng, settings["body_kib"], settings["urls"]))
+    for _ in range(settings["attachments"]):
+        filename, maintype, subtype, magic = rng.choice(ATTACHMENTS)
+        data = magic + rng.randbytes(max(0, settings["attachment_kib"] * 1024 - len(magic)))
+        content.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    for _ in range(max(0, settings["multipart_depth"] - 1)):
+        wrapper = EmailMessage()
+        wrapper["Content-Type"] = "multipart/mixed"
+        wrapper.set_payload([content])
+        content = wrapper
+
+    message = EmailMessage()
+    sender_domain = rng.choice(SAFE_DOMAINS)
+    message["From"] = f'"{rng.choice(SENDER_NAMES)}" <no-reply@{sender_domain}>'
+    if rng.random() < 0.5:
+        message["Reply-To"] = f"help@support-{rng.randint(1, 99)}.{rng.choice(sorted(SUSPICIOUS_TLDS))}"
+    message["To"] = "user@example.com"
+    message["Subject"] = f"Action Required: {rng.choice(sorted(URGENT_LANGUAGE)).title()}"
+    sent = datetime(2025, 12, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randint(0, 500000))
+    message["Date"] = format_datetime(sent)
+    # Newest hop first, like real Received chains
+    for hop in range(settings["hops"]):
+        ip = random_public_ip(rng) if rng.random() < 0.8 else f"10.0.{hop}.{rng.randint(1, 254)}"
+        stamp = format_datetime(sent + timedelta(seconds=5 * (settings["hops"] - hop)))
+        message["Received"] = (f"from relay{hop}.example.net (relay{hop}.example.net [{ip}])"
+                               f" by mx{hop}.example.com with ESMTP id {rng.randint(10**5, 10**6)};"
+                               f" {stamp}")
+    for name, value in content.items():
+        message[name] = value
+    message.set_payload(content.get_payload())
+
+    # email picks boundaries with the global random module, pick them here instead
+    for index, part in enumerate(message.walk()):
+        if part.is_multipart():
+            part.set_boundary(f"=_part{index}_{rng.randint(10**8, 10**9)}")
+    return message.as_bytes()
+
+"""
+personalize
+
+Returns a campaign message addressed to one recipient, with its own tracking token
+"""
+def personalize(message, recipient, rng):
+    token = "".join(rng.choice("abcdef0123456789") for _ in range(24))
+    return (message.replace(b"To: user@example.com", f"To: user{recipient}@example.com".encode(), 1)
+                   .replace(b"Dear customer,", f"Dear user{recipient},".encode(), 1)
+                   .replace(b"Support Team", f"Support Team (ref {token})".encode(), 1))
+
+"""
+generate_corpus
+
+Writes count messages to folder as corpus_00000.eml, ... and returns their paths
+"""
+def generate_corpus(folder, count, seed=1, settings=None):
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        path = folder / f"corpus_{index:05d}.eml"
+        if settings["campaign_size"] > 1:
+            # Every member of a campaign is generated from the same seed
+            if index % settings["campaign_size"] == 0:
+                campaign_seed = rng.randrange(2 ** 32)
+            message = personalize(generate_message(random.Random(campaign_seed), settings), index, rng)
+        else:
+            message = generate_message(rng, settings)
+        path.write_bytes(message)
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print(__doc__.strip())
+    else:
+        campaign_size = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+        generate_corpus(sys.argv[1], int(sys.argv[2]), settings={"campaign_size": campaign_size})
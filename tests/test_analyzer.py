@@ -0,0 +1,25 @@
+import os
+from analyzer import EmailAnalyzer
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+
+def test_without_geolocation_hops_are_not_foreign():
+    with open(os.path.join(EMAILS, "foreign_hops.eml"), "rb") as eml_file:
+        data = eml_file.read()
+    with EmailAnalyzer(geolocate=False) as analyzer:
+        result = analyzer.analyze_bytes(data, name="foreign_hops.eml")
+    assert result["hops"]
+    assert all(hop["country"] is None and not hop["foreign"] for hop in result["hops"])
+    assert result["indicators"]["foreign_hop"] == 0
+
+def test_unclosed_svg_does_not_hide_the_message():
+    def message(prefix):
+        return (b"From: alerts@example.com\r\nTo: you@example.com\r\nSubject: Account notice\r\n"
+                b"MIME-Version: 1.0\r\nContent-Type: text/html\r\n\r\n" + prefix +
+                b"<p>Urgent: verify your account</p><a href=\"http://1.2.3.4/login\">paypal.com</a>\r\n")
+    with EmailAnalyzer(geolocate=False) as analyzer:
+        plain = analyzer.analyze_bytes(message(b""), name="plain.eml")
+        hidden = analyzer.analyze_bytes(message(b"<svg>"), name="svg.eml")
+    assert plain["risk_rating"] > 0
+    assert hidden["risk_rating"] == plain["risk_rating"]
+    assert hidden["urls"] == plain["urls"]
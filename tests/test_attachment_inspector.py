@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import pytest
+from email import policy
+from email.parser import BytesParser
+from attachment_inspector import inspect_attachment
+
+def attachment_part(content_transfer_encoding, body):
+    raw = (b"Content-Type: application/octet-stream\r\n"
+           b"Content-Transfer-Encoding: " + content_transfer_encoding.encode() + b"\r\n\r\n" + body)
+    return BytesParser(policy=policy.default).parsebytes(raw)
+
+@pytest.mark.parametrize("content_transfer_encoding, body", [
+    ("base64", base64.encodebytes(b"MZ" + bytes(range(256)) * 600)),
+    ("quoted-printable", b"caf=C3=A9 =E2=82=AC\r\n" * 100),
+    ("7bit", b"plain text\r\n" * 100),
+    # Not latin-1, must not be re-encoded differently from email's own decoding
+    ("8bit", "Привет, € and 日本語\r\n".encode("utf-8") * 100),
+])
+def test_digest_matches_email_decoding(content_transfer_encoding, body):
+    part = attachment_part(content_transfer_encoding, body)
+    decoded = part.get_payload(decode=True)
+    inspected = inspect_attachment(part, chunk_size=1000)
+    assert inspected["size"] == len(decoded)
+    assert inspected["sha256"] == hashlib.sha256(decoded).hexdigest()
+
+def test_sniffs_executable_in_base64():
+    part = attachment_part("base64", base64.encodebytes(b"MZ" + bytes(1000)))
+    assert inspect_attachment(part)["sniffed_mime"] == "application/x-msdownload"
+
+@pytest.mark.parametrize("body", [
+    # A padded chunk in the middle of the data, two encodings run together
+    base64.b64encode(b"ab") + base64.b64encode(bytes(300)),
+    b"QUJD\r\nRA==\r\n" + base64.encodebytes(bytes(300)),
+    base64.encodebytes(b"MZ" + bytes(2000)).rstrip() + b"=\r\n" + base64.encodebytes(bytes(range(256)) * 10),
+    # Characters outside the alphabet
+    base64.encodebytes(bytes(range(256)) * 20).replace(b"A", b"A!", 3).replace(b"B", b"-B", 2),
+    # One character left over
+    base64.encodebytes(bytes(range(256)) * 20).rstrip() + b"Q\r\n",
+], ids=["padded_pair", "padded_line", "padded_run", "non_alphabet", "one_left_over"])
+def test_damaged_base64_digest_matches_email_decoding(body):
+    part = attachment_part("base64", body)
+    decoded = part.get_payload(decode=True)
+    inspected = inspect_attachment(part, chunk_size=100)
+    assert inspected["size"] == len(decoded)
+    assert inspected["sha256"] == hashlib.sha256(decoded).hexdigest()
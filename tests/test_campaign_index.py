@@ -0,0 +1,73 @@
+from campaign_index import CampaignIndex, message_fingerprint
+from report_generator import analyze_email
+
+BODY = """Your mailbox storage is almost full.
+To keep receiving messages you must verify your account today.
+Unverified accounts are suspended within 24 hours.
+Click the link below and sign in with your password.
+https://mail-verify.example.top/login?id={token}
+This is an automated notice from the IT service desk.
+Please do not reply to this message.
+Thank you for your cooperation.
+IT Service Desk
+"""
+
+# A longer notice, where one line of its own moves the SimHash by a bit or two
+LONG_BODY = BODY + "".join(f"Section {chr(103 + i % 20)}{chr(103 + i // 20)}: your quota policy applies to "
+                           f"shared folders as well.\n" for i in range(200))
+
+def message(recipient, token, body=BODY, greeting=None):
+    greeting = greeting or f"Dear {recipient},"
+    return (f"From: IT Desk <it@example.top>\r\nTo: {recipient}@example.com\r\nSubject: Mailbox full\r\n"
+            f"Content-Type: text/plain\r\n\r\n{greeting}\r\n{body.format(token=token)}").encode()
+
+def analyzed(index, data, name):
+    # Parses a message through the index and analyzes it like finish_email does
+    email_data = index.complete(index.parse(data, name))
+    result = analyze_email(email_data, [], name)
+    index.remember(email_data, result)
+    return result
+
+def test_near_duplicates_share_a_campaign():
+    index = CampaignIndex()
+    # Recipient, customer number and tracking token of their own
+    first = analyzed(index, message("alice", "8f3a9b21", greeting="Dear customer 1042,"), "alice.eml")
+    second = analyzed(index, message("bob", "77c0de45", greeting="Dear customer 2291,"), "bob.eml")
+    third = analyzed(index, message("carol", "1234abcd", greeting="Dear customer 7,"), "carol.eml")
+    assert first["campaign"]["id"] == second["campaign"]["id"] == third["campaign"]["id"]
+    assert not first["campaign"]["reused"]
+    assert second["campaign"] == {"id": first["campaign"]["id"], "representative": "alice.eml", "reused": True}
+    # The reused findings grade the rest of the campaign like its first message
+    for result in (second, third):
+        assert result["indicators"] == first["indicators"]
+        assert result["risk_rating"] == first["risk_rating"]
+        assert result["header"]["To"] != first["header"]["To"]
+
+def test_own_greeting_shares_the_campaign_of_a_long_message():
+    index = CampaignIndex()
+    first = analyzed(index, message("alice", "8f3a9b21", LONG_BODY), "alice.eml")
+    for recipient in ("bob", "carol", "dave", "erin"):
+        result = analyzed(index, message(recipient, "77c0de45", LONG_BODY), f"{recipient}.eml")
+        assert result["campaign"]["id"] == first["campaign"]["id"]
+        assert result["campaign"]["reused"]
+
+def test_other_links_make_another_campaign():
+    index = CampaignIndex()
+    first = analyzed(index, message("alice", "8f3a9b21"), "alice.eml")
+    other_host = BODY.replace("mail-verify.example.top", "login.example.net")
+    second = analyzed(index, message("bob", "77c0de45", other_host), "bob.eml")
+    assert second["campaign"]["id"] != first["campaign"]["id"]
+    assert not second["campaign"]["reused"]
+
+def test_different_text_makes_another_campaign():
+    index = CampaignIndex()
+    first = analyzed(index, message("alice", "8f3a9b21"), "alice.eml")
+    other_text = "\n".join(f"Quarterly figures, line {letter}" for letter in "ghijklmnopqrstuvwxyz") + "\n"
+    second = analyzed(index, message("bob", "77c0de45", other_text), "bob.eml")
+    assert second["campaign"]["id"] != first["campaign"]["id"]
+
+def test_short_messages_are_not_fingerprinted():
+    assert message_fingerprint(b"Subject: hi\r\n\r\nSee you at noon.\r\n") is None
+    index = CampaignIndex()
+    email_data = index.parse(b"Subject: hi\r\n\r\nSee you at noon.\r\n", "short.eml")
+    assert "campaign" not in email_data
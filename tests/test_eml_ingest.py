@@ -0,0 +1,67 @@
+from eml_ingest import DEFAULT_LIMITS, LimitedParser, parse_eml_bytes, parse_limited
+
+HEADER = b"From: a@example.com\r\nTo: b@example.com\r\nSubject: test\r\nMIME-Version: 1.0\r\n"
+
+def test_single_part_non_text_body_is_skipped():
+    data = HEADER + b"Content-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n\r\nJVBERi0xLjQK\r\n"
+    email_data = parse_eml_bytes(data)
+    assert email_data["body"] == ""
+    assert "body_type" in email_data["limits_exceeded"]
+
+def test_unknown_charset_is_decoded_with_replacement():
+    data = HEADER + b"Content-Type: text/plain; charset=x-unknown\r\n\r\nVerify your account \xff now\r\n"
+    email_data = parse_eml_bytes(data)
+    assert email_data["body"] == "Verify your account � now"
+    assert "body_charset" in email_data["limits_exceeded"]
+
+def test_unknown_charset_in_multipart_html():
+    data = (HEADER + b"Content-Type: multipart/alternative; boundary=b\r\n\r\n--b\r\n"
+            b"Content-Type: text/html; charset=x-unknown\r\n\r\n<p>Click <a href=\"http://evil.example\">here</a></p>\r\n"
+            b"--b--\r\n")
+    email_data = parse_eml_bytes(data)
+    assert email_data["body"] == "Click here"
+    assert "body_charset" in email_data["limits_exceeded"]
+
+def test_known_charset_is_not_noted():
+    data = HEADER + b"Content-Type: text/plain; charset=iso-8859-1\r\n\r\nCaf\xe9\r\n"
+    email_data = parse_eml_bytes(data)
+    assert email_data["body"] == "Café"
+    assert email_data["limits_exceeded"] == []
+
+def nested_message(depth):
+    data = b"Content-Type: text/plain\r\n\r\ninnermost\r\n"
+    for level in range(depth):
+        boundary = f"b{level}".encode()
+        data = (b"Content-Type: multipart/mixed; boundary=" + boundary + b"\r\n\r\n--" + boundary + b"\r\n"
+                + data + b"\r\n--" + boundary + b"--\r\n")
+    return HEADER + data
+
+def many_parts_message(count):
+    parts = b"".join(b"--b\r\nContent-Type: text/plain\r\n\r\npart\r\n" for _ in range(count))
+    return HEADER + b"Content-Type: multipart/mixed; boundary=b\r\n\r\n" + parts + b"--b--\r\n"
+
+def test_parser_counts_every_part_it_creates():
+    # LimitedParser relies on email.feedparser calling _new_message for every
+    # part and keeping _msgstack / _cur, this fails if that ever changes
+    parser = LimitedParser(DEFAULT_LIMITS)
+    parser.feed(many_parts_message(3))
+    msg = parser.close()
+    assert parser.parts == 4
+    assert parser.root is msg
+    assert len(list(msg.walk())) == 4
+
+def test_parsing_stops_at_the_part_limit():
+    limits = {**DEFAULT_LIMITS, "max_parts": 10}
+    msg, exceeded = parse_limited(many_parts_message(10000), limits)
+    assert exceeded == ["parts"]
+    assert len(list(msg.walk())) <= 10
+
+def test_parsing_stops_at_the_depth_limit():
+    limits = {**DEFAULT_LIMITS, "max_depth": 5}
+    msg, exceeded = parse_limited(nested_message(50), limits)
+    assert exceeded == ["depth"]
+    depth = 0
+    while msg.is_multipart() and msg.get_payload():
+        msg = msg.get_payload()[0]
+        depth += 1
+    assert depth <= limits["max_depth"] + 1
@@ -0,0 +1,57 @@
+import pytest
+import geolocation_cache
+from geolocation_cache import GeolocationCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geolocation_cache.time, "time", clock.time)
+    return clock
+
+def location(ip):
+    return {"ip": ip, "city": "Ashburn", "region": "Virginia", "country": "United States"}
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    cache = GeolocationCache(str(tmp_path / "cache.db"), ttl=100, negative_ttl=10)
+    cache.put_many([(location("8.8.8.8"), True), (location("10.0.0.1"), False)])
+    clock.now += 50
+    assert cache.get("8.8.8.8") == location("8.8.8.8")
+    # Failed lookups are kept for the shorter negative_ttl
+    assert cache.get("10.0.0.1") is None
+    clock.now += 51
+    assert cache.get("8.8.8.8") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    cache.close()
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = GeolocationCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put_many([(location("1.1.1.1"), True)])
+    clock.now += 1
+    cache.put_many([(location("2.2.2.2"), True)])
+    clock.now += 1
+    # Using the oldest entry makes the other one the least recently used
+    assert cache.get("1.1.1.1") is not None
+    clock.now += 1
+    cache.put_many([(location("3.3.3.3"), True)])
+    assert cache.get("2.2.2.2") is None
+    assert cache.get("1.1.1.1") is not None
+    assert cache.get("3.3.3.3") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+    cache.close()
+
+def test_entries_outlive_the_connection(tmp_path, clock):
+    cache = GeolocationCache(str(tmp_path / "cache.db"))
+    cache.put_many([(location("8.8.8.8"), True)])
+    cache.close()
+    reopened = GeolocationCache(str(tmp_path / "cache.db"))
+    assert reopened.get("8.8.8.8") == location("8.8.8.8")
+    reopened.close()
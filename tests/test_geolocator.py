@@ -0,0 +1,43 @@
+import sqlite3
+import geolocator
+from geolocation_stub import start_stub_server
+from geolocator import GeolocationClient
+
+IPS = ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
+
+def wait(request):
+    # A lost batch would block result() forever, fail instead
+    return [future.result(timeout=10) for future in request.futures]
+
+class LockedCache:
+    def get(self, ip):
+        return None
+
+    def put_many(self, entries):
+        raise sqlite3.OperationalError("database is locked")
+
+    def close(self):
+        pass
+
+def test_failing_cache_does_not_hang_the_lookup():
+    stub = start_stub_server()
+    client = GeolocationClient(base_url=stub.base_url, cache=LockedCache())
+    try:
+        locations = wait(client.lookup_async(IPS))
+        assert [location["ip"] for location in locations] == IPS
+        assert all(location["country"] is not None for location in locations)
+    finally:
+        client.close()
+        stub.shutdown()
+
+def test_failing_response_handling_gives_placeholders(monkeypatch):
+    def broken(ip, data):
+        raise KeyError("city")
+    monkeypatch.setattr(geolocator, "location_from_response", broken)
+    stub = start_stub_server()
+    client = GeolocationClient(base_url=stub.base_url)
+    try:
+        assert wait(client.lookup_async(IPS)) == [geolocator.placeholder_location(ip) for ip in IPS]
+    finally:
+        client.close()
+        stub.shutdown()
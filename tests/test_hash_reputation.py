@@ -0,0 +1,44 @@
+import hashlib
+import threading
+from hash_reputation import HashIndex, build_index
+
+def build(tmp_path, digests):
+    feed_path = tmp_path / "feed.txt"
+    feed_path.write_text("".join(f"{digest},known bad\n" for digest in digests))
+    index_path = tmp_path / "hashes.idx"
+    build_index(str(feed_path), str(index_path))
+    return HashIndex(str(index_path))
+
+def test_duplicates_are_indexed_once(tmp_path):
+    bad = [hashlib.sha256(str(number).encode()).hexdigest() for number in range(50)]
+    index = build(tmp_path, bad + bad[:10])
+    try:
+        assert index.count == 50
+        assert all(index.contains(digest) for digest in bad)
+        assert not index.contains(hashlib.sha256(b"clean").hexdigest())
+        assert not index.contains("not a hash")
+    finally:
+        index.close()
+
+def test_counters_add_up_across_threads(tmp_path):
+    bad = [hashlib.sha256(str(number).encode()).hexdigest() for number in range(10)]
+    clean = [hashlib.sha256(f"clean {number}".encode()).hexdigest() for number in range(10)]
+    index = build(tmp_path, bad)
+
+    def look_up():
+        for _ in range(200):
+            for digest in bad + clean:
+                index.contains(digest)
+
+    threads = [threading.Thread(target=look_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        stats = index.stats()
+        assert stats["lookups"] == 8 * 200 * 20
+        assert stats["matches"] == 8 * 200 * 10
+        assert stats["bloom_rejected"] <= 8 * 200 * 10
+    finally:
+        index.close()
@@ -0,0 +1,43 @@
+from html_extractor import extract_html
+
+def test_block_elements_do_not_glue_text():
+    html = ("<table><tr><td><a href=\"https://www.paypal.com/\">www.paypal.com</a></td><td>Visit</td></tr></table>"
+            "<dl><dt>Amount</dt><dd>$500</dd></dl><p>Account</p><div>verify</div>")
+    text = extract_html(html)["text"]
+    assert "www.paypal.comVisit" not in text
+    assert text.split("\n") == ["www.paypal.com", "Visit", "Amount", "$500", "Account", "verify"]
+
+def test_spaced_inline_elements_do_not_glue_text():
+    html = "<span>gift</span><img src=\"cid:logo\"><span>card</span> <label>User</label><input name=u>"
+    assert extract_html(html)["text"] == "gift card User"
+
+def test_plain_inline_elements_keep_words_whole():
+    assert extract_html("<p>Ver<b>ify</b> your <i>account</i></p>")["text"] == "Verify your account"
+
+def test_entities_are_decoded_after_tags():
+    html = "<p>Pay&amp;Save&nbsp;now</p><p>&lt;div&gt;not a tag&lt;/div&gt;</p>"
+    assert extract_html(html)["text"] == "Pay&Save now\n<div>not a tag</div>"
+
+def test_link_text_split_over_lines_is_checked():
+    html = "<a href=\"http://evil.example.ru/login\">www.paypal.com<br>Visit us</a>"
+    assert extract_html(html)["mismatches"] == [{"text": "www.paypal.com", "href": "http://evil.example.ru/login"}]
+
+def test_link_text_with_entities():
+    html = "<a href=\"http://evil.example.ru/\">www&#46;paypal&#46;com</a><a href=\"https://www.paypal.com/x\">paypal.com</a>"
+    assert extract_html(html)["mismatches"] == [{"text": "www.paypal.com", "href": "http://evil.example.ru/"}]
+
+def test_unclosed_hidden_element_hides_only_its_tag():
+    body = ("<p>Urgent: verify your account</p>"
+            "<a href=\"http://1.2.3.4/login\">paypal.com</a>")
+    for opening in ("<svg>", "<object data=x>", "<TEMPLATE>", "<script>", "<!--"):
+        extracted = extract_html(opening + body)
+        assert extracted["text"] == "Urgent: verify your account\npaypal.com"
+        assert extracted["links"] == ["http://1.2.3.4/login"]
+        assert extracted["mismatches"] == [{"text": "paypal.com", "href": "http://1.2.3.4/login"}]
+
+def test_closed_hidden_elements_are_removed():
+    html = "<svg><text>hidden</text></svg><p>shown</p><!-- note --><script>var a = '<p>x</p>';</SCRIPT >end"
+    assert extract_html(html)["text"] == "shown\nend"
+
+def test_whitespace_is_collapsed():
+    assert extract_html("<p>a \t b  c\td</p>\n\n  <p> e </p>")["text"] == "a b c d\ne"
@@ -0,0 +1,40 @@
+import os
+import pytest
+from eml_ingest import parse_eml
+from keyword_matcher import KeywordMatcher
+from text_analyzer import LANGUAGE_CATEGORIES, build_keyword_matcher, scan_language
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+
+"""
+substring_scan
+
+The checks the matcher replaced: every phrase looked for with "in"
+"""
+def substring_scan(text):
+    return {category: {phrase for phrase in phrases if phrase in text.lower()}
+            for category, phrases in LANGUAGE_CATEGORIES.items()}
+
+def sample_bodies():
+    return [parse_eml(os.path.join(EMAILS, name))["body"] for name in sorted(os.listdir(EMAILS))
+            if name.endswith(".eml")]
+
+@pytest.mark.parametrize("body", sample_bodies())
+def test_default_matches_substring_scan_on_samples(body):
+    found = scan_language(body)
+    assert {category: set(phrases) for category, phrases in found.items()} == substring_scan(body)
+
+def test_default_matches_inside_words():
+    matcher = KeywordMatcher({"financial": ["gift card"]})
+    assert matcher.match_categories("Buy GIFT CARDS today")["financial"] == ["gift card"]
+
+def test_whole_words_is_opt_in():
+    matcher = build_keyword_matcher({"financial": ["wire"]}, whole_words=True)
+    assert "wire" not in matcher.match_categories("Wireless offer")["financial"]
+    assert "wire" in matcher.match_categories("Please wire the money.")["financial"]
+    assert "wire" in build_keyword_matcher({"financial": ["wire"]}).match_categories("Wireless")["financial"]
+
+def test_whole_words_matches_across_lines():
+    matcher = KeywordMatcher({"credential": ["verify your account"]}, whole_words=True)
+    assert matcher.match_categories("Please verify\nyour account")["credential"] == ["verify your account"]
+    assert matcher.match_categories("Please reverify your accounts")["credential"] == []
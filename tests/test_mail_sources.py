@@ -0,0 +1,76 @@
+import io
+import os
+import tarfile
+import zipfile
+import pytest
+from mail_sources import ContainedMessage, iter_sources, parse_source
+
+FIRST = b"From: a@example.com\nSubject: first\n\nHello\n"
+SECOND = b"From: b@example.com\nSubject: second\n\nFrom the start\nof a line\n"
+
+def listing(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder)
+                  for root, folders, files in os.walk(folder) for name in folders + files)
+
+def read(sources):
+    # Returns the subject and data of every message
+    return [(parse_source(source)["header"]["Subject"], source.data) for source in sources]
+
+def test_mbox_is_split_on_from_lines(tmp_path):
+    mbox_path = tmp_path / "inbox.mbox"
+    data = (b"From a@example.com Mon Jan  1 00:00:00 2024\n" + FIRST + b"\n"
+            b"From b@example.com Mon Jan  1 00:00:01 2024\n"
+            b"From: b@example.com\nSubject: second\n\n>From the start\nof a line\n")
+    mbox_path.write_bytes(data)
+    sources = list(iter_sources([mbox_path]))
+    assert all(isinstance(source, ContainedMessage) for source in sources)
+    assert read(sources) == [("first", FIRST), ("second", SECOND)]
+    assert [source.location for source in sources] == ["offset 0", f"offset {data.index(b'From b@')}"]
+
+def test_from_inside_a_paragraph_does_not_split_the_mbox(tmp_path):
+    mbox_path = tmp_path / "inbox.mbox"
+    body = b"From: a@example.com\nSubject: first\n\nQuoted below\nFrom here on\n"
+    mbox_path.write_bytes(b"From a@example.com Mon Jan  1 00:00:00 2024\n" + body)
+    assert read(iter_sources([mbox_path])) == [("first", body)]
+
+def test_maildir_new_and_cur_are_read(tmp_path):
+    maildir = tmp_path / "Maildir"
+    for folder in ("new", "cur", "tmp"):
+        (maildir / folder).mkdir(parents=True)
+    (maildir / "new" / "1.host").write_bytes(FIRST)
+    (maildir / "cur" / "2.host:2,S").write_bytes(SECOND)
+    (maildir / "cur" / ".hidden").write_bytes(b"not a message")
+    (maildir / "tmp" / "3.host").write_bytes(b"still being delivered")
+    sources = list(iter_sources([maildir]))
+    assert read(sources) == [("first", FIRST), ("second", SECOND)]
+    assert [source.location for source in sources] == ["new/1.host", "cur/2.host:2,S"]
+
+def test_zip_members_are_read_without_extracting(tmp_path):
+    zip_path = tmp_path / "messages.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        archive.writestr("a/first.eml", FIRST)
+        archive.writestr("notes.txt", b"not a message")
+        archive.writestr("second.EML", SECOND)
+    before = listing(tmp_path)
+    sources = list(iter_sources([zip_path]))
+    assert read(sources) == [("first", FIRST), ("second", SECOND)]
+    assert [source.location for source in sources] == ["a/first.eml", "second.EML"]
+    assert listing(tmp_path) == before
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:bz2", "w:xz"])
+def test_tar_members_are_read_without_extracting(tmp_path, mode):
+    tar_path = tmp_path / "messages.tar"
+    with tarfile.open(tar_path, mode) as archive:
+        for name, data in (("first.eml", FIRST), ("notes.txt", b"not a message"), ("second.eml", SECOND)):
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+    before = listing(tmp_path)
+    assert read(iter_sources([tar_path])) == [("first", FIRST), ("second", SECOND)]
+    assert listing(tmp_path) == before
+
+def test_eml_files_stay_paths(tmp_path):
+    (tmp_path / "b.eml").write_bytes(SECOND)
+    (tmp_path / "a.eml").write_bytes(FIRST)
+    (tmp_path / "notes.txt").write_bytes(b"not a message")
+    assert list(iter_sources([tmp_path])) == [tmp_path / "a.eml", tmp_path / "b.eml"]
@@ -0,0 +1,33 @@
+import os
+import pytest
+import main
+from geolocation_stub import start_stub_server
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+
+@pytest.fixture
+def stub():
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+
+def scan(folder, stub, *options):
+    # Returns the JSONL results and the text reports of a scan run in folder
+    os.makedirs(folder)
+    os.chdir(folder)
+    main.main(["scan-dir", EMAILS, "--format", "both", "--jsonl", "results.jsonl",
+               "--geo-url", stub.base_url, "--no-geo-cache", *options])
+    with open("results.jsonl", encoding="utf-8") as results_file:
+        results = results_file.read()
+    reports = {}
+    for name in sorted(os.listdir("reports")):
+        with open(os.path.join("reports", name), encoding="utf-8") as report_file:
+            reports[name] = report_file.read()
+    return results, reports
+
+def test_parallel_scan_matches_serial_scan(tmp_path, monkeypatch, stub):
+    monkeypatch.chdir(tmp_path)
+    serial = scan(tmp_path / "serial", stub)
+    parallel = scan(tmp_path / "parallel", stub, "--workers", "3")
+    assert serial[0].count("\n") == len(os.listdir(EMAILS))
+    assert parallel == serial
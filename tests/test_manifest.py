@@ -0,0 +1,59 @@
+from manifest import Manifest
+from mail_sources import ContainedMessage
+
+RESULT = (3, "LOW RISK")
+
+def saved_manifest(tmp_path, eml_paths, version="v1"):
+    manifest = Manifest(str(tmp_path / "manifest.json"), version)
+    for eml_path in eml_paths:
+        manifest.record(eml_path, RESULT)
+    manifest.save()
+    return Manifest(str(tmp_path / "manifest.json"), version)
+
+def test_unchanged_file_is_skipped(tmp_path):
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(b"Subject: hi\r\n\r\nbody\r\n")
+    manifest = saved_manifest(tmp_path, [eml_path])
+    assert not manifest.needs_update(eml_path)
+    assert manifest.result(eml_path) == RESULT
+
+def test_changed_file_is_analyzed_again(tmp_path):
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(b"Subject: hi\r\n\r\nbody\r\n")
+    manifest = saved_manifest(tmp_path, [eml_path])
+    # Same size, so only the content hash can tell
+    eml_path.write_bytes(b"Subject: ho\r\n\r\nbody\r\n")
+    assert manifest.needs_update(eml_path)
+
+def test_new_rules_analyze_everything_again(tmp_path):
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(b"Subject: hi\r\n\r\nbody\r\n")
+    saved_manifest(tmp_path, [eml_path], version="v1")
+    assert Manifest(str(tmp_path / "manifest.json"), "v2").needs_update(eml_path)
+
+def test_missing_report_is_analyzed_again(tmp_path):
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(b"Subject: hi\r\n\r\nbody\r\n")
+    manifest = saved_manifest(tmp_path, [eml_path])
+    assert manifest.needs_update(eml_path, tmp_path / "a_report.txt")
+
+def test_equally_named_containers_are_kept_apart(tmp_path):
+    first = ContainedMessage(tmp_path / "a" / "inbox.mbox", "message 1", b"Subject: one\r\n\r\n")
+    second = ContainedMessage(tmp_path / "b" / "inbox.mbox", "message 1", b"Subject: two\r\n\r\n")
+    manifest = saved_manifest(tmp_path, [first, second])
+    assert not manifest.needs_update(first)
+    assert not manifest.needs_update(second)
+
+def test_changed_container_message_is_analyzed_again(tmp_path):
+    message = ContainedMessage(tmp_path / "inbox.mbox", "message 1", b"Subject: one\r\n\r\n")
+    manifest = saved_manifest(tmp_path, [message])
+    changed = ContainedMessage(tmp_path / "inbox.mbox", "message 1", b"Subject: two\r\n\r\n")
+    assert manifest.needs_update(changed)
+
+def test_prune_forgets_missing_files(tmp_path):
+    kept = ContainedMessage(tmp_path / "inbox.mbox", "message 1", b"Subject: one\r\n\r\n")
+    gone = ContainedMessage(tmp_path / "inbox.mbox", "message 2", b"Subject: two\r\n\r\n")
+    manifest = saved_manifest(tmp_path, [kept, gone])
+    manifest.prune({manifest.key(kept)})
+    assert not manifest.needs_update(kept)
+    assert manifest.needs_update(gone)
@@ -0,0 +1,68 @@
+import pytest
+from geolocator import placeholder_location
+from offline_geolocator import OfflineGeolocator, build_index
+
+RANGES = """network,city,region,country
+0.0.0.0/8,Zero,Nowhere,Reserved
+10.0.0.0/24,Lab,Intranet,Private
+10.0.1.0/24,Office,Intranet,Private
+8.8.8.0/24,Mountain View,California,United States
+255.255.255.0/24,Top,Nowhere,Broadcast
+::/16,Low,Nowhere,Reserved
+2001:db8::/32,Docs,Nowhere,Example
+2001:db9::/48,Docs,Nowhere,Example
+ffff::/16,High,Nowhere,Reserved
+"""
+
+@pytest.fixture
+def geolocator(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    csv_path.write_text(RANGES, encoding="utf-8")
+    index_path = tmp_path / "ranges.idx"
+    assert build_index(csv_path, index_path) == (5, 4)
+    geolocator = OfflineGeolocator(index_path)
+    yield geolocator
+    geolocator.close()
+
+def city(geolocator, ip):
+    return geolocator.lookup(ip)["city"]
+
+@pytest.mark.parametrize("ip, expected", [
+    ("0.0.0.0", "Zero"),
+    ("0.255.255.255", "Zero"),
+    ("1.0.0.0", None),
+    ("9.255.255.255", None),
+    ("10.0.0.0", "Lab"),
+    ("10.0.0.255", "Lab"),
+    ("10.0.1.0", "Office"),
+    ("10.0.1.255", "Office"),
+    ("10.0.2.0", None),
+    ("8.8.7.255", None),
+    ("8.8.8.8", "Mountain View"),
+    ("255.255.254.255", None),
+    ("255.255.255.255", "Top")
+])
+def test_ipv4_range_boundaries(geolocator, ip, expected):
+    assert city(geolocator, ip) == (expected or placeholder_location(ip)["city"])
+
+@pytest.mark.parametrize("ip, expected", [
+    ("::", "Low"),
+    ("0:ffff:ffff:ffff:ffff:ffff:ffff:ffff", "Low"),
+    ("1::", None),
+    ("2001:db7:ffff:ffff:ffff:ffff:ffff:ffff", None),
+    ("2001:db8::", "Docs"),
+    ("2001:db8:ffff:ffff:ffff:ffff:ffff:ffff", "Docs"),
+    ("2001:db9::1", "Docs"),
+    ("2001:db9:0:ffff:ffff:ffff:ffff:ffff", "Docs"),
+    ("2001:db9:1::", None),
+    ("fffe:ffff:ffff:ffff:ffff:ffff:ffff:ffff", None),
+    ("ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff", "High")
+])
+def test_ipv6_range_boundaries(geolocator, ip, expected):
+    assert city(geolocator, ip) == (expected or placeholder_location(ip)["city"])
+
+def test_lookup_returns_the_whole_location(geolocator):
+    assert geolocator.lookup("not an ip") == placeholder_location("not an ip")
+    assert geolocator.lookup("2001:db9::1") == {"ip": "2001:db9::1", "city": "Docs", "region": "Nowhere",
+                                                 "country": "Example"}
+    assert geolocator.stats()["offline_lookups"] == 2
@@ -0,0 +1,55 @@
+from received_parser import parse_received, parse_received_chain, received_time, relay_timing_issues
+from eml_ingest import parse_eml_bytes
+from report_generator import analyze_email
+
+def test_ipv4_literal_and_hosts():
+    hop = parse_received("from mx1.example.ru (mx1.example.ru [91.123.45.67])\r\n"
+                         "\tby mail.example.com with ESMTP id abc123; Mon, 1 Dec 2025 15:25:00 +0000")
+    assert hop == {"from_host": "mx1.example.ru", "by_host": "mail.example.com",
+                   "ips": ["91.123.45.67"], "timestamp": 1764602700.0}
+
+def test_ipv6_literals():
+    hop = parse_received("from relay.example.net (relay.example.net [IPv6:2001:DB8::1]) by mx.example.com "
+                         "(Postfix) with ESMTPS; Tue, 2 Dec 2025 08:00:00 -0500")
+    assert hop["ips"] == ["2001:db8::1"]
+    assert hop["by_host"] == "mx.example.com"
+    assert parse_received("from a.example ([2001:db8:0:1::25]) by b.example; "
+                          "Tue, 2 Dec 2025 08:00:00 +0000")["ips"] == ["2001:db8:0:1::25"]
+
+def test_bare_ip_in_from_comment():
+    hop = parse_received("from unknown (HELO mail.example.com) (203.0.113.5) by mx.example.com; "
+                         "Tue, 2 Dec 2025 08:00:00 +0000")
+    assert hop["from_host"] == "unknown"
+    assert hop["ips"] == ["203.0.113.5"]
+
+def test_hostname_only_hop_is_kept():
+    hop = parse_received("by internal.example.com (Postfix, from userid 1000) id 4B2C; "
+                         "Tue, 2 Dec 2025 08:00:00 +0000")
+    assert hop["from_host"] is None
+    assert hop["by_host"] == "internal.example.com"
+    assert hop["ips"] == []
+    assert hop["timestamp"] is not None
+
+def test_bad_and_missing_dates():
+    assert parse_received("from a.example by b.example; Mon, 31 Feb 2025 10:00:00 +0000")["timestamp"] is None
+    assert parse_received("from a.example by b.example; yesterday")["timestamp"] is None
+    assert parse_received("from a.example by b.example")["timestamp"] is None
+    assert received_time("2 Dec 2025 08:00:00 GMT") == received_time("Tue, 2 Dec 2025 08:00:00 +0000")
+
+def test_one_bad_timestamp_counts_once():
+    received = [
+        "from b.example ([198.51.100.3]) by c.example; Tue, 2 Dec 2025 08:02:00 +0000",
+        # This relay's clock is five days ahead
+        "from a.example ([198.51.100.2]) by b.example; Sun, 7 Dec 2025 08:01:00 +0000",
+        "from client ([198.51.100.1]) by a.example; Tue, 2 Dec 2025 08:00:00 +0000",
+    ]
+    chain = parse_received_chain(received)
+    assert [hop["delay"] for hop in chain] == [-431940.0, 432060.0, None]
+    assert [issue["hop"] for issue in relay_timing_issues(chain)] == [2, 3]
+
+    data = ("".join(f"Received: {value}\r\n" for value in received) +
+            "From: a@example.com\r\nTo: b@example.com\r\nSubject: hi\r\n\r\nHello\r\n").encode()
+    result = analyze_email(parse_eml_bytes(data), [], "test.eml")
+    assert len(result["relay_timing"]) == 2
+    assert result["indicators"]["relay_timing"] == 1
+    assert result["risk_rating"] == 0
@@ -0,0 +1,43 @@
+import os
+import random
+import pytest
+from eml_ingest import parse_eml_bytes, parse_eml_headers
+from geolocation_stub import stub_location
+from geolocator import location_from_response
+from report_generator import analyze_email
+from synthetic_corpus import generate_message
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+
+def messages():
+    for name in sorted(os.listdir(EMAILS)):
+        with open(os.path.join(EMAILS, name), "rb") as eml_file:
+            yield name, eml_file.read()
+    rng = random.Random(7)
+    for number in range(60):
+        yield f"synthetic_{number}.eml", generate_message(rng)
+
+def analyzed(data, name, triage):
+    # Triage parses the header alone and the body only when it is needed, as start_email does
+    email_data = dict(parse_eml_headers(data), raw=data) if triage else parse_eml_bytes(data)
+    locations = [location_from_response(ip, stub_location(ip)) for ip in email_data["hop_ips"]]
+    return analyze_email(email_data, locations, name, triage=triage)
+
+@pytest.mark.parametrize("name, data", list(messages()), ids=lambda value: value if isinstance(value, str) else "")
+def test_triage_grades_like_a_full_scan(name, data):
+    full = analyzed(data, name, triage=False)
+    triaged = analyzed(data, name, triage=True)
+    assert triaged["risk_grade"] == full["risk_grade"]
+    if triaged["skipped_stages"]:
+        # Stopped at HIGH RISK, the rating is a lower bound
+        assert triaged["risk_grade"] == "HIGH RISK"
+        assert triaged["risk_rating"] <= full["risk_rating"]
+    else:
+        assert triaged["indicators"] == full["indicators"]
+        assert triaged["risk_rating"] == full["risk_rating"]
+        assert triaged["urls"] == full["urls"]
+        assert triaged["attachments"] == full["attachments"]
+
+def test_triage_skips_stages_of_some_messages():
+    skipped = [analyzed(data, name, triage=True)["skipped_stages"] for name, data in messages()]
+    assert any(skipped)
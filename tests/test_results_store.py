@@ -0,0 +1,88 @@
+import os
+import sqlite3
+from collections import Counter
+import pytest
+from eml_ingest import parse_eml_bytes
+from geolocation_stub import stub_location
+from geolocator import location_from_response
+from report_generator import analyze_email
+from results_store import (ResultsStore, build_filter, parse_query_args, query_counts, query_messages, run_query,
+                           sender_domain)
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+
+def analyze_samples():
+    results = []
+    for name in sorted(os.listdir(EMAILS)):
+        path = os.path.join(EMAILS, name)
+        with open(path, "rb") as eml_file:
+            email_data = parse_eml_bytes(eml_file.read())
+        locations = [location_from_response(ip, stub_location(ip)) for ip in email_data["hop_ips"]]
+        results.append(analyze_email(email_data, locations, path))
+    return results
+
+@pytest.fixture
+def stored(tmp_path):
+    results = analyze_samples()
+    store_path = str(tmp_path / "results.sqlite3")
+    # Small batches, so the results span several transactions
+    with ResultsStore(store_path, batch_messages=3) as store:
+        for result in results:
+            store.add(result)
+        store.add({"source": {"name": "broken.eml", "path": "broken.eml"}, "error": "could not parse"})
+    assert store.written == len(results) + 1
+    connection = sqlite3.connect(store_path)
+    yield store_path, connection, results
+    connection.close()
+
+def query(connection, *argv):
+    args = parse_query_args(list(argv))
+    where, parameters = build_filter(args)
+    if args.list:
+        return query_messages(connection, where, parameters, args.limit)
+    return dict(query_counts(connection, args.group_by, where, parameters, args.limit))
+
+def test_counts_by_grade_match_the_results(stored):
+    _, connection, results = stored
+    assert query(connection) == Counter(result["risk_grade"] for result in results)
+
+def test_indicator_filters_match_the_results(stored):
+    _, connection, results = stored
+    for indicator in ("from_reply_mismatch", "foreign_hop", "language_urgent"):
+        expected = Counter(result["risk_grade"] for result in results if result["indicators"][indicator])
+        assert query(connection, "--indicator", indicator) == expected
+    both = [result for result in results
+            if result["indicators"]["foreign_hop"] and result["indicators"]["language_urgent"]]
+    assert sum(query(connection, "--indicator", "foreign_hop", "--indicator", "language_urgent").values()) \
+        == len(both)
+
+def test_group_by_joined_tables(stored):
+    _, connection, results = stored
+    domains = Counter(sender_domain(result["header"]["From"]) for result in results)
+    assert query(connection, "--group-by", "sender_domain") == domains
+    countries = Counter(country for result in results
+                        for country in {hop["country"] for hop in result["hops"]})
+    assert query(connection, "--group-by", "hop_country") == countries
+    domain, count = domains.most_common(1)[0]
+    assert sum(query(connection, "--sender-domain", domain.upper()).values()) == count
+
+def test_list_is_highest_rating_first(stored):
+    _, connection, results = stored
+    rows = query(connection, "--list", "--limit", "100")
+    assert [row[5] for row in rows] == sorted((result["risk_rating"] for result in results), reverse=True)
+    assert {row[0] for row in rows} == {result["source"]["path"] for result in results}
+
+def test_failed_messages_are_stored_but_never_match(stored):
+    _, connection, results = stored
+    assert connection.execute("SELECT name, error FROM messages WHERE error IS NOT NULL").fetchall() == \
+        [("broken.eml", "could not parse")]
+    assert sum(query(connection).values()) == len(results)
+
+def test_run_query_prints_the_counts(stored, capsys):
+    store_path, _, results = stored
+    run_query(parse_query_args(["--store", store_path, "--grade", "HIGH RISK"]))
+    output = capsys.readouterr().out
+    high = sum(result["risk_grade"] == "HIGH RISK" for result in results)
+    assert output.startswith(f"{high} matching messages")
+    run_query(parse_query_args(["--store", store_path, "--sql", "SELECT COUNT(*) AS stored FROM messages"]))
+    assert capsys.readouterr().out == f"stored\n{len(results) + 1}\n"
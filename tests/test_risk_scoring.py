@@ -0,0 +1,69 @@
+import json
+import os
+import pytest
+from analyzer import EmailAnalyzer
+from report_generator import configure_scoring, get_scoring, load_scoring
+from risk_scoring import FeatureMatrix, build_features, default_scoring, load_features, rescore
+
+EMAILS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "emails")
+SCORING = {"weights": {"language_urgent": 4, "from_reply_mismatch": 9, "suspicious_tld": 0},
+           "thresholds": {"HIGH RISK": 25, "MODERATE RISK": 5}}
+
+@pytest.fixture
+def scoring(tmp_path):
+    scoring_path = tmp_path / "scoring.json"
+    scoring_path.write_text(json.dumps(SCORING), encoding="utf-8")
+    scoring = load_scoring(scoring_path)
+    configure_scoring(scoring)
+    yield scoring
+    configure_scoring(None)
+
+def analyze_samples():
+    results = []
+    with EmailAnalyzer(geolocate=False) as analyzer:
+        for name in sorted(os.listdir(EMAILS)):
+            with open(os.path.join(EMAILS, name), "rb") as eml_file:
+                results.append(analyzer.analyze_bytes(eml_file.read(), name=name))
+    return results
+
+def saved_matrix(tmp_path, results, scoring=None):
+    matrix = FeatureMatrix(scoring)
+    for result in results:
+        matrix.add(result["source"]["name"], result["indicators"])
+    matrix.save(str(tmp_path / "features.npz"))
+    return load_features(str(tmp_path / "features.npz"))
+
+def test_rescore_matches_analysis_with_the_same_scoring(tmp_path, scoring):
+    results = analyze_samples()
+    features, names, graded_with = saved_matrix(tmp_path, results, get_scoring())
+    assert names == [result["source"]["name"] for result in results]
+    assert graded_with == scoring
+    rescored = rescore(features, scoring, graded_with)
+    assert list(rescored["ratings_after"]) == [result["risk_rating"] for result in results]
+    assert list(rescored["grades_after"]) == [result["risk_grade"] for result in results]
+    assert list(rescored["ratings_before"]) == list(rescored["ratings_after"])
+    assert rescored["changed"] == 0
+
+def test_rescore_compares_against_the_scoring_the_matrix_was_graded_with(tmp_path, scoring):
+    results = analyze_samples()
+    features, _, graded_with = saved_matrix(tmp_path, results, get_scoring())
+    rescored = rescore(features, default_scoring(), graded_with)
+    assert list(rescored["grades_before"]) == [result["risk_grade"] for result in results]
+    configure_scoring(None)
+    defaults = analyze_samples()
+    assert list(rescored["grades_after"]) == [result["risk_grade"] for result in defaults]
+    assert rescored["changed"] == sum(a["risk_grade"] != b["risk_grade"] for a, b in zip(results, defaults))
+    assert rescored["changed"] > 0
+
+def test_matrix_built_from_results_keeps_the_given_scoring(tmp_path, scoring):
+    results = analyze_samples()
+    jsonl_path = tmp_path / "results.jsonl"
+    jsonl_path.write_text("".join(json.dumps(result, separators=(",", ":")) + "\n" for result in results)
+                          + json.dumps({"source": {"name": "broken.eml"}, "error": "failed"}) + "\n",
+                          encoding="utf-8")
+    build_features(str(jsonl_path), scoring).save(str(tmp_path / "features.npz"))
+    features, names, graded_with = load_features(str(tmp_path / "features.npz"))
+    assert graded_with == scoring
+    assert names == [result["source"]["name"] for result in results]
+    assert list(rescore(features, scoring, graded_with)["ratings_after"]) == [result["risk_rating"]
+                                                                             for result in results]
@@ -0,0 +1,101 @@
+import asyncio
+import smtplib
+import socket
+import threading
+import time
+import pytest
+import smtp_service
+from geolocation_stub import start_stub_server
+from geolocator import GeolocationClient
+from smtp_service import ScanService
+
+MESSAGE = (b"From: alice@example.com\r\n"
+           b"To: bob@example.com\r\n"
+           b"Subject: Lunch\r\n"
+           b"Received: from mail.example.com ([8.8.8.8]) by mx.example.com; Mon, 1 Jan 2024 10:00:00 +0000\r\n"
+           b"\r\n"
+           b"See you at noon.\r\n")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+async def start(service, port):
+    return asyncio.create_task(service.serve("127.0.0.1", port))
+
+async def stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+@pytest.fixture(params=[False, True], ids=["smtp", "lmtp"])
+def service(request):
+    lmtp = request.param
+    stub = start_stub_server()
+    client = GeolocationClient(base_url=stub.base_url)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    port = free_port()
+    serving = asyncio.run_coroutine_threadsafe(start(ScanService(client, budget=5, lmtp=lmtp), port), loop).result()
+    wait_for_port(port)
+    try:
+        yield lmtp, port
+    finally:
+        asyncio.run_coroutine_threadsafe(stop(serving), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        client.close()
+        stub.shutdown()
+
+def send(service, message, recipients=("bob@example.com",)):
+    # Returns the reply to DATA for every recipient
+    lmtp, port = service
+    connection = smtplib.LMTP("127.0.0.1", port) if lmtp else smtplib.SMTP("127.0.0.1", port)
+    with connection:
+        connection.ehlo_or_helo_if_needed()
+        assert connection.mail("alice@example.com")[0] == 250
+        for recipient in recipients:
+            assert connection.rcpt(recipient)[0] == 250
+        replies = [connection.data(message)]
+        if lmtp:
+            replies += [connection.getreply() for _ in recipients[1:]]
+    return [(code, text.decode()) for code, text in replies]
+
+def test_message_is_scored(service):
+    lmtp, _ = service
+    recipients = ("bob@example.com", "carol@example.com")
+    replies = send(service, MESSAGE, recipients)
+    assert len(replies) == (len(recipients) if lmtp else 1)
+    for code, text in replies:
+        assert code == 250
+        assert text.startswith("2.0.0 Ok: ") and "partial" not in text
+
+def test_long_line_is_read_in_pieces(service):
+    line = b"x" * (3 * smtp_service.MAX_LINE_LENGTH + 5)
+    (code, text), = send(service, MESSAGE + line + b"\r\n.dotted\r\n")
+    assert code == 250
+    assert text.startswith("2.0.0 Ok: ")
+
+def test_too_big_message_is_refused(service, monkeypatch):
+    monkeypatch.setattr(smtp_service, "MAX_MESSAGE_SIZE", 1024)
+    (code, text), = send(service, MESSAGE + b"x" * 4096 + b"\r\n")
+    assert code == 552
+
+def test_failed_analysis_is_accepted_not_analyzed(service, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("cannot parse")
+    monkeypatch.setattr(smtp_service, "analyze_email", broken)
+    replies = send(service, MESSAGE)
+    assert replies == [(250, f"2.0.0 Ok: {smtp_service.NOT_ANALYZED}")]
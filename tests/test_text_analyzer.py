@@ -0,0 +1,43 @@
+import pytest
+from text_analyzer import has_mismatched_mime
+
+OCTET_STREAM = "application/octet-stream"
+
+# Extensions this repo has no expected type for, carrying their usual content
+@pytest.mark.parametrize("extension, sniffed_mime", [
+    ("ppsx", "application/zip"),
+    ("dotx", "application/zip"),
+    ("epub", "application/zip"),
+    ("apk", "application/zip"),
+    ("msg", "application/x-ole-storage"),
+    ("pps", "application/x-ole-storage"),
+    ("jfif", "image/jpeg"),
+    ("bin", "application/x-msdownload"),
+    ("", "application/pdf"),
+])
+def test_unknown_extension_is_not_a_mismatch(extension, sniffed_mime):
+    assert not has_mismatched_mime(extension, OCTET_STREAM, sniffed_mime)
+
+@pytest.mark.parametrize("extension, mime, sniffed_mime", [
+    ("pdf", "application/pdf", "application/pdf"),
+    (".docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/zip"),
+    ("doc", "application/msword", "application/rtf"),
+    ("jpg", "image/jpeg", "image/jpeg"),
+    ("txt", "text/plain", None),
+])
+def test_matching_content_is_not_a_mismatch(extension, mime, sniffed_mime):
+    assert not has_mismatched_mime(extension, mime, sniffed_mime)
+
+@pytest.mark.parametrize("extension, mime, sniffed_mime", [
+    ("pdf", "application/pdf", "application/x-msdownload"),
+    ("jpg", "image/jpeg", "application/zip"),
+    ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/x-msdownload"),
+    # Known extensions whose type has no magic of its own
+    ("txt", "text/plain", "application/x-msdownload"),
+    ("html", "text/html", "application/x-executable"),
+])
+def test_known_extension_with_conflicting_content_is_a_mismatch(extension, mime, sniffed_mime):
+    assert has_mismatched_mime(extension, mime, sniffed_mime)
+
+def test_declared_mime_still_checked():
+    assert has_mismatched_mime("pdf", "application/x-msdownload")
@@ -0,0 +1,56 @@
+from watcher import FolderWatcher, move_processed
+
+MESSAGE = b"From: a@example.com\r\nSubject: hi\r\n\r\nHello\r\n"
+
+def test_file_is_ready_once_it_stops_changing(tmp_path):
+    watcher = FolderWatcher(tmp_path)
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(MESSAGE[:10])
+    (tmp_path / "notes.txt").write_bytes(b"not a message")
+    assert watcher.poll() == []
+    # Still being written
+    eml_path.write_bytes(MESSAGE)
+    assert watcher.poll() == []
+    assert watcher.poll() == [eml_path]
+    # Queued files are not queued again
+    assert watcher.poll() == []
+
+def test_file_can_return_once_it_has_left_the_folder(tmp_path):
+    watcher = FolderWatcher(tmp_path)
+    eml_path = tmp_path / "a.eml"
+    eml_path.write_bytes(MESSAGE)
+    watcher.poll()
+    assert watcher.poll() == [eml_path]
+    # Not moved, stays ignored
+    watcher.done(eml_path)
+    watcher.poll()
+    assert watcher.poll() == []
+
+    move_processed(eml_path, tmp_path / "processed")
+    watcher.done(eml_path)
+    eml_path.write_bytes(MESSAGE)
+    watcher.poll()
+    assert watcher.poll() == [eml_path]
+
+def test_poller_queues_new_files(tmp_path):
+    watcher = FolderWatcher(tmp_path, poll_interval=0.01)
+    watcher.start()
+    try:
+        assert watcher.get(timeout=0.05) is None
+        (tmp_path / "a.eml").write_bytes(MESSAGE)
+        (tmp_path / "b.eml").write_bytes(MESSAGE)
+        assert [watcher.get(timeout=5), watcher.get(timeout=5)] == [tmp_path / "a.eml", tmp_path / "b.eml"]
+        assert watcher.idle()
+    finally:
+        watcher.stop()
+        watcher.poller.join(timeout=5)
+    assert not watcher.poller.is_alive()
+
+def test_move_processed_keeps_existing_files(tmp_path):
+    processed = tmp_path / "processed"
+    for expected in ("a.eml", "a-1.eml", "a-2.eml"):
+        (tmp_path / "a.eml").write_bytes(MESSAGE)
+        assert move_processed(tmp_path / "a.eml", processed) == processed / expected
+    (tmp_path / "b.eml").write_bytes(MESSAGE)
+    assert move_processed(tmp_path / "b.eml") == tmp_path / "b.eml.done"
+    assert sorted(path.name for path in processed.iterdir()) == ["a-1.eml", "a-2.eml", "a.eml"]
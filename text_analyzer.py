@@ -4,6 +4,8 @@ text_analyzer.py
 This analyzes text (email body)
 """
 
+from keyword_matcher import KeywordMatcher
+
 # Phrases that relate to urgency
 URGENT_LANGUAGE = {
     "immediately",
@@ -80,6 +82,13 @@ FINANCIAL_LANGUAGE = {
     "rent"
 }
 
+# Phrase lists scanned for in the body, by category
+LANGUAGE_CATEGORIES = {
+    "urgent": URGENT_LANGUAGE,
+    "credential": CREDENTIAL_LANGUAGE,
+    "financial": FINANCIAL_LANGUAGE
+}
+
 # Extensions considered to be risky
 DANGEROUS_EXTENSIONS = {
     ".html",
@@ -185,17 +194,93 @@ EXPECTED_MIME_MAP = {
     "ics":  "text/calendar"
 }
 
+"""
+build_keyword_matcher
+
+Returns a matcher for LANGUAGE_CATEGORIES plus any extra phrases
+(a dict of category -> phrases, new categories are allowed). By default
+phrases match anywhere in the text, like the substring checks this
+replaced; with whole_words only complete words match
+"""
+def build_keyword_matcher(extra_phrases=None, whole_words=False):
+    phrases_by_category = {category: set(phrases) for category, phrases in LANGUAGE_CATEGORIES.items()}
+    for category, phrases in (extra_phrases or {}).items():
+        phrases_by_category.setdefault(category, set()).update(phrases)
+    return KeywordMatcher(phrases_by_category, whole_words=whole_words)
+
+# Built once, shared by every message. See configure_whole_words
+KEYWORD_MATCHER = build_keyword_matcher()
+_whole_words = False
+
+"""
+configure_whole_words
+
+Turns whole-word keyword matching on or off for this process
+"""
+def configure_whole_words(enabled):
+    global KEYWORD_MATCHER, _whole_words
+    if enabled != _whole_words:
+        KEYWORD_MATCHER = build_keyword_matcher(whole_words=enabled)
+        _whole_words = enabled
+
+"""
+get_whole_words
+
+Returns True if keywords only match complete words in this process
+"""
+def get_whole_words():
+    return _whole_words
+
+"""
+scan_language
+
+returns a dict of category -> matched phrases, found in a single pass
+"""
+def scan_language(text, matcher=None):
+    return (matcher or KEYWORD_MATCHER).match_categories(text)
+
+# Extensions that fit each file type sniffed from attachment content
+# (see attachment_inspector.py). Types not listed are not checked, and
+# neither are extensions with no known type (see has_mismatched_mime)
+SNIFFED_MIME_EXTENSIONS = {
+    "application/pdf":              {"pdf"},
+    "application/zip":              {"zip", "docx", "docm", "xlsx", "xlsm", "xlsb", "pptx", "pptm",
+                                     "odt", "ods", "odp", "jar"},
+    "application/x-ole-storage":    {"doc", "dot", "xls", "xlt", "ppt", "msi"},
+    "application/x-msdownload":     {"exe", "dll", "scr"},
+    "application/x-executable":     set(),
+    "application/x-rar-compressed": {"rar"},
+    "application/x-7z-compressed":  {"7z"},
+    "application/gzip":             {"gz", "tgz"},
+    "application/x-bzip2":          {"bz2"},
+    "application/x-tar":            {"tar"},
+    "application/rtf":              {"rtf", "doc"},
+    "image/png":                    {"png"},
+    "image/jpeg":                   {"jpg", "jpeg"},
+    "image/gif":                    {"gif"},
+    "image/bmp":                    {"bmp"},
+    "image/tiff":                   {"tif", "tiff"},
+    "image/webp":                   {"webp"},
+    "audio/wav":                    {"wav"},
+    "audio/flac":                   {"flac"},
+    "audio/ogg":                    {"ogg"},
+    "video/x-msvideo":              {"avi"},
+    "video/x-matroska":             {"mkv", "webm"}
+}
+
+# Extension -> the sniffed types its content may have
+SNIFFED_TYPES_BY_EXTENSION = {
+    extension: {sniffed for sniffed, fitting in SNIFFED_MIME_EXTENSIONS.items() if extension in fitting}
+    for extensions in SNIFFED_MIME_EXTENSIONS.values() for extension in extensions
+}
+
 """
 get_urgent_language
 
 returns matches from the URGENT_LANGUAGE list
 """
 def get_urgent_language(text):
-    matches = []
-    for term in URGENT_LANGUAGE:
-        if term in text.lower():
-            matches.append(term)
-    return matches
+    return scan_language(text)["urgent"]
 
 """
 get_credential_language
@@ -203,11 +288,7 @@ get_credential_language
 returns matches from the CREDENTIAL_LANGUAGE list
 """
 def get_credential_language(text):
-    matches = []
-    for term in CREDENTIAL_LANGUAGE:
-        if term in text.lower():
-            matches.append(term)
-    return matches
+    return scan_language(text)["credential"]
 
 """
 get_financial_language
@@ -215,11 +296,7 @@ get_financial_language
 returns matches from the FINANCIAL_LANGUAGE list
 """
 def get_financial_language(text):
-    matches = []
-    for term in FINANCIAL_LANGUAGE:
-        if term in text.lower():
-            matches.append(term)
-    return matches
+    return scan_language(text)["financial"]
 
 """
 has_dangerous_extension
@@ -235,9 +312,21 @@ def has_dangerous_extension(extension):
 has_mismatched_mime
 
 returns true if mime doesn't match the one we expect
-for the extension.
+for the extension, or if the file type sniffed from the
+content conflicts with the type the extension is known to have.
 """
-def has_mismatched_mime(extension, mime):
+def has_mismatched_mime(extension, mime, sniffed_mime=None):
+    # Extensions may be given with or without the leading dot
+    extension = extension.lstrip(".").lower()
+    if sniffed_mime in SNIFFED_MIME_EXTENSIONS:
+        # Only an extension with a known type can conflict with the content,
+        # one this table does not know (.ppsx, .msg, none) is not a mismatch
+        expected = SNIFFED_TYPES_BY_EXTENSION.get(extension)
+        if expected is None and extension in EXPECTED_MIME_MAP:
+            expected = {EXPECTED_MIME_MAP[extension]}
+        if expected is not None and sniffed_mime not in expected:
+            return True
+    # Mime types are case-insensitive
     if extension in EXPECTED_MIME_MAP:
-        return EXPECTED_MIME_MAP[extension] != mime
+        return EXPECTED_MIME_MAP[extension].lower() != mime.lower()
     return False
\ No newline at end of file
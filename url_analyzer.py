@@ -2,9 +2,14 @@
 url_analyzer.py
 
 This analyzes URLs for anything out of the ordinary
+
+analyze_urls parses each URL once and looks up the verdicts for its hostname
+in a cache shared across messages, since campaigns repeat the same links
 """
 
 import ipaddress
+import threading
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 # Some TLDs considered to be suspicious. This could be tailored to liking.
@@ -13,6 +18,9 @@ SUSPICIOUS_TLDS = {
     "icu", "cyou", "monster", "live", "shop", "work"
 }
 
+# Most hostnames whose verdicts are kept between messages
+DEFAULT_HOSTNAME_CACHE_SIZE = 10000
+
 """
 normalize_url
 
@@ -24,31 +32,53 @@ def normalize_url(url):
     return url
 
 """
-is_raw_ip
+url_hostname
 
-Returns true if the host is a raw IP address
+Returns the lowercased hostname of a URL, or None if it has none or cannot be parsed
 """
-def is_raw_ip(url):
-    url = normalize_url(url)
+def url_hostname(url):
     try:
-        parsed_url = urlparse(url)
-        hostname = parsed_url.hostname
+        return urlparse(normalize_url(url)).hostname
+    # Parsing failed
+    except Exception:
+        return None
 
-        # No hostname found
-        if not hostname:
-            return False
+"""
+hostname_is_ip
 
-        # If this try succeeds, hostname is raw IP
-        try:
-            ip_obj = ipaddress.ip_address(hostname)
-            return True
-        except ValueError:
-            # Not a raw IP
-            return False
+Returns true if a hostname is a raw IP address
+"""
+def hostname_is_ip(hostname):
+    # If this try succeeds, hostname is raw IP
+    try:
+        ipaddress.ip_address(hostname)
+        return True
+    except ValueError:
+        # Not a raw IP
+        return False
 
-    # Parsing failed
-    except Exception:
+"""
+hostname_has_suspicious_tld
+
+Returns true if the TLD of a hostname is in the suspicious list
+"""
+def hostname_has_suspicious_tld(hostname):
+    # Check for . before splitting on it
+    if "." not in hostname:
+        return False
+    return hostname.split(".")[-1].lower() in SUSPICIOUS_TLDS
+
+"""
+is_raw_ip
+
+Returns true if the host is a raw IP address
+"""
+def is_raw_ip(url):
+    hostname = url_hostname(url)
+    # No hostname found
+    if not hostname:
         return False
+    return hostname_is_ip(hostname)
 
 """
 has_suspicious_tld
@@ -56,26 +86,11 @@ has_suspicious_tld
 Returns true if the TLD is in the suspicious list
 """
 def has_suspicious_tld(url):
-    url = normalize_url(url)
-    try:
-        parsed_url = urlparse(url)
-        hostname = parsed_url.hostname
-
-        # No hostname found
-        if not hostname:
-            return False
-
-        # Check for . before splitting on it
-        if "." not in hostname:
-            return False
-        
-        # Check TLD against suspicious list
-        tld = hostname.split(".")[-1].lower()
-        return tld in SUSPICIOUS_TLDS
-
-    # Parsing failed
-    except Exception:
+    hostname = url_hostname(url)
+    # No hostname found
+    if not hostname:
         return False
+    return hostname_has_suspicious_tld(hostname)
     
 """
 is_very_long
@@ -83,4 +98,104 @@ is_very_long
 Returns true if the URL is excessively long (currently defined as 150+ characters)
 """
 def is_very_long(url, limit=150):
-    return len(url) > limit
\ No newline at end of file
+    return len(url) > limit
+
+"""
+HostnameVerdicts
+
+Bounded LRU cache of (raw ip, suspicious tld) per hostname, shared by every
+message. Safe to use from several threads
+"""
+class HostnameVerdicts:
+    def __init__(self, max_entries=DEFAULT_HOSTNAME_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    """
+    verdict
+
+    Returns (raw ip, suspicious tld) for a hostname
+    """
+    def verdict(self, hostname):
+        with self.lock:
+            verdict = self.entries.get(hostname)
+            if verdict is not None:
+                self.entries.move_to_end(hostname)
+                self.hits += 1
+                return verdict
+            self.misses += 1
+
+        verdict = (hostname_is_ip(hostname), hostname_has_suspicious_tld(hostname))
+        with self.lock:
+            self.entries[hostname] = verdict
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return verdict
+
+    """
+    stats
+
+    Returns hits, misses, hit rate and number of cached hostnames
+    """
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries)
+            }
+
+HOSTNAME_VERDICTS = HostnameVerdicts()
+
+"""
+parse_url
+
+Parses a URL once and returns a record of everything the checks need:
+url, hostname, raw_ip, suspicious_tld and very_long
+"""
+def parse_url(url, verdicts=HOSTNAME_VERDICTS):
+    hostname = url_hostname(url)
+    raw_ip, suspicious_tld = verdicts.verdict(hostname) if hostname else (False, False)
+    return {
+        "url": url,
+        "hostname": hostname,
+        "raw_ip": raw_ip,
+        "suspicious_tld": suspicious_tld,
+        "very_long": is_very_long(url)
+    }
+
+"""
+url_detections
+
+Returns the detections of a parsed URL, in report order
+"""
+def url_detections(record):
+    detections = []
+    if record["raw_ip"]:
+        detections.append("ip_as_domain")
+    if record["suspicious_tld"]:
+        detections.append("suspicious_tld")
+    if record["very_long"]:
+        detections.append("long_url")
+    return detections
+
+"""
+analyze_urls
+
+Returns {"url", "detections"} for every URL of a body, in order. A URL
+that appears more than once is only analyzed the first time
+"""
+def analyze_urls(urls, verdicts=HOSTNAME_VERDICTS):
+    detections_by_url = {}
+    analyzed = []
+    for url in urls:
+        detections = detections_by_url.get(url)
+        if detections is None:
+            detections = detections_by_url[url] = url_detections(parse_url(url, verdicts))
+        analyzed.append({"url": url, "detections": list(detections)})
+    return analyzed
@@ -0,0 +1,153 @@
+"""
+watcher.py
+
+This watches a folder for eml files to analyze as they arrive
+
+A poller thread lists the folder every poll interval and queues each new
+.eml file once its size and modification time are the same on two polls in
+a row, so files that are still being written are left alone. The queue is
+bounded: when analysis falls behind, the poller waits for room instead of
+queueing an ever growing backlog. Polling needs nothing platform specific.
+"""
+
+import os
+import queue
+import signal
+import threading
+from pathlib import Path
+from defaults import DEFAULT_POLL_INTERVAL
+
+DEFAULT_QUEUE_SIZE = 100
+
+"""
+FolderWatcher
+
+Queues the .eml files that appear in a folder. Take them with get and call
+done once a file has been moved out of the folder
+"""
+class FolderWatcher:
+    def __init__(self, folder, poll_interval=DEFAULT_POLL_INTERVAL, queue_size=DEFAULT_QUEUE_SIZE):
+        self.folder = Path(folder)
+        self.poll_interval = poll_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        # (size, mtime_ns) of files seen on the last poll that were not ready yet
+        self.pending = {}
+        # Files queued or being analyzed, so they are not queued twice
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.poller = threading.Thread(target=self._poll_loop, daemon=True)
+
+    def start(self):
+        self.poller.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    """
+    get
+
+    Returns the next eml file to analyze, or None if none arrived within timeout
+    """
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    """
+    idle
+
+    Returns True if no eml file is waiting
+    """
+    def idle(self):
+        return self.queue.empty()
+
+    """
+    done
+
+    Lets an eml file be queued again once it has left the folder. A file that
+    could not be moved stays ignored so it is not analyzed over and over
+    """
+    def done(self, path):
+        if not path.exists():
+            with self.lock:
+                self.queued.discard(path)
+
+    """
+    poll
+
+    Returns the eml files that became ready since the last poll, in name order
+    """
+    def poll(self):
+        seen = {}
+        ready = []
+        with self.lock:
+            queued = set(self.queued)
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(".eml") or not entry.is_file():
+                    continue
+                path = Path(entry.path)
+                if path in queued:
+                    continue
+                status = entry.stat()
+                signature = (status.st_size, status.st_mtime_ns)
+                if self.pending.get(path) == signature:
+                    ready.append(path)
+                else:
+                    seen[path] = signature
+        self.pending = seen
+        with self.lock:
+            self.queued.update(ready)
+        return sorted(ready)
+
+    def _poll_loop(self):
+        while not self.stopped.is_set():
+            try:
+                ready = self.poll()
+            except OSError as e:
+                # Folder briefly unavailable (network share, remount), try again next poll
+                print(f"Could not list {self.folder}: {e}")
+                ready = []
+            for path in ready:
+                # Blocks while the queue is full, checking now and then for stop
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put(path, timeout=self.poll_interval)
+                        break
+                    except queue.Full:
+                        pass
+            self.stopped.wait(self.poll_interval)
+
+"""
+move_processed
+
+Moves an analyzed eml file into folder, keeping its name unless a file of
+that name is already there. Without a folder the file is marked instead, by
+renaming it to NAME.eml.suffix. Returns the new path
+"""
+def move_processed(path, folder=None, suffix="done"):
+    if folder is None:
+        target = path.with_name(f"{path.name}.{suffix}")
+    else:
+        os.makedirs(folder, exist_ok=True)
+        target = Path(folder) / path.name
+    extensions = target.name[len(path.stem):]
+    count = 1
+    while target.exists():
+        target = target.with_name(f"{path.stem}-{count}{extensions}")
+        count += 1
+    os.replace(path, target)
+    return target
+
+"""
+stop_on_sigterm
+
+Makes SIGTERM stop the process like Ctrl+C does, so a service manager can
+stop the watcher cleanly
+"""
+def stop_on_sigterm():
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, interrupt)